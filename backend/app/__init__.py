@@ -1,24 +1,100 @@
+"""
+app
+====================================
+Application factory.
+Extensions are created unbound here and bound in create_app(); the
+blueprints, models and the helper modules are imported there, so
+importing the package stays cheap. Flask-Migrate (and with it alembic)
+is only loaded for "flask" CLI runs and the deploy migration.
+"from app import app" still works: it returns the first application
+created in the process, creating one if necessary. The helper modules keep
+per-process state, so a process serves one application.
+"""
+import os
+
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
-from flask_bootstrap import Bootstrap
-from flask_compress import Compress
+from flask_socketio import SocketIO
 
 from .default_config import DefaultConfig
+from .db_routing import RoutingSession
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+socketio = SocketIO()
+
+_default = {'app': None, 'creating': False}
+
+
+def create_app(config=None):
+    """Build the application. config (object or mapping) is applied after
+    DefaultConfig and the TELESCHOCKEN_CONFIG_FILE, which is optional
+    only when config is given."""
+    app = Flask(__name__, static_folder='static', static_url_path='')
+    app.config.from_object(DefaultConfig)
+    app.config.from_envvar("TELESCHOCKEN_CONFIG_FILE", silent=config is not None)
+    if isinstance(config, dict):
+        app.config.update(config)
+    elif config is not None:
+        app.config.from_object(config)
+
+    from flask_bootstrap import Bootstrap
+    from flask_compress import Compress
+    from app import metrics, db_pool, db_routing
+
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = db_pool.engine_options(app.config)
+    db_routing.configure(app)
+    db.init_app(app)
+    # Set SOCKETIO_ASYNC_MODE to "threading", "eventlet" or "gevent" to test
+    # the different async modes
+    socketio.init_app(app, async_mode=app.config.get('SOCKETIO_ASYNC_MODE', 'gevent'),
+                      cors_allowed_origins="*", json=metrics.EmitSizeJSON)
+    Compress(app)
+    Bootstrap(app)
+    if os.environ.get('FLASK_RUN_FROM_CLI') == 'true':
+        init_migrate(app)
+
+    from app import instrumentation, profiling, hub_monitor, jobs, stats_cache, \
+        audio_manifest, static_assets, template_cache, deploy, errors, sqlite_profile, \
+        rng, journal, game_counters, game_actor, models  # noqa: F401
+    instrumentation.init_app(app)
+    metrics.init_app(app)
+    profiling.init_app(app)
+    hub_monitor.init_app(app)
+    jobs.init_app(app)
+    stats_cache.init_app(app)
+    audio_manifest.init_app(app)
+    static_assets.init_app(app)
+    template_cache.init_app(app)
+    deploy.init_app(app)
+    db_pool.init_app(app)
+    db_routing.init_app(app)
+    sqlite_profile.init_app(app)
+    rng.init_app(app)
+    journal.init_app(app)
+    game_counters.init_app(app)
+    game_actor.init_app(app)
+    errors.init_app(app)
+
+    app.after_request(add_security_headers)
+
+    from app.api import bp as api_bp
+    app.register_blueprint(api_bp, url_prefix='/api')
+    from app.routes import bp as main_bp
+    app.register_blueprint(main_bp)
+    if _default['app'] is None:
+        _default['app'] = app
+    return app
 
-app = Flask(__name__, static_folder='static', static_url_path='')
-app.config.from_object(DefaultConfig)
-app.config.from_envvar("TELESCHOCKEN_CONFIG_FILE")
-db = SQLAlchemy(app)
-if app.config["SQLALCHEMY_DATABASE_URI"].startswith("sqlite"):
-    migrate = Migrate(app, db, render_as_batch=True)
-else:
-    migrate = Migrate(app, db, render_as_batch=False)
 
-Compress(app)
+def init_migrate(app):
+    """Bind Flask-Migrate (registers "flask db"); idempotent."""
+    if 'migrate' in app.extensions:
+        return
+    from flask_migrate import Migrate
+    render_as_batch = app.config["SQLALCHEMY_DATABASE_URI"].startswith("sqlite")
+    Migrate(app, db, render_as_batch=render_as_batch)
 
 
-@app.after_request
 def add_security_headers(response):
     response.headers['Strict-Transport-Security'] = 'max-age=31536000; includeSubDomains'
     response.headers['X-Frame-Options'] = 'DENY'
@@ -34,42 +110,17 @@ def add_security_headers(response):
     return response
 
 
-from app.api import bp as api_bp
-app.register_blueprint(api_bp, url_prefix='/api')
-
-from app import routes, models, errors
-bootstrap = Bootstrap(app)
-
-
-
-def create_app():
-    app = Flask(__name__, static_folder='static')
-    app.config.from_object(DefaultConfig)
-    app.config.from_envvar("TELESCHOCKEN_CONFIG_FILE")
-    db = SQLAlchemy(app)
-    if app.config["SQLALCHEMY_DATABASE_URI"].startswith("sqlite"):
-        migrate = Migrate(app, db, render_as_batch=True)
-    else:
-        migrate = Migrate(app, db, render_as_batch=False)
-    Compress(app)
-
-    @app.after_request
-    def add_security_headers(response):
-        response.headers['Strict-Transport-Security'] = 'max-age=31536000; includeSubDomains'
-        response.headers['X-Frame-Options'] = 'DENY'
-        response.headers['Cross-Origin-Opener-Policy'] = 'same-origin'
-        response.headers['Content-Security-Policy'] = (
-            "default-src 'self'; "
-            "script-src 'self' 'unsafe-inline'; "
-            "style-src 'self' 'unsafe-inline'; "
-            "img-src 'self' data: blob:; "
-            "connect-src 'self' ws: wss:; "
-            "font-src 'self'"
-        )
-        return response
-
-    from app.api import bp as api_bp
-    app.register_blueprint(api_bp, url_prefix='/api')
-    from app import routes, models, errors
-    bootstrap = Bootstrap(app)
-    return app
+def __getattr__(name):
+    # Module level "app": the default application, built on first access
+    if name != 'app':
+        raise AttributeError("module 'app' has no attribute {!r}".format(name))
+    if _default['app'] is None:
+        if _default['creating']:
+            raise ImportError('"from app import app" while the app is being '
+                              'created; use flask.current_app')
+        _default['creating'] = True
+        try:
+            _default['app'] = create_app()
+        finally:
+            _default['creating'] = False
+    return _default['app']
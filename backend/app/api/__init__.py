@@ -1,5 +1,7 @@
 from flask import Blueprint
 
-bp = Blueprint('api', __name__)
+# cli_group=None: "flask create-statistics" stays a top-level command
+bp = Blueprint('api', __name__, cli_group=None)
 
-from app.api import game_endpoints, admin_endpoints, errors, statistic, protocol_endpoints
+from app.api import game_endpoints, admin_endpoints, errors, statistic, protocol_endpoints, \
+    monitoring_endpoints
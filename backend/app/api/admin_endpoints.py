@@ -1,12 +1,9 @@
 from app.api import bp
-from app import db
-
-from flask_socketio import emit
+from app import db, rng, game_counters, game_actor
 
 from flask import jsonify
 from flask import request
 from app.models import User, Game, Status
-from random import choice
 from jinja2 import utils
 
 import json
@@ -41,6 +38,7 @@ def _handle_round_end(game, loser):
     Called when the loser (userB) has received chips.
     Sets game status, resets users, returns message string.
     """
+    game_counters.apply(game)
     message = 'OK'
 
     if loser.chips == game.stack_max:
@@ -144,7 +142,7 @@ def execute_deferred_actions(game):
             remaining = [u for u in game.users
                          if not u.leave_after_game]
             if remaining:
-                loser_id = choice(remaining).id
+                loser_id = rng.for_game(game).choice(remaining).id
         db.session.delete(user)
 
     # 2b. Assign turn_order to newly activated players: append them at
@@ -205,6 +203,7 @@ def _cleanup_old_games(app):
     from dateutil.relativedelta import relativedelta
     with app.app_context():
         try:
+            game_counters.flush()
             one_day = datetime.now() + relativedelta(days=-1)
             old_games = db.session.query(Game).filter(Game.refreshed <= one_day).all()
             for old_game in old_games:
@@ -263,6 +262,7 @@ def create_Game():
 
 # Start the Game
 @bp.route('/game/<gid>/start', methods=['POST'])
+@game_actor.command
 def start_game(gid):
     """The Admin can use this route to start the game with a selected ruleset."""
     data = request.get_json() or {}
@@ -303,7 +303,7 @@ def start_game(gid):
     if game.first_user_id and any(u.id == game.first_user_id for u in active):
         game.move_user_id = game.first_user_id
     else:
-        starter = choice(active)
+        starter = rng.for_game(game).choice(active)
         game.first_user_id = starter.id
         game.move_user_id = starter.id
 
@@ -334,12 +334,13 @@ def start_game(gid):
     game.player_changes_allowed = True
     db.session.add(game)
     db.session.commit()
-    emit('reload_game', game.to_dict(), room=gid, namespace='/game')
+    game_actor.broadcast_game(game)
     return jsonify(Message='Hat geklappt!'), 201
 
 
 # Distribute chips (server-side scoring)
 @bp.route('/game/<gid>/distribute', methods=['POST'])
+@game_actor.command
 def distribute_chips(gid):
     """Calculate scoring and distribute chips automatically based on rules."""
     game = Game.query.filter_by(UUID=gid).first()
@@ -413,12 +414,13 @@ def distribute_chips(gid):
 
     db.session.add(game)
     db.session.commit()
-    emit('reload_game', game.to_dict(), room=gid, namespace='/game')
+    game_actor.broadcast_game(game)
     return jsonify(Message=message), 200
 
 
 # Manual transfer chips (admin only, kept as "Manuelle Korrektur")
 @bp.route('/game/<gid>/user/chips', methods=['POST'])
+@game_actor.command
 def transfer_chips(gid):
     """Manual chip transfer by admin."""
     game = Game.query.filter_by(UUID=gid).first()
@@ -532,12 +534,13 @@ def transfer_chips(gid):
     db.session.add(game)
     db.session.commit()
     response.status_code = 200
-    emit('reload_game', game.to_dict(), room=gid, namespace='/game')
+    game_actor.broadcast_game(game)
     return response
 
 
 # Toggle admin status for a user
 @bp.route('/game/<gid>/user/<uid>/toggle_admin', methods=['POST'])
+@game_actor.command
 def toggle_admin(gid, uid):
     """Promote or demote a user to/from admin. Requester must be admin."""
     game = Game.query.filter_by(UUID=gid).first()
@@ -572,12 +575,13 @@ def toggle_admin(gid, uid):
 
     db.session.add(game)
     db.session.commit()
-    emit('reload_game', game.to_dict(), room=gid, namespace='/game')
+    game_actor.broadcast_game(game)
     return jsonify(Message='Hat geklappt!'), 200
 
 
 # Mark/unmark player for leaving after current game
 @bp.route('/game/<gid>/user/<uid>/mark_leave', methods=['POST'])
+@game_actor.command
 def mark_leave_after_game(gid, uid):
     """Toggle leave_after_game for a user. Own user or admin can do this."""
     game = Game.query.filter_by(UUID=gid).first()
@@ -622,7 +626,7 @@ def mark_leave_after_game(gid, uid):
                 remaining = [u for u in game.users
                              if u.id != target_user.id]
                 if remaining:
-                    new_starter = choice(remaining)
+                    new_starter = rng.for_game(game).choice(remaining)
                     if target_user.id == game.first_user_id:
                         game.first_user_id = new_starter.id
                     if target_user.id == game.move_user_id:
@@ -632,12 +636,12 @@ def mark_leave_after_game(gid, uid):
             db.session.delete(target_user)
             db.session.add(game)
             db.session.commit()
-            emit('reload_game', game.to_dict(), room=gid, namespace='/game')
+            game_actor.broadcast_game(game)
             return jsonify(Message='Spieler entfernt'), 200
 
     db.session.add(game)
     db.session.commit()
-    emit('reload_game', game.to_dict(), room=gid, namespace='/game')
+    game_actor.broadcast_game(game)
 
     if new_state:
         return jsonify(Message='{} wird nach dem Spiel entfernt'.format(target_user.name)), 200
@@ -647,6 +651,7 @@ def mark_leave_after_game(gid, uid):
 
 # Toggle lobby-after-game flag
 @bp.route('/game/<gid>/mark_lobby', methods=['POST'])
+@game_actor.command
 def mark_lobby_after_game(gid):
     """Toggle lobby_after_game. Admin only."""
     game = Game.query.filter_by(UUID=gid).first()
@@ -661,7 +666,7 @@ def mark_lobby_after_game(gid):
     game.lobby_after_game = not game.lobby_after_game
     db.session.add(game)
     db.session.commit()
-    emit('reload_game', game.to_dict(), room=gid, namespace='/game')
+    game_actor.broadcast_game(game)
 
     if game.lobby_after_game:
         return jsonify(Message='Nach dem Spiel zurück zur Lobby'), 200
@@ -671,6 +676,7 @@ def mark_lobby_after_game(gid):
 
 # XHR Delete User from Game (admin only)
 @bp.route('/game/<gid>/user/<uid>', methods=['DELETE'])
+@game_actor.command
 def delete_player(gid, uid):
     game = Game.query.filter_by(UUID=gid).first()
     delete_user = User.query.get_or_404(uid)
@@ -689,7 +695,7 @@ def delete_player(gid, uid):
         # Starter was removed — pick a random replacement
         remaining = [u for u in game.users if u.id != delete_user.id]
         if remaining:
-            game.first_user_id = choice(remaining).id
+            game.first_user_id = rng.for_game(game).choice(remaining).id
 
     # Game resets after removal, so the starter begins the new round
     game.move_user_id = game.first_user_id
@@ -711,12 +717,13 @@ def delete_player(gid, uid):
 
     db.session.add(game)
     db.session.commit()
-    emit('reload_game', game.to_dict(), room=gid, namespace='/game')
+    game_actor.broadcast_game(game)
     return jsonify(Message='success'), 200
 
 
 # XHR choose new admin (legacy endpoint, now uses toggle_admin internally)
 @bp.route('/game/<gid>/user/<uid>/change_admin', methods=['POST'])
+@game_actor.command
 def choose_admin(gid, uid):
     """Legacy endpoint: promote another user to admin."""
     game = Game.query.filter_by(UUID=gid).first()
@@ -742,12 +749,13 @@ def choose_admin(gid, uid):
     game.message = "{} ist jetzt auch Admin".format(new_admin.name)
     db.session.add(game)
     db.session.commit()
-    emit('reload_game', game.to_dict(), room=gid, namespace='/game')
+    game_actor.broadcast_game(game)
     return jsonify(Message='Hat geklappt!'), 200
 
 
 # back to waiting
 @bp.route('/game/<gid>/back', methods=['POST'])
+@game_actor.command
 def wait_game(gid):
     """The Admin can use this route to put the game back to the waiting area."""
     game = Game.query.filter_by(UUID=gid).first()
@@ -773,5 +781,5 @@ def wait_game(gid):
     game.player_changes_allowed = True
     db.session.add(game)
     db.session.commit()
-    emit('reload_game', game.to_dict(), room=gid, namespace='/game')
+    game_actor.broadcast_game(game)
     return jsonify(Message='success'), 201
@@ -1,28 +1,22 @@
 from app.api import bp
-from app import app, db
+from app import db, socketio
 
 from flask_socketio import emit, join_room
 from flask import jsonify
-from flask import request, url_for
-from app.models import User, Game, Status, NickMapping, Person
-from random import randint, random, seed
-from datetime import datetime
+from flask import request
+from app.models import User, Game, Status
 from jinja2 import utils
-import os
+import hashlib
+import json
 
 from app.api.errors import bad_request
+from app.instrumentation import instrument_socket_event
+from app import metrics, mapping_service, audio_manifest, rng, game_counters, game_actor
 from sqlalchemy.exc import IntegrityError
 
 
 from flask import session
 
-from flask_socketio import SocketIO
-# Set this variable to "threading", "eventlet" or "gevent" to test the
-# different async modes, or leave it set to None for the application to choose
-# the best option based on installed packages.
-async_mode = "gevent"
-socketio = SocketIO(app, async_mode=async_mode, cors_allowed_origins="*")
-
 
 # Get User from Game
 def get_Index_Of_User(game, uid):
@@ -64,11 +58,28 @@ def _get_next_active_user(game, current_index):
 
 
 @socketio.on('connect', namespace='/game')
+@instrument_socket_event('connect')
 def test_connect():
+    metrics.SOCKET_CLIENTS.inc()
     emit('my_response', {'data': 'Connected', 'count': 0})
 
 
+@socketio.on('disconnect', namespace='/game')
+@instrument_socket_event('disconnect')
+def test_disconnect():
+    metrics.SOCKET_CLIENTS.dec()
+
+
+@metrics.collector
+def _count_rooms():
+    rooms = socketio.server.manager.rooms.get('/game', {})
+    # Every client also sits in the None room and in a room named by its sid
+    sids = rooms.get(None, {})
+    metrics.SOCKET_ROOMS.set(len([r for r in rooms if r is not None and r not in sids]))
+
+
 @socketio.on('join', namespace='/game')
+@instrument_socket_event('join')
 def join(message):
     join_room(message['room'])
     session['receive_count'] = session.get('receive_count', 0) + 1
@@ -78,15 +89,52 @@ def join(message):
         emit('reload_game', game.to_dict(), room=game.UUID, namespace='/game')
 
 
+def state_version(data):
+    """Content hash of a serialized game state."""
+    return hashlib.sha1(json.dumps(data, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+
+def my_dice(user):
+    """The private dice of a player, including the ones still in the cup."""
+    return {
+        'dice1': user.dice1 or 0,
+        'dice2': user.dice2 or 0,
+        'dice3': user.dice3 or 0,
+        'number_dice': user.number_dice,
+        'dice1_visible': user.dice1_visible or False,
+        'dice2_visible': user.dice2_visible or False,
+        'dice3_visible': user.dice3_visible or False,
+    }
+
+
+def game_snapshot(game, uid=None):
+    """Initial state embedded in the game pages: the game with its
+    State_Version and, if uid is a player of the game, that player's dice."""
+    data = game.to_dict()
+    data['State_Version'] = state_version(data)
+    snapshot = {'Game': data, 'My_Id': None, 'My_Dice': None}
+    try:
+        user_index = get_Index_Of_User(game, uid) if uid else -1
+    except ValueError:
+        user_index = -1
+    if user_index >= 0:
+        user = game.users[user_index]
+        snapshot['My_Id'] = user.id
+        snapshot['My_Dice'] = my_dice(user)
+    return snapshot
+
+
 # get Game Data
 @bp.route('/game/<gid>', methods=['GET'])
 def get_game(gid):
     """**GET   /api/game/<gid>**
 
-    Return a hole game as json
+    Return a hole game as json. The ETag is the State_Version of the
+    embedded page snapshot, so pages can revalidate it cheaply.
 
     :reqheader Accept: application/json
     :statuscode 200: Game Data
+    :statuscode 304: Game unchanged (If-None-Match)
     :statuscode 404: Game id not in Database
     """
     game = Game.query.filter_by(UUID=gid).first()
@@ -94,13 +142,16 @@ def get_game(gid):
         response = jsonify(Message='Spiel ist nicht in der Datenbank')
         response.status_code = 404
         return response
-    response = jsonify(game.to_dict())
+    data = game.to_dict()
+    response = jsonify(data)
     response.status_code = 200
-    return response
+    response.set_etag(state_version(data))
+    return response.make_conditional(request)
 
 
 # set User to Game (supports mid-game joining)
 @bp.route('/game/<gid>/user', methods=['POST'])
+@game_actor.command
 def set_game_user(gid):
     """Add a User to a game. Supports joining during WAITING (immediate),
     during active game (pending if someone rolled, immediate if not),
@@ -136,7 +187,7 @@ def set_game_user(gid):
                 existing.pending_join = True
             db.session.add(existing)
             db.session.commit()
-            emit('reload_game', game.to_dict(), room=gid, namespace='/game')
+            game_actor.broadcast_game(game)
             return jsonify(game.to_dict())
         else:
             response = jsonify(Message='Benutzername in diesem Spiel schon vergeben!')
@@ -162,7 +213,7 @@ def set_game_user(gid):
         response = jsonify(Message='Benutzername in diesem Spiel schon vergeben!')
         response.status_code = 400
         return response
-    emit('reload_game', game.to_dict(), room=gid, namespace='/game')
+    game_actor.broadcast_game(game)
     return jsonify(game.to_dict())
 
 
@@ -177,20 +228,13 @@ def get_my_dice(gid, uid):
     if user_index < 0:
         return jsonify(Message='Spieler nicht gefunden'), 404
     user = game.users[user_index]
-    return jsonify(
-        dice1=user.dice1 or 0,
-        dice2=user.dice2 or 0,
-        dice3=user.dice3 or 0,
-        number_dice=user.number_dice,
-        dice1_visible=user.dice1_visible or False,
-        dice2_visible=user.dice2_visible or False,
-        dice3_visible=user.dice3_visible or False
-    ), 200
+    return jsonify(my_dice(user)), 200
 
 
 # pull up the dice cup
 # A3 fix: added leading /
 @bp.route('/game/<gid>/user/<uid>/visible', methods=['POST'])
+@game_actor.command
 def pull_up_dice_cup(gid, uid):
     """
     Pull the Dice cup up so that every user can see the dice's
@@ -249,12 +293,13 @@ def pull_up_dice_cup(gid, uid):
     db.session.commit()
     response = jsonify(Message='Hat geklappt!')
     response.status_code = 201
-    emit('reload_game', game.to_dict(), room=gid, namespace='/game')
+    game_actor.broadcast_game(game)
     return response
 
 
 # user finishes before third roll
 @bp.route('/game/<gid>/user/<uid>/finisch', methods=['POST'])
+@game_actor.command
 def finish_throwing(gid, uid):
     game = Game.query.filter_by(UUID=gid).first()
     if game is None:
@@ -297,7 +342,7 @@ def finish_throwing(gid, uid):
         db.session.commit()
         response = jsonify(Message='Hat geklappt!')
         response.status_code = 200
-        emit('reload_game', game.to_dict(), room=gid, namespace='/game')
+        game_actor.broadcast_game(game)
         return response
     else:
         response = jsonify(Message='Du bist nicht dran!')
@@ -307,6 +352,7 @@ def finish_throwing(gid, uid):
 
 # set user aktiv or passiv
 @bp.route('/game/<gid>/user/<uid>/passiv', methods=['POST'])
+@game_actor.command
 def set_user_passiv(gid, uid):
     game = Game.query.filter_by(UUID=gid).first()
     if game is None:
@@ -370,7 +416,7 @@ def set_user_passiv(gid, uid):
                 popup_msg = 'Pausierversuch trotz {}. Dafür musst Du Dich {} mal Einwürfeln'.format(
                     penalty_reason, user.penalty_count)
 
-                emit('reload_game', game.to_dict(), room=gid, namespace='/game')
+                game_actor.broadcast_game(game)
                 response = jsonify(Message=popup_msg, Penalty=True, Penalty_Count=user.penalty_count)
                 response.status_code = 400
                 return response
@@ -398,7 +444,7 @@ def set_user_passiv(gid, uid):
         db.session.commit()
         response = jsonify(Message='Hat geklappt!')
         response.status_code = 201
-        emit('reload_game', game.to_dict(), room=gid, namespace='/game')
+        game_actor.broadcast_game(game)
         return response
     else:
         response = jsonify(Message="Request must include userstate")
@@ -408,6 +454,7 @@ def set_user_passiv(gid, uid):
 
 # roll dice
 @bp.route('/game/<gid>/user/<uid>/dice', methods=['POST'])
+@game_actor.command
 def roll_dice(gid, uid):
     """A user can roll up to 3 dice."""
     game = Game.query.filter_by(UUID=gid).first()
@@ -451,7 +498,7 @@ def roll_dice(gid, uid):
             and game.status != Status.PLAYFINAL):
         user.penalty_count = user.penalty_count - 1
 
-    game.refreshed = datetime.now()
+    game_counters.touch(game)
     if user.id == game.move_user_id:
         if game.first_user_id == user.id or user.number_dice < first_user_dice:
             if user.number_dice >= 3:
@@ -459,7 +506,8 @@ def roll_dice(gid, uid):
                 response.status_code = 400
                 return response
             # Check if a dice fall from the table and return if so
-            fallen = decision(game.chance_of_falling_dice)
+            dice = rng.for_game(game)
+            fallen = decision(game.chance_of_falling_dice, dice)
             if fallen:
                 game.message = "Hoppla, {} ist ein Würfel vom Tisch gefallen!".format(user.name)
                 game.falling_dice_count = game.falling_dice_count + 1
@@ -467,7 +515,7 @@ def roll_dice(gid, uid):
                 db.session.commit()
                 response = jsonify(fallen=fallen, dice1=user.dice1, dice2=user.dice2, dice3=user.dice3, number_dice=user.number_dice)
                 response.status_code = 201
-                emit('reload_game', game.to_dict(), room=gid, namespace='/game')
+                game_actor.broadcast_game(game)
                 return response
             user.number_dice = user.number_dice + 1
             # Check if this was the last roll for this user
@@ -483,19 +531,18 @@ def roll_dice(gid, uid):
                 if game.move_user_id == -1:
                     game.message = "Aufdecken!"
 
-            seed()
             if 'dice1' in data and str(utils.escape(data['dice1'])).lower() in ['true', '1']:
-                user.dice1 = randint(1, 6)
+                user.dice1 = dice.randint(1, 6)
                 user.dice1_visible = False
             else:
                 user.dice1_visible = True
             if 'dice2' in data and str(utils.escape(data['dice2'])).lower() in ['true', '1']:
-                user.dice2 = randint(1, 6)
+                user.dice2 = dice.randint(1, 6)
                 user.dice2_visible = False
             else:
                 user.dice2_visible = True
             if 'dice3' in data and str(utils.escape(data['dice3'])).lower() in ['true', '1']:
-                user.dice3 = randint(1, 6)
+                user.dice3 = dice.randint(1, 6)
                 user.dice3_visible = False
             else:
                 user.dice3_visible = True
@@ -504,10 +551,12 @@ def roll_dice(gid, uid):
             response.status_code = 400
             return response
 
-        # Statistic
-        if user.dice1 == 1 and user.dice2 == 1 and user.dice3 == 1:
-            game.schockoutcount = game.schockoutcount + 1
-        game.throw_dice_count = game.throw_dice_count + 1
+        metrics.DICE_ROLLS.inc()
+
+        # Statistic (written in batches, with the round end at the latest)
+        game_counters.count_roll(game, user.dice1 == 1 and user.dice2 == 1 and user.dice3 == 1)
+        if game.move_user_id == -1:
+            game_counters.apply(game)
 
         # D1: Single commit instead of multiple
         db.session.add(game)
@@ -525,7 +574,7 @@ def roll_dice(gid, uid):
             resp_dice3 = user.dice3
         response = jsonify(fallen=fallen, dice1=resp_dice1, dice2=resp_dice2, dice3=resp_dice3, number_dice=user.number_dice)
         response.status_code = 201
-        emit('reload_game', game.to_dict(), room=gid, namespace='/game')
+        game_actor.broadcast_game(game)
         return response
     else:
         response = jsonify(Message='Du bist nicht dran!')
@@ -535,6 +584,7 @@ def roll_dice(gid, uid):
 
 # turn dice (2 or 3 6er to 1 or 2 1er)
 @bp.route('/game/<gid>/user/<uid>/diceturn', methods=['POST'])
+@game_actor.command
 def turn_dice(gid, uid):
     """If a User Throws two or three 6er in Throw 1 or 2 they are allowed
     to turn 1 dice (two 6er) or 2 dice (three 6er) to dice with the number 1
@@ -609,12 +659,13 @@ def turn_dice(gid, uid):
     db.session.add(user)
     db.session.commit()
     # D2: Add reload_game emit after diceturn
-    emit('reload_game', game.to_dict(), room=gid, namespace='/game')
+    game_actor.broadcast_game(game)
     return response
 
 
 # undo a diceturn (revert 1->6, optionally restore None->6)
 @bp.route('/game/<gid>/user/<uid>/diceturn_undo', methods=['POST'])
+@game_actor.command
 def undo_turn_dice(gid, uid):
     game = Game.query.filter_by(UUID=gid).first()
     if game is None:
@@ -653,12 +704,13 @@ def undo_turn_dice(gid, uid):
     user.dice1, user.dice2, user.dice3 = dice_vals
     db.session.add(user)
     db.session.commit()
-    emit('reload_game', game.to_dict(), room=gid, namespace='/game')
+    game_actor.broadcast_game(game)
     return jsonify(dice1=user.dice1, dice2=user.dice2, dice3=user.dice3), 201
 
 
 # XHR Route: sort dice for visual comparison
 @bp.route('/game/<gid>/sort', methods=['PUT'])
+@game_actor.command
 def sort_dice(gid):
     data = request.get_json() or {}
     if 'admin_id' in data:
@@ -689,7 +741,7 @@ def sort_dice(gid):
                     u.dice3 = dices[0]
             db.session.add(game)
             db.session.commit()
-            emit('reload_game', game.to_dict(), room=gid, namespace='/game')
+            game_actor.broadcast_game(game)
         else:
             response = jsonify(Message='Warten bis alle aufgedeckt haben!')
             response.status_code = 403
@@ -703,6 +755,7 @@ def sort_dice(gid):
 
 # Vote to reveal all dice
 @bp.route('/game/<gid>/vote_reveal', methods=['POST'])
+@game_actor.command
 def vote_reveal_all(gid):
     """Vote to force-reveal all dice. Admin triggers immediately,
     otherwise need strict majority (>50%) of active non-passive players.
@@ -759,44 +812,30 @@ def vote_reveal_all(gid):
         db.session.add(game)
         db.session.commit()
 
-    emit('reload_game', game.to_dict(), room=gid, namespace='/game')
+    game_actor.broadcast_game(game)
     return jsonify(Message='Stimme gezählt'), 200
 
 
 # ============= Personalized Sound URLs =============
 
-SOUND_NAMES = ['rolling_dice', 'roll_now', 'lift_cup']
-
 @bp.route('/sounds', methods=['GET'])
 def get_sound_urls():
     """Return sound URLs for a nick, using person-specific files if available."""
     nick = request.args.get('nick', '').strip()
-    audio_dir = os.path.join(app.static_folder, 'audio')
     person_name = None
 
     if nick:
-        nm = NickMapping.query.filter_by(nick=nick).first()
-        if nm:
-            person = Person.query.get(nm.person_id)
-            if person:
-                person_name = person.name
-
-    urls = {}
-    for sound in SOUND_NAMES:
-        if person_name:
-            personal_file = f'{sound}_{person_name}.mp3'
-            if os.path.isfile(os.path.join(audio_dir, personal_file)):
-                urls[sound] = url_for('static', filename=f'audio/{personal_file}')
-                continue
-        urls[sound] = url_for('static', filename=f'audio/{sound}.mp3')
+        person = mapping_service.resolve_nick(nick)
+        if person:
+            person_name = person[1]
 
-    return jsonify(urls), 200
+    return jsonify(audio_manifest.sound_urls(person_name)), 200
 
 
 # to fall a dice from the tableCount
 # the chance increases each round
-def decision(probability) -> bool:
+def decision(probability, dice) -> bool:
     """
     Return a Boolean that represent a fallen dice
     """
-    return random() < probability
+    return dice.random() < probability
@@ -0,0 +1,81 @@
+"""
+monitoring_endpoints.py
+====================================
+Operational endpoints for the protokoll admins: aggregated SQL
+statement counts and timings per endpoint and Socket.IO event, the
+on-demand request profiler and the gevent hub blocking reports.
+"""
+from app.api import bp
+from app import instrumentation, profiling, hub_monitor
+from app.api.protocol_endpoints import _check_protokoll_auth, _auth_error
+
+from flask import jsonify, request, send_file
+
+
+# --------------- Query statistics ---------------
+
+@bp.route('/protokoll/query_stats', methods=['GET'])
+def query_stats():
+    if not _check_protokoll_auth():
+        return _auth_error()
+    return jsonify(instrumentation.get_stats()), 200
+
+
+@bp.route('/protokoll/query_stats', methods=['DELETE'])
+def reset_query_stats():
+    if not _check_protokoll_auth():
+        return _auth_error()
+    instrumentation.reset_stats()
+    return jsonify(Message='OK'), 200
+
+
+# --------------- Hub blocking ---------------
+
+@bp.route('/protokoll/hub_blocks', methods=['GET'])
+def hub_blocks():
+    if not _check_protokoll_auth():
+        return _auth_error()
+    return jsonify(hub_monitor.recent_blocks()), 200
+
+
+# --------------- Profiler ---------------
+
+@bp.route('/protokoll/profiler', methods=['GET'])
+def get_profiler():
+    if not _check_protokoll_auth():
+        return _auth_error()
+    return jsonify(settings=profiling.get_settings(),
+                   profiles=profiling.list_profiles()), 200
+
+
+@bp.route('/protokoll/profiler', methods=['PUT'])
+def update_profiler():
+    """Switch profiling on/off. Body: {enabled, endpoints, sample_rate}.
+    endpoints are endpoint names (e.g. "api.distribute_chips") or paths."""
+    if not _check_protokoll_auth():
+        return _auth_error()
+    data = request.get_json() or {}
+    try:
+        settings = profiling.save_settings(data)
+    except (TypeError, ValueError):
+        return jsonify(Message='Ungültige Profiler-Einstellungen'), 400
+    return jsonify(settings=settings), 200
+
+
+@bp.route('/protokoll/profiles/<name>', methods=['GET'])
+def download_profile(name):
+    if not _check_protokoll_auth():
+        return _auth_error()
+    path = profiling.profile_path(name)
+    if path is None:
+        return jsonify(Message='Profil nicht gefunden'), 404
+    return send_file(path, mimetype='application/octet-stream',
+                     as_attachment=True, download_name=name)
+
+
+@bp.route('/protokoll/profiles', methods=['DELETE'])
+def delete_profiles():
+    if not _check_protokoll_auth():
+        return _auth_error()
+    profiling.clear_profiles()
+    return jsonify(Message='OK'), 200
@@ -6,19 +6,21 @@ Handles person management, nick-to-person mapping, statistics,
 CSV import/export, and data deletion.
 """
 from app.api import bp
-from app import db, app
+from app import db, jobs, stats_cache, mapping_service, preferences, db_routing
 
-from flask import jsonify, request, session, Response
+from flask import current_app, jsonify, request, session, Response, make_response
 from app.models import (Person, GameLog, GameLogPlayer, NickMapping)
 
-import csv
 import io
 import json
 import re
 from datetime import datetime
-import pytz
 
-BERLIN_TZ = pytz.timezone('Europe/Berlin')
+
+def _berlin_tz():
+    # pytz is only needed by the few endpoints that write timestamps
+    import pytz
+    return pytz.timezone('Europe/Berlin')
 
 
 def _check_protokoll_auth():
@@ -35,7 +37,7 @@ def _auth_error():
 def protokoll_auth():
     data = request.get_json() or {}
     password = data.get('password', '')
-    configured = app.config.get('ADMIN_PASSWORD', '')
+    configured = current_app.config.get('ADMIN_PASSWORD', '')
     if not configured:
         return jsonify(Message='Kein Admin-Passwort konfiguriert'), 500
     if password == configured:
@@ -104,31 +106,101 @@ def update_person(pid):
 def delete_person(pid):
     if not _check_protokoll_auth():
         return _auth_error()
-    person = Person.query.get_or_404(pid)
+    Person.query.get_or_404(pid)
     # Find affected game logs before removing the person reference
-    affected_log_ids = db.session.query(GameLogPlayer.game_log_id).filter(
-        GameLogPlayer.person_id == pid).distinct().all()
-    affected_log_ids = [r[0] for r in affected_log_ids]
-    GameLogPlayer.query.filter_by(person_id=pid).update({'person_id': None})
-    NickMapping.query.filter_by(person_id=pid).delete()
-    if affected_log_ids:
-        GameLog.query.filter(GameLog.id.in_(affected_log_ids)).update(
-            {'mapping_complete': False}, synchronize_session='fetch')
-    db.session.delete(person)
+    affected_log_ids = [r[0] for r in db.session.query(
+        GameLogPlayer.game_log_id).filter(
+        GameLogPlayer.person_id == pid).distinct().all()]
+    GameLogPlayer.query.filter_by(person_id=pid).update(
+        {'person_id': None}, synchronize_session=False)
+    NickMapping.query.filter_by(person_id=pid).delete(synchronize_session=False)
+    mapping_service.recompute_mapping_complete(affected_log_ids)
+    Person.query.filter_by(id=pid).delete(synchronize_session=False)
     db.session.commit()
     return jsonify(Message='OK'), 200
 
 
+# --------------- Bulk helpers ---------------
+
+def _delete_log_chunk(log_ids):
+    """Delete the logs and their players with two statements."""
+    GameLogPlayer.query.filter(GameLogPlayer.game_log_id.in_(log_ids)).delete(
+        synchronize_session=False)
+    return GameLog.query.filter(GameLog.id.in_(log_ids)).delete(
+        synchronize_session=False)
+
+
 # --------------- Game Logs ---------------
 
+def _parse_games_cursor(cursor):
+    """Cursor format: "<game_date>_<id>", "_<id>" for logs without a date."""
+    date_str, _, id_str = cursor.rpartition('_')
+    game_date = datetime.strptime(date_str, '%Y-%m-%d').date() if date_str else None
+    return game_date, int(id_str)
+
+
+def _games_cursor(game):
+    return '{}_{}'.format(game['game_date'] or '', game['id'])
+
+
+def _load_game_list(query, limit=None):
+    """Logs of query with their players and person names in one projected
+    statement, newest first. With limit only that many logs are loaded."""
+    page = query.with_entities(GameLog.id).order_by(
+        GameLog.game_date.desc(), GameLog.id.desc())
+    if limit is not None:
+        page = page.limit(limit)
+    page = page.subquery()
+
+    rows = db.session.query(
+        GameLog.id, GameLog.game_uuid, GameLog.game_date,
+        GameLog.mapping_complete, GameLogPlayer.id, GameLogPlayer.nick,
+        GameLogPlayer.is_loser, GameLogPlayer.person_id, Person.name
+    ).join(page, page.c.id == GameLog.id).outerjoin(
+        GameLogPlayer, GameLogPlayer.game_log_id == GameLog.id
+    ).outerjoin(
+        Person, Person.id == GameLogPlayer.person_id
+    ).order_by(
+        GameLog.game_date.desc(), GameLog.id.desc(), GameLogPlayer.id
+    ).all()
+
+    result = []
+    for (log_id, game_uuid, game_date, complete,
+         player_id, nick, is_loser, person_id, person_name) in rows:
+        if not result or result[-1]['id'] != log_id:
+            result.append({
+                'id': log_id,
+                'game_uuid': game_uuid,
+                'game_date': game_date.isoformat() if game_date else None,
+                'mapping_complete': complete,
+                'players': []
+            })
+        if player_id is not None:
+            result[-1]['players'].append({
+                'id': player_id,
+                'nick': nick,
+                'is_loser': is_loser,
+                'person_id': person_id,
+                'person_name': person_name if person_id else None
+            })
+    return result
+
+
 @bp.route('/protokoll/games', methods=['GET'])
+@db_routing.read_replica
 def list_game_logs():
+    """Game logs, newest first, in pages of `limit` logs.
+    Returns {games, next_cursor}; pass next_cursor as `cursor` to get the
+    next page. With PROTOKOLL_GAMES_LEGACY or legacy=true (and no
+    limit/cursor) all logs are returned as a plain list as before."""
     if not _check_protokoll_auth():
         return _auth_error()
 
     incomplete_only = request.args.get('incomplete', 'false').lower() == 'true'
     date_from = request.args.get('date_from')
     date_to = request.args.get('date_to')
+    cursor = request.args.get('cursor')
+    limit = request.args.get('limit', type=int)
 
     query = GameLog.query
     if incomplete_only:
@@ -140,26 +212,35 @@ def list_game_logs():
         query = query.filter(
             GameLog.game_date <= datetime.strptime(date_to, '%Y-%m-%d').date())
 
-    games = query.order_by(GameLog.game_date.desc(), GameLog.id.desc()).all()
-    result = []
-    for game in games:
-        players = []
-        for p in game.players:
-            players.append({
-                'id': p.id,
-                'nick': p.nick,
-                'is_loser': p.is_loser,
-                'person_id': p.person_id,
-                'person_name': p.person.name if p.person_id and p.person else None
-            })
-        result.append({
-            'id': game.id,
-            'game_uuid': game.game_uuid,
-            'game_date': game.game_date.isoformat() if game.game_date else None,
-            'mapping_complete': game.mapping_complete,
-            'players': players
-        })
-    return jsonify(result), 200
+    legacy = request.args.get('legacy', 'false').lower() == 'true' or \
+        current_app.config.get('PROTOKOLL_GAMES_LEGACY', False)
+    if legacy and cursor is None and limit is None:
+        return jsonify(_load_game_list(query)), 200
+
+    max_limit = current_app.config.get('PROTOKOLL_GAMES_PAGE_SIZE', 200)
+    limit = min(max(limit or max_limit, 1), max_limit)
+
+    if cursor:
+        try:
+            cursor_date, cursor_id = _parse_games_cursor(cursor)
+        except ValueError:
+            return jsonify(Message='Ungültiger Cursor'), 400
+        # NULL dates sort last in descending order (MySQL, SQLite)
+        if cursor_date is None:
+            query = query.filter(GameLog.game_date.is_(None),
+                                 GameLog.id < cursor_id)
+        else:
+            query = query.filter(db.or_(
+                GameLog.game_date < cursor_date,
+                db.and_(GameLog.game_date == cursor_date, GameLog.id < cursor_id),
+                GameLog.game_date.is_(None)))
+
+    games = _load_game_list(query, limit + 1)
+    next_cursor = None
+    if len(games) > limit:
+        games = games[:limit]
+        next_cursor = _games_cursor(games[-1])
+    return jsonify(games=games, next_cursor=next_cursor), 200
 
 
 @bp.route('/protokoll/games/<int:gid>/mapping', methods=['PUT'])
@@ -172,21 +253,12 @@ def update_game_mapping(gid):
     # mappings: {player_id_str: person_id_int_or_null}
     mappings = data.get('mappings', {})
 
-    for player in game_log.players:
-        pid_str = str(player.id)
-        if pid_str in mappings:
-            person_id = mappings[pid_str]
-            player.person_id = person_id
-            if person_id:
-                existing = NickMapping.query.filter_by(nick=player.nick).first()
-                if existing:
-                    existing.person_id = person_id
-                else:
-                    nm = NickMapping(nick=player.nick, person_id=person_id)
-                    db.session.add(nm)
-
-    game_log.mapping_complete = all(
-        p.person_id is not None for p in game_log.players)
+    nick_mappings = {}
+    for player_id, nick in db.session.query(
+            GameLogPlayer.id, GameLogPlayer.nick).filter_by(game_log_id=gid):
+        if str(player_id) in mappings:
+            nick_mappings[nick] = mappings[str(player_id)]
+    mapping_service.apply_nick_mappings(nick_mappings, [gid])
 
     db.session.commit()
     return jsonify(Message='OK', mapping_complete=game_log.mapping_complete), 200
@@ -202,23 +274,30 @@ def delete_game_logs():
     date_from = data.get('date_from')
     date_to = data.get('date_to')
 
+    # Deleted in chunks with a commit each, so a whole year does not hold
+    # locks for the entire run
+    chunk = current_app.config.get('PROTOKOLL_DELETE_CHUNK', 500)
     deleted = 0
     if ids:
-        for gid in ids:
-            game_log = GameLog.query.get(gid)
-            if game_log:
-                db.session.delete(game_log)
-                deleted += 1
+        try:
+            ids = [int(gid) for gid in ids]
+        except (TypeError, ValueError):
+            return jsonify(Message='Ungültige IDs'), 400
+        for i in range(0, len(ids), chunk):
+            deleted += _delete_log_chunk(ids[i:i + chunk])
+            db.session.commit()
     elif date_from and date_to:
         df = datetime.strptime(date_from, '%Y-%m-%d').date()
         dt = datetime.strptime(date_to, '%Y-%m-%d').date()
-        logs = GameLog.query.filter(
-            GameLog.game_date >= df, GameLog.game_date <= dt).all()
-        for log in logs:
-            db.session.delete(log)
-            deleted += 1
+        query = GameLog.query.with_entities(GameLog.id).filter(
+            GameLog.game_date >= df, GameLog.game_date <= dt).order_by(GameLog.id)
+        while True:
+            log_ids = [r[0] for r in query.limit(chunk).all()]
+            if not log_ids:
+                break
+            deleted += _delete_log_chunk(log_ids)
+            db.session.commit()
 
-    db.session.commit()
     return jsonify(Message='{} Spiele gelöscht'.format(deleted)), 200
 
 
@@ -238,24 +317,8 @@ def update_mapping_by_date():
         return jsonify(Message='Datum fehlt'), 400
 
     game_date = datetime.strptime(date_str, '%Y-%m-%d').date()
-    game_logs = GameLog.query.filter_by(game_date=game_date).all()
-
-    for gl in game_logs:
-        for player in gl.players:
-            if player.nick in mappings:
-                person_id = mappings[player.nick]
-                player.person_id = person_id
-                if person_id:
-                    existing = NickMapping.query.filter_by(
-                        nick=player.nick).first()
-                    if existing:
-                        existing.person_id = person_id
-                    else:
-                        nm = NickMapping(nick=player.nick,
-                                         person_id=person_id)
-                        db.session.add(nm)
-        gl.mapping_complete = all(
-            p.person_id is not None for p in gl.players)
+    mapping_service.apply_nick_mappings(
+        mappings, db.select(GameLog.id).where(GameLog.game_date == game_date))
 
     db.session.commit()
     return jsonify(Message='OK'), 200
@@ -274,40 +337,54 @@ def list_nick_mappings():
     return jsonify(result), 200
 
 
-# --------------- Statistics ---------------
-
-@bp.route('/protokoll/statistics', methods=['GET'])
-def get_statistics():
-    if not _check_protokoll_auth():
-        return _auth_error()
-
-    date_from = request.args.get('date_from')
-    date_to = request.args.get('date_to')
-    person_id = request.args.get('person_id', type=int)
+# --------------- Plain row loading ---------------
+
+def _load_game_rows(query):
+    """Load the logs of a GameLog query with their players as plain dicts,
+    in two statements. The rows can be handed to jobs.offload()."""
+    logs = query.with_entities(
+        GameLog.id, GameLog.game_uuid, GameLog.game_date,
+        GameLog.created_at, GameLog.mapping_complete).all()
+    rows = []
+    by_id = {}
+    for log_id, game_uuid, game_date, created_at, complete in logs:
+        row = {'id': log_id, 'game_uuid': game_uuid, 'game_date': game_date,
+               'created_at': created_at, 'mapping_complete': complete,
+               'players': []}
+        rows.append(row)
+        by_id[log_id] = row
+    if rows:
+        ids = query.with_entities(GameLog.id).order_by(None).subquery()
+        players = db.session.query(
+            GameLogPlayer.game_log_id, GameLogPlayer.id, GameLogPlayer.nick,
+            GameLogPlayer.is_loser, GameLogPlayer.person_id
+        ).filter(GameLogPlayer.game_log_id.in_(db.select(ids.c.id))).order_by(
+            GameLogPlayer.id).all()
+        for log_id, player_id, nick, is_loser, pid in players:
+            by_id[log_id]['players'].append({
+                'id': player_id, 'nick': nick, 'is_loser': is_loser,
+                'person_id': pid})
+    return rows
+
+
+def _person_names():
+    return dict(db.session.query(Person.id, Person.name).all())
 
-    query = GameLog.query.filter_by(mapping_complete=True)
-    if date_from:
-        query = query.filter(
-            GameLog.game_date >= datetime.strptime(date_from, '%Y-%m-%d').date())
-    if date_to:
-        query = query.filter(
-            GameLog.game_date <= datetime.strptime(date_to, '%Y-%m-%d').date())
-    if person_id:
-        query = query.filter(
-            GameLog.players.any(GameLogPlayer.person_id == person_id))
 
-    games = query.order_by(GameLog.game_date, GameLog.id).all()
+# --------------- Statistics ---------------
 
+def _compute_statistics(games, person_map, person_id):
+    """Game days, results and beer sums for the given game rows (pure)."""
     # --- Game days ---
     game_days = {}
     for game in games:
-        day = game.game_date.isoformat()
+        day = game['game_date'].isoformat()
         if day not in game_days:
             game_days[day] = {'date': day, 'nicks': set(), 'mappings': {}}
-        for p in game.players:
-            game_days[day]['nicks'].add(p.nick)
-            if p.person:
-                game_days[day]['mappings'][p.nick] = p.person.name
+        for p in game['players']:
+            game_days[day]['nicks'].add(p['nick'])
+            if p['person_id'] in person_map:
+                game_days[day]['mappings'][p['nick']] = person_map[p['person_id']]
 
     game_days_list = []
     for day_data in sorted(game_days.values(), key=lambda d: d['date']):
@@ -319,15 +396,15 @@ def get_statistics():
     for game in games:
         loser = None
         winners = []
-        for p in game.players:
-            pname = p.person.name if p.person else p.nick
-            if p.is_loser:
+        for p in game['players']:
+            pname = person_map.get(p['person_id']) or p['nick']
+            if p['is_loser']:
                 loser = pname
             else:
                 winners.append(pname)
         game_results.append({
-            'id': game.id,
-            'date': game.game_date.strftime('%d.%m.%Y'),
+            'id': game['id'],
+            'date': game['game_date'].strftime('%d.%m.%Y'),
             'loser': loser,
             'winners': sorted(winners)
         })
@@ -339,13 +416,13 @@ def get_statistics():
     for game in games:
         loser_pid = None
         winner_pids = []
-        for p in game.players:
-            if p.person_id:
-                all_person_ids.add(p.person_id)
-            if p.is_loser:
-                loser_pid = p.person_id
+        for p in game['players']:
+            if p['person_id']:
+                all_person_ids.add(p['person_id'])
+            if p['is_loser']:
+                loser_pid = p['person_id']
             else:
-                winner_pids.append(p.person_id)
+                winner_pids.append(p['person_id'])
 
         if loser_pid is None:
             continue
@@ -360,25 +437,20 @@ def get_statistics():
             beer_data.setdefault(wpid, {}).setdefault(
                 loser_pid, {'gives': 0, 'gets': 0})['gets'] += 1
 
-    person_map = {}
-    for pid in all_person_ids:
-        person = Person.query.get(pid)
-        if person:
-            person_map[pid] = person.name
-
+    known = {pid: person_map[pid] for pid in all_person_ids if pid in person_map}
     target_persons = [person_id] if person_id else sorted(
-        all_person_ids, key=lambda p: person_map.get(p, ''))
+        all_person_ids, key=lambda p: known.get(p, ''))
 
     beer_summary = []
     for pid in target_persons:
-        if pid not in person_map:
+        if pid not in known:
             continue
         opponents = []
         for opp_id, counts in beer_data.get(pid, {}).items():
-            if opp_id not in person_map:
+            if opp_id not in known:
                 continue
             opponents.append({
-                'opponent': person_map[opp_id],
+                'opponent': known[opp_id],
                 'opponent_id': opp_id,
                 'gives': counts['gives'],
                 'gets': counts['gets'],
@@ -386,22 +458,54 @@ def get_statistics():
             })
         opponents.sort(key=lambda x: x['opponent'])
         beer_summary.append({
-            'person': person_map[pid],
+            'person': known[pid],
             'person_id': pid,
             'opponents': opponents
         })
 
-    return jsonify({
+    return {
         'game_days': game_days_list,
         'game_results': game_results,
         'beer_summary': beer_summary,
         'total_games': len(games)
-    }), 200
+    }
+
+
+@bp.route('/protokoll/statistics', methods=['GET'])
+@db_routing.read_replica
+def get_statistics():
+    if not _check_protokoll_auth():
+        return _auth_error()
+
+    date_from = request.args.get('date_from')
+    date_to = request.args.get('date_to')
+    person_id = request.args.get('person_id', type=int)
+
+    date_from = datetime.strptime(date_from, '%Y-%m-%d').date() if date_from else None
+    date_to = datetime.strptime(date_to, '%Y-%m-%d').date() if date_to else None
+    person_id = person_id or None
+
+    def compute():
+        query = GameLog.query.filter_by(mapping_complete=True)
+        if date_from:
+            query = query.filter(GameLog.game_date >= date_from)
+        if date_to:
+            query = query.filter(GameLog.game_date <= date_to)
+        if person_id:
+            query = query.filter(
+                GameLog.players.any(GameLogPlayer.person_id == person_id))
+
+        games = _load_game_rows(query.order_by(GameLog.game_date, GameLog.id))
+        return jobs.offload(_compute_statistics, games, _person_names(), person_id)
+
+    result = stats_cache.cached((date_from, date_to, person_id), compute)
+    return jsonify(result), 200
 
 
 # --------------- CSV Export ---------------
 
 @bp.route('/protokoll/export', methods=['GET'])
+@db_routing.read_replica
 def export_csv():
     if not _check_protokoll_auth():
         return _auth_error()
@@ -423,6 +527,7 @@ def export_csv():
 
     games = query.order_by(GameLog.game_date, GameLog.id).all()
 
+    import csv
     output = io.StringIO()
     writer = csv.writer(output, delimiter=';', quoting=csv.QUOTE_ALL)
 
@@ -438,7 +543,7 @@ def export_csv():
         row = [game.game_date.strftime('%Y%m%d'), loser] + sorted(winners)
         writer.writerow(row)
 
-    today_str = datetime.now(BERLIN_TZ).strftime('%Y%m%d')
+    today_str = datetime.now(_berlin_tz()).strftime('%Y%m%d')
     resp = Response(output.getvalue(), mimetype='text/csv')
     resp.headers['Content-Disposition'] = \
         'attachment; filename=schocken_protokoll_{}.csv'.format(today_str)
@@ -447,33 +552,22 @@ def export_csv():
 
 # --------------- CSV Import ---------------
 
-@bp.route('/protokoll/import', methods=['POST'])
-def import_csv():
-    if not _check_protokoll_auth():
-        return _auth_error()
+def _finish_import(new_logs, new_mappings):
+    """Insert the imported logs, add mappings for nicks that have none yet
+    and set mapping_complete of the new logs."""
+    db.session.flush()
+    mapping_service.upsert_nick_mappings(new_mappings, overwrite=False)
+    mapping_service.recompute_mapping_complete([gl.id for gl in new_logs])
 
-    data = request.get_json() or {}
-    csv_text = data.get('csv', '')
-    dry_run = data.get('dry_run', False)
-    create_persons_list = data.get('create_persons', [])
-
-    if not csv_text:
-        return jsonify(Message='Keine Daten'), 400
-
-    # Auto-create requested persons before import
-    if create_persons_list and not dry_run:
-        for pname in create_persons_list:
-            pname = pname.strip()
-            if pname and not Person.query.filter_by(name=pname).first():
-                db.session.add(Person(name=pname))
-        db.session.flush()
 
+def _parse_csv_import(csv_text):
+    """Parse the CSV export format (pure). Returns (entries, errors) where
+    entries are (game_date, loser, [winners]) tuples."""
+    import csv
     reader = csv.reader(io.StringIO(csv_text), delimiter=';',
                         quotechar='"', quoting=csv.QUOTE_ALL)
-    person_by_name = {p.name: p for p in Person.query.all()}
-    importable = 0
+    entries = []
     errors = []
-    unknown_names = set()
 
     for line_num, row in enumerate(reader, 1):
         if len(row) < 2:
@@ -501,6 +595,35 @@ def import_csv():
                            'error': 'Keine Gewinner angegeben'})
             continue
 
+        entries.append((game_date, loser_name, winner_names))
+    return entries, errors
+
+
+@jobs.job_type('import_csv')
+def _import_csv(data, progress=None):
+    csv_text = data.get('csv', '')
+    dry_run = data.get('dry_run', False)
+    create_persons_list = data.get('create_persons', [])
+
+    if not csv_text:
+        return {'Message': 'Keine Daten'}, 400
+
+    # Auto-create requested persons before import
+    if create_persons_list and not dry_run:
+        for pname in create_persons_list:
+            pname = pname.strip()
+            if pname and not Person.query.filter_by(name=pname).first():
+                db.session.add(Person(name=pname))
+        db.session.flush()
+
+    entries, errors = jobs.offload(_parse_csv_import, csv_text)
+    person_by_name = {p.name: p for p in Person.query.all()}
+    importable = 0
+    unknown_names = set()
+    new_mappings = {}
+    new_logs = []
+
+    for i, (game_date, loser_name, winner_names) in enumerate(entries):
         all_names = [loser_name] + winner_names
         for n in all_names:
             if n not in person_by_name:
@@ -530,27 +653,32 @@ def import_csv():
                 wp.person_id = person_by_name[wname].id
             game_log.players.append(wp)
 
-        game_log.mapping_complete = all(
-            p.person_id is not None for p in game_log.players)
-
         for p in game_log.players:
             if p.person_id:
-                existing_nm = NickMapping.query.filter_by(
-                    nick=p.nick).first()
-                if not existing_nm:
-                    nm = NickMapping(nick=p.nick, person_id=p.person_id)
-                    db.session.add(nm)
+                new_mappings.setdefault(p.nick, p.person_id)
 
         db.session.add(game_log)
+        new_logs.append(game_log)
         importable += 1
+        if progress is not None and i % 50 == 0:
+            progress(i / len(entries))
 
     if not dry_run:
+        _finish_import(new_logs, new_mappings)
         db.session.commit()
 
     msg = '{} Spiele importiert'.format(importable) if not dry_run \
         else '{} Spiele importierbar'.format(importable)
-    return jsonify(Message=msg, imported=importable, errors=errors,
-                   unknown_persons=sorted(unknown_names)), 200
+    return {'Message': msg, 'imported': importable, 'errors': errors,
+            'unknown_persons': sorted(unknown_names)}, 200
+
+
+@bp.route('/protokoll/import', methods=['POST'])
+def import_csv():
+    if not _check_protokoll_auth():
+        return _auth_error()
+    result, status = _import_csv(request.get_json() or {})
+    return jsonify(result), status
 
 
 # --------------- Markdown Import ---------------
@@ -626,20 +754,16 @@ def _parse_md_import(text):
     return results, errors
 
 
-@bp.route('/protokoll/import_md', methods=['POST'])
-def import_md():
-    if not _check_protokoll_auth():
-        return _auth_error()
-
-    data = request.get_json() or {}
+@jobs.job_type('import_md')
+def _import_md(data, progress=None):
     text = data.get('text', '')
     dry_run = data.get('dry_run', False)
     create_persons_list = data.get('create_persons', [])
 
     if not text:
-        return jsonify(Message='Keine Daten'), 400
+        return {'Message': 'Keine Daten'}, 400
 
-    results, parse_errors = _parse_md_import(text)
+    results, parse_errors = jobs.offload(_parse_md_import, text)
     error_list = [{'line': e[0], 'text': e[1], 'error': e[2]}
                   for e in parse_errors]
 
@@ -656,9 +780,9 @@ def import_md():
     if dry_run or (not results and parse_errors):
         msg = '{} Spiele importierbar'.format(importable) if results \
             else 'Keine Spiele erkannt'
-        return jsonify(Message=msg, imported=importable,
-                       errors=error_list,
-                       unknown_persons=sorted(unknown_names)), 200
+        return {'Message': msg, 'imported': importable,
+                'errors': error_list,
+                'unknown_persons': sorted(unknown_names)}, 200
 
     # Auto-create requested persons before import
     if create_persons_list:
@@ -670,6 +794,8 @@ def import_md():
         person_by_name = {p.name: p for p in Person.query.all()}
 
     imported = 0
+    new_mappings = {}
+    new_logs = []
 
     for game_date, loser, count, winners in results:
         for _ in range(count):
@@ -693,80 +819,94 @@ def import_md():
                     wp.person_id = person_by_name[wname].id
                 game_log.players.append(wp)
 
-            game_log.mapping_complete = all(
-                p.person_id is not None for p in game_log.players)
-
             for p in game_log.players:
                 if p.person_id:
-                    existing_nm = NickMapping.query.filter_by(
-                        nick=p.nick).first()
-                    if not existing_nm:
-                        nm = NickMapping(nick=p.nick,
-                                         person_id=p.person_id)
-                        db.session.add(nm)
+                    new_mappings.setdefault(p.nick, p.person_id)
 
             db.session.add(game_log)
+            new_logs.append(game_log)
             imported += 1
+            if progress is not None and imported % 50 == 0:
+                progress(imported / importable)
 
+    _finish_import(new_logs, new_mappings)
     db.session.commit()
-    return jsonify(
-        Message='{} Spiele importiert'.format(imported),
-        imported=imported,
-        errors=error_list,
-        unknown_persons=sorted(unknown_names)
-    ), 200
-
+    return {
+        'Message': '{} Spiele importiert'.format(imported),
+        'imported': imported,
+        'errors': error_list,
+        'unknown_persons': sorted(unknown_names)
+    }, 200
 
-# --------------- Backup ---------------
 
-@bp.route('/protokoll/backup', methods=['GET'])
-def backup_data():
+@bp.route('/protokoll/import_md', methods=['POST'])
+def import_md():
     if not _check_protokoll_auth():
         return _auth_error()
+    result, status = _import_md(request.get_json() or {})
+    return jsonify(result), status
+
 
-    persons = Person.query.order_by(Person.id).all()
-    nick_mappings = NickMapping.query.order_by(NickMapping.id).all()
-    game_logs = GameLog.query.order_by(GameLog.game_date, GameLog.id).all()
+# --------------- Backup ---------------
 
+def _build_backup(persons, nick_mappings, game_logs, created_at):
+    """Serialize persons, mappings and game rows to the backup JSON (pure)."""
     min_date = None
     max_date = None
     games_data = []
     for gl in game_logs:
-        d = gl.game_date.isoformat() if gl.game_date else None
+        d = gl['game_date'].isoformat() if gl['game_date'] else None
         if d:
             if min_date is None or d < min_date:
                 min_date = d
             if max_date is None or d > max_date:
                 max_date = d
         players = []
-        for p in gl.players:
+        for p in gl['players']:
             players.append({
-                'nick': p.nick,
-                'is_loser': p.is_loser,
-                'person_id': p.person_id
+                'nick': p['nick'],
+                'is_loser': p['is_loser'],
+                'person_id': p['person_id']
             })
         games_data.append({
-            'game_uuid': gl.game_uuid,
+            'game_uuid': gl['game_uuid'],
             'game_date': d,
-            'created_at': gl.created_at.isoformat() if gl.created_at else None,
-            'mapping_complete': gl.mapping_complete,
+            'created_at': gl['created_at'].isoformat() if gl['created_at'] else None,
+            'mapping_complete': gl['mapping_complete'],
             'players': players
         })
 
     backup = {
         'version': 1,
-        'created_at': datetime.now(BERLIN_TZ).isoformat(),
+        'created_at': created_at,
         'date_from': min_date,
         'date_to': max_date,
-        'persons': [{'id': p.id, 'name': p.name} for p in persons],
-        'nick_mappings': [{'nick': nm.nick, 'person_id': nm.person_id}
-                          for nm in nick_mappings],
+        'persons': [{'id': pid, 'name': name} for pid, name in persons],
+        'nick_mappings': [{'nick': nick, 'person_id': pid}
+                          for nick, pid in nick_mappings],
         'game_logs': games_data
     }
+    return json.dumps(backup, ensure_ascii=False, indent=2)
+
+
+@bp.route('/protokoll/backup', methods=['GET'])
+@db_routing.read_replica
+def backup_data():
+    if not _check_protokoll_auth():
+        return _auth_error()
+
+    persons = db.session.query(Person.id, Person.name).order_by(Person.id).all()
+    nick_mappings = db.session.query(
+        NickMapping.nick, NickMapping.person_id).order_by(NickMapping.id).all()
+    game_logs = _load_game_rows(
+        GameLog.query.order_by(GameLog.game_date, GameLog.id))
+
+    body = jobs.offload(_build_backup, [tuple(p) for p in persons],
+                        [tuple(m) for m in nick_mappings], game_logs,
+                        datetime.now(_berlin_tz()).isoformat())
 
-    today_str = datetime.now(BERLIN_TZ).strftime('%Y%m%d')
-    resp = Response(json.dumps(backup, ensure_ascii=False, indent=2),
-                    mimetype='application/json')
+    today_str = datetime.now(_berlin_tz()).strftime('%Y%m%d')
+    resp = Response(body, mimetype='application/json')
     resp.headers['Content-Disposition'] = \
         'attachment; filename=schocken_backup_{}.json'.format(today_str)
     return resp
@@ -774,20 +914,16 @@ def backup_data():
 
 # --------------- Restore ---------------
 
-@bp.route('/protokoll/restore', methods=['POST'])
-def restore_data():
-    if not _check_protokoll_auth():
-        return _auth_error()
-
-    data = request.get_json() or {}
+@jobs.job_type('restore')
+def _restore(data, progress=None):
     backup = data.get('backup')
     dry_run = data.get('dry_run', False)
 
     if not backup or not isinstance(backup, dict):
-        return jsonify(Message='Ungültiges Backup-Format'), 400
+        return {'Message': 'Ungültiges Backup-Format'}, 400
 
     if backup.get('version') != 1:
-        return jsonify(Message='Unbekannte Backup-Version'), 400
+        return {'Message': 'Unbekannte Backup-Version'}, 400
 
     date_from = backup.get('date_from')
     date_to = backup.get('date_to')
@@ -812,7 +948,7 @@ def restore_data():
         info['games_to_delete'] = existing
 
     if dry_run:
-        return jsonify(Message='Restore-Vorschau', info=info), 200
+        return {'Message': 'Restore-Vorschau', 'info': info}, 200
 
     # Delete existing data in the date range
     if date_from and date_to:
@@ -837,19 +973,13 @@ def restore_data():
             old_to_new_person[pd['id']] = new_p.id
 
     # Restore nick mappings
-    for nmd in nick_mappings_data:
-        new_pid = old_to_new_person.get(nmd['person_id'])
-        if not new_pid:
-            continue
-        existing = NickMapping.query.filter_by(nick=nmd['nick']).first()
-        if existing:
-            existing.person_id = new_pid
-        else:
-            nm = NickMapping(nick=nmd['nick'], person_id=new_pid)
-            db.session.add(nm)
+    mapping_service.upsert_nick_mappings({
+        nmd['nick']: old_to_new_person.get(nmd['person_id'])
+        for nmd in nick_mappings_data})
 
     # Restore game logs
     restored = 0
+    new_logs = []
     for gld in game_logs_data:
         gl = GameLog()
         gl.game_uuid = gld.get('game_uuid', 'restore')
@@ -858,8 +988,7 @@ def restore_data():
                 'game_date') else None
         gl.created_at = datetime.fromisoformat(
             gld['created_at']) if gld.get('created_at') else datetime.now(
-                BERLIN_TZ)
-        gl.mapping_complete = gld.get('mapping_complete', False)
+                _berlin_tz())
 
         for pld in gld.get('players', []):
             glp = GameLogPlayer()
@@ -869,52 +998,71 @@ def restore_data():
             glp.person_id = old_to_new_person.get(old_pid) if old_pid else None
             gl.players.append(glp)
 
-        gl.mapping_complete = all(
-            p.person_id is not None for p in gl.players)
         db.session.add(gl)
+        new_logs.append(gl)
         restored += 1
+        if progress is not None and restored % 50 == 0:
+            progress(restored / len(game_logs_data))
 
+    db.session.flush()
+    mapping_service.recompute_mapping_complete([gl.id for gl in new_logs])
     db.session.commit()
-    return jsonify(
-        Message='{} Spiele wiederhergestellt'.format(restored),
-        restored=restored
-    ), 200
+    return {
+        'Message': '{} Spiele wiederhergestellt'.format(restored),
+        'restored': restored
+    }, 200
 
 
-# --------------- Live Beer Summary (in-game) ---------------
+@bp.route('/protokoll/restore', methods=['POST'])
+def restore_data():
+    if not _check_protokoll_auth():
+        return _auth_error()
+    result, status = _restore(request.get_json() or {})
+    return jsonify(result), status
 
-@bp.route('/protokoll/beer_summary_live', methods=['GET'])
-def beer_summary_live():
-    """Beer summary for the current game evening, using nicks.
-    Also returns person-based historical stats if the user is mapped."""
-    game_uuid = request.args.get('game_uuid')
-    user_nick = request.args.get('user_nick')
 
-    if not game_uuid or not user_nick:
-        return jsonify(Message='Parameter fehlen'), 400
+# --------------- Background jobs ---------------
 
-    from app.models import Game
-    game = Game.query.filter_by(UUID=game_uuid).first()
-    if game is None:
-        return jsonify(Message='Spiel nicht gefunden'), 404
+@bp.route('/protokoll/jobs', methods=['POST'])
+def start_protokoll_job():
+    """Start a long-running import or restore in the background.
+    Body: {"type": "import_csv" | "import_md" | "restore", "payload": {...}}
+    with the same payload as the synchronous endpoint."""
+    if not _check_protokoll_auth():
+        return _auth_error()
+    data = request.get_json() or {}
+    job_name = data.get('type')
+    if job_name not in ('import_csv', 'import_md', 'restore'):
+        return jsonify(Message='Unbekannter Job-Typ'), 400
+    job = jobs.start_job(job_name, data.get('payload') or {})
+    return jsonify(job), 202
 
-    game_date = game.started.date() if game.started else None
-    if game_date is None:
-        return jsonify(opponents=[]), 200
 
-    logs = GameLog.query.filter_by(game_date=game_date).all()
+@bp.route('/protokoll/jobs/<job_id>', methods=['GET'])
+def get_protokoll_job(job_id):
+    if not _check_protokoll_auth():
+        return _auth_error()
+    job = jobs.get_job(job_id)
+    if job is None:
+        return jsonify(Message='Job nicht gefunden'), 404
+    return jsonify(job), 200
 
+
+# --------------- Live Beer Summary (in-game) ---------------
+
+def _live_beer_opponents(logs, user_nick):
+    """Beer per opponent nick for one game evening (pure)."""
     gives = {}
     gets = {}
 
     for log in logs:
         loser_nick = None
         winner_nicks = []
-        for p in log.players:
-            if p.is_loser:
-                loser_nick = p.nick
+        for p in log['players']:
+            if p['is_loser']:
+                loser_nick = p['nick']
             else:
-                winner_nicks.append(p.nick)
+                winner_nicks.append(p['nick'])
 
         if loser_nick == user_nick:
             for wn in winner_nicks:
@@ -933,12 +1081,105 @@ def beer_summary_live():
             'gets': r,
             'diff': r - g
         })
+    return opponents
+
+
+def _person_beer_history(all_logs, person_id, names):
+    """Overall and per-year beer of a person against all others (pure).
+    all_logs are the complete logs the person played, ordered by date."""
+    result = {}
+    years = set()
+    for gl in all_logs:
+        if gl['game_date']:
+            years.add(gl['game_date'].year)
+
+    years = sorted(years)
+    result['year_range'] = {
+        'first': years[0],
+        'last': years[-1]
+    }
+
+    def compute_beer(game_list, pid):
+        beer = {}
+        for gl in game_list:
+            loser_pid = None
+            winner_pids = []
+            for p in gl['players']:
+                if p['is_loser']:
+                    loser_pid = p['person_id']
+                else:
+                    winner_pids.append(p['person_id'])
+            if loser_pid == pid:
+                for wp in winner_pids:
+                    if wp:
+                        beer.setdefault(wp, {'gives': 0, 'gets': 0})['gives'] += 1
+            elif pid in winner_pids:
+                if loser_pid:
+                    beer.setdefault(loser_pid, {'gives': 0, 'gets': 0})['gets'] += 1
+        return beer
+
+    overall_beer = compute_beer(all_logs, person_id)
+
+    year_beers = {}
+    for yr in years:
+        yr_logs = [gl for gl in all_logs
+                   if gl['game_date'] and gl['game_date'].year == yr]
+        year_beers[yr] = compute_beer(yr_logs, person_id)
+
+    def format_opponents(beer_dict):
+        opps = []
+        for opp_id, counts in beer_dict.items():
+            if opp_id not in names or opp_id == person_id:
+                continue
+            opps.append({
+                'opponent': names[opp_id],
+                'gives': counts['gives'],
+                'gets': counts['gets'],
+                'diff': counts['gets'] - counts['gives']
+            })
+        opps.sort(key=lambda x: x['opponent'])
+        return opps
 
+    result['overall'] = format_opponents(overall_beer)
+    result['per_year'] = {}
+    for yr in years:
+        yr_opps = format_opponents(year_beers[yr])
+        if yr_opps:
+            result['per_year'][yr] = yr_opps
+    return result
+
+
+@bp.route('/protokoll/beer_summary_live', methods=['GET'])
+@db_routing.read_replica
+def beer_summary_live():
+    """Beer summary for the current game evening, using nicks.
+    Also returns person-based historical stats if the user is mapped."""
+    game_uuid = request.args.get('game_uuid')
+    user_nick = request.args.get('user_nick')
+
+    if not game_uuid or not user_nick:
+        return jsonify(Message='Parameter fehlen'), 400
+
+    from app.models import Game
+    game = Game.query.filter_by(UUID=game_uuid).first()
+    if game is None:
+        # Possibly created after the replica's last update
+        with db_routing.primary():
+            game = Game.query.filter_by(UUID=game_uuid).first()
+    if game is None:
+        return jsonify(Message='Spiel nicht gefunden'), 404
+
+    game_date = game.started.date() if game.started else None
+    if game_date is None:
+        return jsonify(opponents=[]), 200
+
+    logs = _load_game_rows(GameLog.query.filter_by(game_date=game_date))
+    opponents = _live_beer_opponents(logs, user_nick)
     result = {'opponents': opponents, 'date': game_date.isoformat()}
 
     # Check if user has a person mapping for this game evening
-    nm = NickMapping.query.filter_by(nick=user_nick).first()
-    person_id = nm.person_id if nm else None
+    person = mapping_service.resolve_nick(user_nick)
+    person_id = person[0] if person else None
 
     # Also check GameLogPlayer mapping on this date
     if not person_id:
@@ -957,88 +1198,15 @@ def beer_summary_live():
             result['person_id'] = person_id
 
             # Get all complete game logs where person participated
-            all_logs = GameLog.query.filter_by(
+            all_logs = _load_game_rows(GameLog.query.filter_by(
                 mapping_complete=True
             ).filter(
                 GameLog.players.any(GameLogPlayer.person_id == person_id)
-            ).order_by(GameLog.game_date).all()
-
-            if all_logs:
-                # Build per-year stats
-                years = set()
-                for gl in all_logs:
-                    if gl.game_date:
-                        years.add(gl.game_date.year)
-
-                years = sorted(years)
-                result['year_range'] = {
-                    'first': years[0],
-                    'last': years[-1]
-                }
-
-                def compute_beer(game_list, pid):
-                    beer = {}
-                    all_pids = set()
-                    for gl in game_list:
-                        loser_pid = None
-                        winner_pids = []
-                        for p in gl.players:
-                            if p.person_id:
-                                all_pids.add(p.person_id)
-                            if p.is_loser:
-                                loser_pid = p.person_id
-                            else:
-                                winner_pids.append(p.person_id)
-                        if loser_pid == pid:
-                            for wp in winner_pids:
-                                if wp:
-                                    beer.setdefault(wp, {'gives': 0, 'gets': 0})['gives'] += 1
-                        elif pid in winner_pids:
-                            if loser_pid:
-                                beer.setdefault(loser_pid, {'gives': 0, 'gets': 0})['gets'] += 1
-                    return beer, all_pids
-
-                person_map = {}
-                all_pid_set = set()
-
-                # Overall
-                overall_beer, pids = compute_beer(all_logs, person_id)
-                all_pid_set.update(pids)
-
-                # Per year
-                year_beers = {}
-                for yr in years:
-                    yr_logs = [gl for gl in all_logs
-                               if gl.game_date and gl.game_date.year == yr]
-                    yr_beer, pids = compute_beer(yr_logs, person_id)
-                    all_pid_set.update(pids)
-                    year_beers[yr] = yr_beer
-
-                for pid_val in all_pid_set:
-                    p = Person.query.get(pid_val)
-                    if p:
-                        person_map[pid_val] = p.name
-
-                def format_opponents(beer_dict):
-                    opps = []
-                    for opp_id, counts in beer_dict.items():
-                        if opp_id not in person_map or opp_id == person_id:
-                            continue
-                        opps.append({
-                            'opponent': person_map[opp_id],
-                            'gives': counts['gives'],
-                            'gets': counts['gets'],
-                            'diff': counts['gets'] - counts['gives']
-                        })
-                    opps.sort(key=lambda x: x['opponent'])
-                    return opps
-
-                result['overall'] = format_opponents(overall_beer)
-                result['per_year'] = {}
-                for yr in years:
-                    yr_opps = format_opponents(year_beers[yr])
-                    if yr_opps:
-                        result['per_year'][yr] = yr_opps
+            ).order_by(GameLog.game_date))
+
+            if any(gl['game_date'] for gl in all_logs):
+                result.update(jobs.offload(
+                    _person_beer_history, all_logs, person_id, _person_names()))
 
     return jsonify(result), 200
 
@@ -1052,30 +1220,29 @@ def log_game_result(game, loser):
     Uses game.started date as the Spieltag date.
     """
     game_date = game.started.date() if game.started else datetime.now(
-        BERLIN_TZ).date()
+        _berlin_tz()).date()
 
     game_log = GameLog()
     game_log.game_uuid = game.UUID
     game_log.game_date = game_date
-    game_log.created_at = datetime.now(BERLIN_TZ)
+    game_log.created_at = datetime.now(_berlin_tz())
 
-    def find_person(nick):
-        nm = NickMapping.query.filter_by(nick=nick).first()
-        return nm.person_id if nm else None
+    winners = [user for user in game.active_users if user.id != loser.id]
+    person_ids = mapping_service.lookup_person_ids(
+        [loser.name] + [user.name for user in winners])
 
     lp = GameLogPlayer()
     lp.nick = loser.name
     lp.is_loser = True
-    lp.person_id = find_person(loser.name)
+    lp.person_id = person_ids.get(loser.name)
     game_log.players.append(lp)
 
-    for user in game.active_users:
-        if user.id != loser.id:
-            wp = GameLogPlayer()
-            wp.nick = user.name
-            wp.is_loser = False
-            wp.person_id = find_person(user.name)
-            game_log.players.append(wp)
+    for user in winners:
+        wp = GameLogPlayer()
+        wp.nick = user.name
+        wp.is_loser = False
+        wp.person_id = person_ids.get(user.name)
+        game_log.players.append(wp)
 
     game_log.mapping_complete = all(
         p.person_id is not None for p in game_log.players)
@@ -1087,9 +1254,9 @@ def log_game_result(game, loser):
 
 def _resolve_person_by_nick(nick):
     """Return Person for a nick via NickMapping, or None."""
-    nm = NickMapping.query.filter_by(nick=nick).first()
-    if nm:
-        return Person.query.get(nm.person_id)
+    person = mapping_service.resolve_nick(nick)
+    if person:
+        return db.session.get(Person, person[0])
     return None
 
 
@@ -1098,17 +1265,11 @@ def get_keybindings():
     nick = request.args.get('nick', '').strip()
     if not nick:
         return jsonify(Message='nick parameter required'), 400
-    person = _resolve_person_by_nick(nick)
-    if not person:
+    prefs, _ = preferences.get_preferences(nick)
+    if not prefs['person_id']:
         return jsonify(bindings=None, person_name=None), 200
-    bindings = None
-    if person.keyboard_bindings:
-        try:
-            bindings = json.loads(person.keyboard_bindings)
-        except (ValueError, TypeError):
-            pass
-    return jsonify(bindings=bindings, person_id=person.id,
-                   person_name=person.name), 200
+    return jsonify(bindings=prefs['bindings'], person_id=prefs['person_id'],
+                   person_name=prefs['person_name']), 200
 
 
 @bp.route('/keybindings', methods=['PUT'])
@@ -1123,20 +1284,22 @@ def save_keybindings():
         return jsonify(Message='Kein Person-Mapping für diesen Nick'), 404
     person.keyboard_bindings = json.dumps(bindings) if bindings else None
     db.session.commit()
+    preferences.invalidate()
     return jsonify(Message='Gespeichert', person_name=person.name), 200
 
 
 @bp.route('/keybindings/persons', methods=['GET'])
 def list_keybinding_persons():
-    persons = Person.query.filter(
-        Person.keyboard_bindings.isnot(None),
-        Person.keyboard_bindings != ''
-    ).order_by(Person.name).all()
-    result = []
-    for p in persons:
-        try:
-            bindings = json.loads(p.keyboard_bindings)
-        except (ValueError, TypeError):
-            continue
-        result.append({'id': p.id, 'name': p.name, 'bindings': bindings})
-    return jsonify(result), 200
+    return jsonify(preferences.persons_with_bindings()), 200
+
+
+@bp.route('/preferences', methods=['GET'])
+def get_preferences():
+    """Sounds, own keyboard bindings and the saved bindings of all persons
+    for a nick in one response; supports If-None-Match."""
+    nick = request.args.get('nick', '').strip()
+    prefs, etag = preferences.get_preferences(nick)
+    resp = make_response(jsonify(prefs))
+    resp.set_etag(etag)
+    resp.headers['Cache-Control'] = 'private, no-cache'
+    return resp.make_conditional(request)
@@ -1,16 +1,18 @@
-from app import app, db
+from app import db, game_counters
+from app.api import bp
 from app.models import Game, Statistic
 from datetime import datetime
-from dateutil.relativedelta import relativedelta
 
 
 # Will be externely called via cronjob
-@app.cli.command("create-statistics")
+@bp.cli.command("create-statistics")
 def statistic():
+    from dateutil.relativedelta import relativedelta
     todayDate = datetime.now()
     delta = relativedelta(days=-1)
     one_day = todayDate + delta
     print('Schedular runs')
+    game_counters.flush()
     try:
         old_games = db.session.query(Game).filter(Game.refreshed <= one_day).with_for_update().all()
         if len(old_games) > 0:
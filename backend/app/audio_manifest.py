@@ -0,0 +1,141 @@
+"""
+audio_manifest.py
+====================================
+In-memory manifest of static/audio.
+Maps every sound file to a short content hash that is appended to its
+URL (?v=...), so /api/sounds and the templates need no filesystem access
+and versioned audio can be cached by browsers forever. A background thread
+of each worker checks the directory listing with each file's mtime and
+size every AUDIO_MANIFEST_CHECK_INTERVAL seconds (0 disables it); files
+added, removed, replaced or overwritten in place trigger a rebuild.
+Requests only read the manifest in memory.
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+
+from flask import request, url_for
+
+logger = logging.getLogger(__name__)
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+# Sounds of the game page; <sound>_<person name>.mp3 overrides <sound>.mp3
+SOUND_NAMES = ['rolling_dice', 'roll_now', 'lift_cup']
+
+_lock = threading.Lock()
+_state = {
+    'dir': None,
+    'interval': 5.0,
+    # Process whose watcher thread is running
+    'pid': None,
+    # Hash of the listing with stat data (see _stamp())
+    'stamp': None,
+    # filename -> content hash
+    'files': {},
+}
+
+
+def _file_hash(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(65536), b''):
+            digest.update(block)
+    return digest.hexdigest()[:12]
+
+
+def _stamp():
+    # Overwriting a file keeps the directory mtime, not the file's mtime/size
+    try:
+        listing = sorted((e.name, st.st_mtime_ns, st.st_size)
+                         for e in os.scandir(_state['dir']) if e.is_file()
+                         for st in (e.stat(),))
+    except OSError:
+        return None
+    return hashlib.sha1(repr(listing).encode('utf-8')).hexdigest()[:16]
+
+
+def build():
+    """Scan the audio directory and replace the manifest."""
+    stamp = _stamp()
+    try:
+        entries = [e for e in os.scandir(_state['dir']) if e.is_file()]
+    except OSError:
+        entries = []
+    files = {}
+    for entry in entries:
+        try:
+            files[entry.name] = _file_hash(entry.path)
+        except OSError:
+            continue
+    with _lock:
+        _state['files'] = files
+        _state['stamp'] = stamp
+    return files
+
+
+def _watch_loop():
+    while True:
+        time.sleep(_state['interval'])
+        try:
+            if _stamp() != _state['stamp']:
+                build()
+        except Exception:
+            logger.exception('Rebuilding the audio manifest failed')
+
+
+def _manifest():
+    if _state['pid'] != os.getpid() and _state['interval'] > 0:
+        with _lock:
+            if _state['pid'] != os.getpid():
+                # A forked worker needs its own watcher
+                _state['pid'] = os.getpid()
+                threading.Thread(target=_watch_loop, daemon=True).start()
+    return _state['files']
+
+
+def version():
+    """Changes whenever the manifest is rebuilt with different files."""
+    _manifest()
+    return _state['stamp']
+
+
+def audio_url(filename):
+    """Versioned static URL of an audio file (unversioned if unknown)."""
+    file_hash = _manifest().get(filename)
+    if file_hash is None:
+        return url_for('static', filename='audio/' + filename)
+    return url_for('static', filename='audio/' + filename, v=file_hash)
+
+
+def sound_urls(person_name=None):
+    """{sound: url}, preferring <sound>_<person_name>.mp3 if it exists."""
+    files = _manifest()
+    urls = {}
+    for sound in SOUND_NAMES:
+        filename = '{}.mp3'.format(sound)
+        if person_name:
+            personal_file = '{}_{}.mp3'.format(sound, person_name)
+            if personal_file in files:
+                filename = personal_file
+        urls[sound] = audio_url(filename)
+    return urls
+
+
+def init_app(app):
+    """Build the manifest and mark versioned audio responses immutable."""
+    _state['dir'] = os.path.join(app.static_folder, 'audio')
+    _state['interval'] = app.config.get('AUDIO_MANIFEST_CHECK_INTERVAL', 5.0)
+    build()
+    app.jinja_env.globals['audio_url'] = audio_url
+
+    @app.after_request
+    def _cache_versioned_audio(response):
+        if request.endpoint == 'static' and request.args.get('v') and \
+                (request.view_args or {}).get('filename', '').startswith('audio/') and \
+                response.status_code in (200, 206, 304):
+            response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+            response.headers.pop('Expires', None)
+        return response
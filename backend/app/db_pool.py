@@ -0,0 +1,169 @@
+"""
+db_pool.py
+====================================
+Connection pool of the SQLAlchemy engine.
+Under gevent every request and Socket.IO event is a greenlet, so far more
+of them can want a connection than the pool holds; the surplus waits in
+the pool (at most DB_POOL_TIMEOUT seconds, then the request fails).
+The DB_POOL_* settings are turned into SQLALCHEMY_ENGINE_OPTIONS, with a
+QueuePool that records the checkout wait (teleschocken_db_pool_wait_seconds)
+next to the SQL time (teleschocken_db_time_seconds). Pre-ping replaces
+connections the server dropped, recycle retires them before MySQL's
+wait_timeout does.
+
+"flask dbpool loadtest" runs many greenlets against the configured
+database to show how the wait grows once they outnumber the connections.
+"""
+import time
+import weakref
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import exc, text
+from sqlalchemy.pool import QueuePool
+
+from app import metrics
+
+POOL_WAIT = metrics.Histogram(
+    'teleschocken_db_pool_wait_seconds',
+    'Time a greenlet waited for a pooled DB connection (incl. connecting)',
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+POOL_TIMEOUTS = metrics.Counter(
+    'teleschocken_db_pool_timeouts_total',
+    'Checkouts that gave up after DB_POOL_TIMEOUT')
+POOL_CHECKED_OUT = metrics.Gauge(
+    'teleschocken_db_pool_checked_out', 'DB connections in use')
+POOL_OVERFLOW = metrics.Gauge(
+    'teleschocken_db_pool_overflow', 'DB connections open beyond DB_POOL_SIZE')
+
+_pools = weakref.WeakSet()
+
+pool_cli = AppGroup('dbpool', help='Database connection pool.')
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        _pools.add(self)
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            POOL_TIMEOUTS.inc()
+            raise
+        finally:
+            POOL_WAIT.observe(time.perf_counter() - started)
+
+
+@metrics.collector
+def _collect_pool_usage():
+    pools = list(_pools)
+    if pools:
+        POOL_CHECKED_OUT.set(sum(p.checkedout() for p in pools))
+        POOL_OVERFLOW.set(sum(max(p.overflow(), 0) for p in pools))
+
+
+def engine_options(config):
+    """Engine options for the DB_POOL_* settings; explicit
+    SQLALCHEMY_ENGINE_OPTIONS win. In-memory SQLite keeps its single
+    static connection."""
+    options = dict(config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    uri = config.get('SQLALCHEMY_DATABASE_URI') or ''
+    if uri.startswith('sqlite') and (uri.endswith(':memory:') or uri.rstrip('/') == 'sqlite:'):
+        return options
+    defaults = {
+        'poolclass': TimedQueuePool,
+        'pool_size': config.get('DB_POOL_SIZE', 10),
+        'max_overflow': config.get('DB_MAX_OVERFLOW', 20),
+        'pool_timeout': config.get('DB_POOL_TIMEOUT', 10),
+        'pool_recycle': config.get('DB_POOL_RECYCLE', 280),
+        'pool_pre_ping': config.get('DB_POOL_PRE_PING', True),
+    }
+    for key, value in defaults.items():
+        options.setdefault(key, value)
+    return options
+
+
+# --------------- Load test ---------------
+
+def _percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def load_test(engine, greenlets, queries, db_ms):
+    """Run greenlets * queries checkouts, each holding its connection for
+    db_ms (server side where the database can sleep, else in gevent).
+    Returns the wait and DB time samples in seconds."""
+    import gevent
+
+    if engine.dialect.name == 'mysql':
+        statement, params = text('SELECT SLEEP(:s)'), {'s': db_ms / 1000.0}
+    else:
+        statement, params = text('SELECT 1'), {}
+    waits, db_times, timeouts = [], [], [0]
+
+    def worker():
+        for _ in range(queries):
+            started = time.perf_counter()
+            try:
+                conn = engine.connect()
+            except exc.TimeoutError:
+                timeouts[0] += 1
+                continue
+            checked_out = time.perf_counter()
+            try:
+                conn.execute(statement, params)
+                if engine.dialect.name != 'mysql':
+                    gevent.sleep(db_ms / 1000.0)
+            finally:
+                conn.close()
+            waits.append(checked_out - started)
+            db_times.append(time.perf_counter() - checked_out)
+            # Next request: let the waiting greenlets get the connection first
+            gevent.sleep(0)
+
+    gevent.joinall([gevent.spawn(worker) for _ in range(greenlets)])
+    return waits, db_times, timeouts[0]
+
+
+@pool_cli.command('loadtest')
+@click.option('--greenlets', default='10,50,200', show_default=True,
+              help='Comma separated numbers of concurrent greenlets.')
+@click.option('--queries', default=10, show_default=True, help='Queries per greenlet.')
+@click.option('--db-ms', default=20.0, show_default=True,
+              help='Time each query holds its connection (ms).')
+def load_test_command(greenlets, queries, db_ms):
+    """Greenlets waiting for connections versus DB time."""
+    # Outside gunicorn nothing is patched yet; the pool created below then
+    # waits cooperatively like in a gevent worker
+    from gevent import monkey
+    monkey.patch_all()
+    from flask import current_app
+    from sqlalchemy import create_engine
+    from app import db
+    engine = create_engine(db.engine.url, **engine_options(current_app.config))
+    pool = engine.pool
+    click.echo('Pool: {} (size {}, overflow {}, timeout {}s)'.format(
+        type(pool).__name__, getattr(pool, 'size', lambda: '-')(),
+        getattr(pool, '_max_overflow', '-'), getattr(pool, '_timeout', '-')))
+    click.echo('{:>9} {:>10} {:>10} {:>10} {:>10} {:>9}'.format(
+        'greenlets', 'wait p50', 'wait p95', 'db p50', 'db p95', 'timeouts'))
+    for count in (int(n) for n in greenlets.split(',')):
+        waits, db_times, timeouts = load_test(engine, count, queries, db_ms)
+        click.echo('{:>9} {:>8.1f}ms {:>8.1f}ms {:>8.1f}ms {:>8.1f}ms {:>9}'.format(
+            count, _percentile(waits, 0.5) * 1000, _percentile(waits, 0.95) * 1000,
+            _percentile(db_times, 0.5) * 1000, _percentile(db_times, 0.95) * 1000,
+            timeouts))
+    engine.dispose()
+
+
+def init_app(app):
+    """Register "flask dbpool"."""
+    app.cli.add_command(pool_cli)
@@ -0,0 +1,118 @@
+"""
+db_routing.py
+====================================
+Optional read replica for the protokoll read endpoints.
+With SQLALCHEMY_REPLICA_URI set, views decorated with @read_replica run
+their queries on the replica (bind "replica"); everything else, and
+every flush, stays on the primary. Without it nothing changes.
+Replication lags, so the primary is read instead
+- for DB_REPLICA_LAG seconds after this client committed protokoll data
+  (read-your-writes, kept in the session cookie),
+- while the protokoll data changed less than DB_REPLICA_LAG seconds ago
+  (stats_cache would otherwise cache a stale result under the new version),
+- inside "with primary():", e.g. for rows another request just created.
+"""
+import contextlib
+import functools
+import time
+
+import sqlalchemy as sa
+from flask import current_app, g, has_request_context, session
+from flask_sqlalchemy.session import Session
+
+from app import stats_cache
+
+REPLICA_BIND = 'replica'
+# Session key: read the primary until this timestamp
+SESSION_KEY = 'db_primary_until'
+# session.info key of a running game_actor batch
+BATCH = 'game_actor_batch'
+
+
+class RoutingSession(Session):
+    """Session that sends reads of @read_replica views to the replica and
+    leaves commit()/rollback() inside a game command batch to the batch."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and g.get('_db_route') == REPLICA_BIND:
+            table = sa.inspect(mapper).persist_selectable if mapper is not None else clause
+            # Models with their own bind_key keep it
+            if not (isinstance(table, sa.Table) and table.metadata.info.get('bind_key')):
+                return self._db.engines[REPLICA_BIND]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def commit(self):
+        batch = self.info.get(BATCH)
+        if batch is not None:
+            return batch.commit()
+        return super().commit()
+
+    def rollback(self):
+        batch = self.info.get(BATCH)
+        if batch is not None:
+            return batch.rollback()
+        return super().rollback()
+
+
+def _replica_allowed():
+    config = current_app.config
+    if not config.get('SQLALCHEMY_REPLICA_URI'):
+        return False
+    if session.get(SESSION_KEY, 0) > time.time():
+        return False
+    return stats_cache.version_age() >= config.get('DB_REPLICA_LAG', 10)
+
+
+def read_replica(f):
+    """View decorator: read from the replica when that is safe."""
+    @functools.wraps(f)
+    def wrapper(*args, **kwargs):
+        if not _replica_allowed():
+            return f(*args, **kwargs)
+        g._db_route = REPLICA_BIND
+        try:
+            return f(*args, **kwargs)
+        finally:
+            g.pop('_db_route', None)
+    return wrapper
+
+
+@contextlib.contextmanager
+def primary():
+    """Read from the primary inside a @read_replica view."""
+    route = g.pop('_db_route', None)
+    try:
+        yield
+    finally:
+        if route is not None:
+            g._db_route = route
+
+
+def _remember_write():
+    # Called by stats_cache after a commit that changed protokoll data
+    if has_request_context():
+        g._db_wrote = True
+
+
+def configure(app):
+    """Add the replica bind; call before db.init_app()."""
+    uri = app.config.get('SQLALCHEMY_REPLICA_URI')
+    if uri:
+        binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+        binds.setdefault(REPLICA_BIND, uri)
+        app.config['SQLALCHEMY_BINDS'] = binds
+
+
+def init_app(app):
+    """Keep clients that just wrote on the primary (session cookie)."""
+    if not app.config.get('SQLALCHEMY_REPLICA_URI'):
+        return
+    from app.models import GameLog, GameLogPlayer, NickMapping, Person
+
+    stats_cache.watch_commits((GameLog, GameLogPlayer, NickMapping, Person), _remember_write)
+
+    @app.after_request
+    def _stick_to_primary(response):
+        if g.pop('_db_wrote', False):
+            session[SESSION_KEY] = time.time() + app.config.get('DB_REPLICA_LAG', 10)
+        return response
@@ -1,5 +1,6 @@
 
 import os
+import tempfile
 
 
 class DefaultConfig(object):
@@ -12,9 +13,31 @@ class DefaultConfig(object):
 
     SECRET_KEY = os.environ.get('SECRET_KEY')
 
-    SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+    # Development database in the instance folder (backend/instance)
+    SQLALCHEMY_DATABASE_URI = 'sqlite:///teleschocken.db'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     SQLALCHEMY_ECHO = False
+    # Connection pool per worker (see app/db_pool.py; not used for in-memory
+    # SQLite). Greenlets beyond size + overflow wait up to DB_POOL_TIMEOUT s
+    DB_POOL_SIZE = 10
+    DB_MAX_OVERFLOW = 20
+    DB_POOL_TIMEOUT = 10
+    # Reconnect before MySQL's wait_timeout and test connections on checkout
+    DB_POOL_RECYCLE = 280
+    DB_POOL_PRE_PING = True
+    # Optional read replica for the protokoll reads (see app/db_routing.py)
+    # and the replication lag to allow for before reading recent writes there
+    SQLALCHEMY_REPLICA_URI = None
+    DB_REPLICA_LAG = 10
+    # Pragmas for SQLite file databases (see app/sqlite_profile.py); the
+    # busy timeout (ms) blocks the worker, keep it short
+    SQLITE_PROFILE = True
+    SQLITE_JOURNAL_MODE = 'WAL'
+    SQLITE_SYNCHRONOUS = 'NORMAL'
+    SQLITE_BUSY_TIMEOUT = 2000
+    SQLITE_MMAP_SIZE = 64 * 1024 * 1024
+    # Create the tables of a new SQLite file database (the migrations are MySQL only)
+    SQLITE_CREATE_SCHEMA = True
 
     #SESSION_COOKIE_NAME = None
     SESSION_COOKIE_DOMAIN = "example.com"
@@ -27,3 +50,78 @@ class DefaultConfig(object):
     BOOTSTRAP_SERVE_LOCAL = True
 
     ADMIN_PASSWORD = ''
+
+    # Per-request SQL statement counting (Server-Timing header, query stats)
+    SQL_INSTRUMENTATION = True
+    # Requests / socket events slower than this are logged with their
+    # slowest statements (at most SLOW_REQUEST_MAX_STATEMENTS)
+    SLOW_REQUEST_MS = 500
+    SLOW_REQUEST_MAX_STATEMENTS = 20
+
+    # Shared scratch directory of all worker processes (metrics snapshots etc.)
+    RUNTIME_DIR = os.environ.get('TELESCHOCKEN_RUNTIME_DIR') or \
+        os.path.join(tempfile.gettempdir(), 'teleschocken')
+    METRICS_FLUSH_INTERVAL = 5.0
+    # /metrics answers "Authorization: Bearer <token>" with this token set and
+    # protokoll logins (ADMIN_PASSWORD); everyone else gets 401
+    METRICS_TOKEN = None
+    # Number of request profiles kept in RUNTIME_DIR/profiles
+    PROFILE_RING_SIZE = 50
+
+    # Report greenlets that block the gevent hub longer than the threshold (s)
+    HUB_MONITOR = True
+    HUB_BLOCKING_THRESHOLD = 0.1
+
+    # CPU-heavy protokoll work (statistics, parsing, backup) runs on this many
+    # native threads; "process" uses a process pool instead
+    JOB_CPU_WORKERS = 2
+    JOB_CPU_EXECUTOR = 'thread'
+    # Background imports/restores running at the same time per worker
+    JOB_MAX_CONCURRENT = 2
+    # Finished job states are removed after this many seconds
+    JOB_RETENTION = 24 * 3600
+    # Statistics results cached per worker (0 disables the cache)
+    STATS_CACHE_SIZE = 32
+    # Seconds between checks of the protokoll data version of other workers
+    DATA_VERSION_CHECK_INTERVAL = 1.0
+    # Page size (and maximum limit) of /api/protokoll/games
+    PROTOKOLL_GAMES_PAGE_SIZE = 200
+    # Return all game logs as a plain list unless limit/cursor are given
+    PROTOKOLL_GAMES_LEGACY = False
+    # Game logs deleted per statement/commit by the protokoll bulk deletes
+    PROTOKOLL_DELETE_CHUNK = 500
+    # Seconds a nick-to-person resolution is cached per worker
+    NICK_CACHE_TTL = 60
+    # Seconds between background checks of static/audio for changed sound
+    # files (0: only read at startup)
+    AUDIO_MANIFEST_CHECK_INTERVAL = 5.0
+    # Embed the preference bundle of the ts_nick cookie into gameplay.html
+    EMBED_PREFERENCES = True
+    # Embed the game state (and the ts_uid player's dice) into the game pages
+    EMBED_GAME_STATE = True
+    # Share compiled templates between workers and restarts (RUNTIME_DIR/jinja)
+    JINJA_BYTECODE_CACHE = True
+    # Migrate in the first gunicorn worker of a deployment; set to False
+    # when "flask deploy migrate" runs as a pre-start step instead
+    MIGRATE_ON_BOOT = True
+    # Dice come from os.urandom, read this many bytes at a time (see app/rng.py)
+    DICE_BUFFER_BYTES = 4096
+    # Seed for reproducible games (tests, benchmarks); never in production
+    DICE_SEED = None
+    # Journal of all game actions (see app/journal.py): written in batches
+    # every JOURNAL_FLUSH_INTERVAL s (or JOURNAL_BATCH_SIZE entries), a
+    # snapshot every JOURNAL_SNAPSHOT_EVERY entries of a game
+    JOURNAL = True
+    JOURNAL_FLUSH_INTERVAL = 1.0
+    JOURNAL_BATCH_SIZE = 200
+    JOURNAL_SNAPSHOT_EVERY = 50
+    JOURNAL_RETENTION_DAYS = 30
+    # Roll counters and game.refreshed are written at most this often per game
+    # and at the round end (see app/game_counters.py); 0 writes them per roll
+    GAME_COUNTER_FLUSH_INTERVAL = 5.0
+    # Game actions run one after the other per game; commands queued meanwhile
+    # share one commit and one reload_game (see app/game_actor.py)
+    GAME_ACTOR = True
+    GAME_ACTOR_BATCH = 20
+    # Seconds without commands after which the worker of a game stops
+    GAME_ACTOR_IDLE = 30.0
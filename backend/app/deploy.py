@@ -0,0 +1,240 @@
+"""
+deploy.py
+====================================
+Database migrations, once per deployment.
+The gunicorn master assigns every start/reload a deployment id
+(TELESCHOCKEN_DEPLOY_ID). The first worker that gets the migration lock
+runs the migrations and records the id in RUNTIME_DIR/migrated; all
+other workers find the id there and only wait until the database
+answers. The lock is a file lock in RUNTIME_DIR (workers of one host)
+and, on MySQL, additionally GET_LOCK() (hosts sharing the database).
+
+"flask deploy migrate" runs the same steps as a dedicated pre-start
+command; with MIGRATE_ON_BOOT = False workers then skip them entirely.
+"""
+import contextlib
+import fcntl
+import os
+import sys
+import time
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import inspect, text
+
+from app import db, metrics
+
+DEPLOY_ID_ENV = 'TELESCHOCKEN_DEPLOY_ID'
+ADVISORY_LOCK = 'teleschocken_migrate'
+# Last revision known to exist, used when the DB points to a removed one
+FALLBACK_REVISION = '2c71994ad95b'
+STATUS_ENUM = "enum('WAITING','STARTED','ROUNDFINISCH','PLAYFINAL','GAMEFINISCH')"
+
+WORKER_BOOT = metrics.Histogram(
+    'teleschocken_worker_boot_seconds',
+    'Worker boot (fork to ready, incl. app import and migration step) in seconds',
+    ('migration',), buckets=(0.25, 0.5, 1, 2, 5, 10, 30, 60))
+
+_state = {'marker': None, 'lock': None}
+
+deploy_cli = AppGroup('deploy', help='Deployment steps.')
+
+
+def _log(message):
+    print('[deploy] ' + message, file=sys.stderr, flush=True)
+
+
+# --------------- Migration steps ---------------
+
+def wait_for_database(attempts=5):
+    """Readiness check: True once SELECT 1 succeeds."""
+    for attempt in range(attempts):
+        try:
+            db.session.execute(text('SELECT 1'))
+            return True
+        except Exception as e:
+            wait = 2 * (attempt + 1)
+            _log('DB connection attempt {} failed: {} - retrying in {}s...'.format(
+                attempt + 1, e, wait))
+            time.sleep(wait)
+        finally:
+            db.session.remove()
+    return False
+
+
+def _upgrade():
+    from flask import current_app
+    from flask_migrate import upgrade
+    from app import init_migrate
+    init_migrate(current_app)
+    try:
+        upgrade()
+        return
+    except BaseException as e:
+        message = str(e)
+        if "Can't locate revision" not in message and 'No such revision' not in message:
+            raise
+        _log('Stale revision detected, stamping DB to {} and retrying...'.format(
+            FALLBACK_REVISION))
+    db.session.execute(text('UPDATE alembic_version SET version_num = :rev'),
+                       {'rev': FALLBACK_REVISION})
+    db.session.commit()
+    db.session.remove()
+    upgrade()
+
+
+def _normalize_status_enum():
+    """Ensure game.status has the uppercase enum NAMES incl. PLAYFINAL.
+    SQLAlchemy 2.0 stores enum names; an old migration used lowercase
+    values. Skipped without DDL when the column is already correct."""
+    if db.engine.dialect.name != 'mysql':
+        return
+    column_type = db.session.execute(text(
+        "SELECT COLUMN_TYPE FROM information_schema.COLUMNS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'game' "
+        "AND COLUMN_NAME = 'status'")).scalar()
+    if column_type is None or column_type.lower() == STATUS_ENUM.lower():
+        db.session.remove()
+        return
+    try:
+        db.session.execute(text(
+            "ALTER TABLE game MODIFY COLUMN status "
+            "ENUM('WAITING','STARTED','ROUNDFINISCH','PLAYFINAL','GAMEFINISCH',"
+            "'roundfinish','gamefinish') NULL"))
+        db.session.execute(text(
+            "UPDATE game SET status = 'ROUNDFINISCH' WHERE status = 'roundfinish'"))
+        db.session.execute(text(
+            "UPDATE game SET status = 'GAMEFINISCH' WHERE status = 'gamefinish'"))
+        db.session.execute(text(
+            "ALTER TABLE game MODIFY COLUMN status "
+            "ENUM('WAITING','STARTED','ROUNDFINISCH','PLAYFINAL','GAMEFINISCH') NULL"))
+        db.session.commit()
+        _log('Status enum values normalized.')
+    except Exception as e:
+        db.session.rollback()
+        _log('Status enum fix skipped: {}'.format(e))
+    finally:
+        db.session.remove()
+
+
+def migrate():
+    """Run all migration steps (needs an app context and the lock)."""
+    if not wait_for_database():
+        _log('All connection attempts failed, trying migration anyway...')
+    if db.engine.dialect.name == 'sqlite' and \
+            not inspect(db.engine).has_table('alembic_version'):
+        # Schema from create_all() (see app/sqlite_profile.py)
+        _log('SQLite database without alembic_version, skipping migrations.')
+        return
+    _upgrade()
+    _normalize_status_enum()
+
+
+# --------------- Locking ---------------
+
+@contextlib.contextmanager
+def _file_lock(waiting):
+    os.makedirs(os.path.dirname(_state['lock']), exist_ok=True)
+    with open(_state['lock'], 'a') as f:
+        while True:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                if waiting():
+                    yield False
+                    return
+                time.sleep(0.1)
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+@contextlib.contextmanager
+def _advisory_lock(waiting):
+    if db.engine.dialect.name != 'mysql':
+        yield True
+        return
+    with db.engine.connect() as conn:
+        while not conn.execute(text('SELECT GET_LOCK(:name, 1)'),
+                               {'name': ADVISORY_LOCK}).scalar():
+            if waiting():
+                yield False
+                return
+        try:
+            yield True
+        finally:
+            conn.execute(text('SELECT RELEASE_LOCK(:name)'), {'name': ADVISORY_LOCK})
+
+
+@contextlib.contextmanager
+def migration_lock(waiting=None):
+    """Cross-process (and on MySQL cross-host) migration lock; yields
+    whether it was acquired. waiting() is called while another process
+    holds the lock (e.g. to keep a gunicorn worker alive) and may return
+    True to stop waiting."""
+    waiting = waiting or (lambda: False)
+    with _file_lock(waiting) as acquired:
+        if not acquired:
+            yield False
+            return
+        with _advisory_lock(waiting) as acquired:
+            yield acquired
+
+
+def _migrated_for(deploy_id):
+    try:
+        with open(_state['marker']) as f:
+            return f.read() == deploy_id
+    except OSError:
+        return False
+
+
+def _mark_migrated(deploy_id):
+    tmp = '{}.{}.tmp'.format(_state['marker'], os.getpid())
+    with open(tmp, 'w') as f:
+        f.write(deploy_id)
+    os.replace(tmp, _state['marker'])
+
+
+def ensure_migrated(app, notify=None):
+    """Worker start-up: migrate if no other worker did it for this
+    deployment, else only wait for the database. Returns True if this
+    process ran the migrations."""
+    deploy_id = os.environ.get(DEPLOY_ID_ENV)
+
+    def migrated_elsewhere():
+        if notify is not None:
+            notify()
+        return bool(deploy_id) and _migrated_for(deploy_id)
+
+    with app.app_context():
+        if not app.config.get('MIGRATE_ON_BOOT', True) or migrated_elsewhere():
+            wait_for_database()
+            return False
+        with migration_lock(migrated_elsewhere) as acquired:
+            if not acquired or migrated_elsewhere():
+                wait_for_database()
+                return False
+            migrate()
+            if deploy_id:
+                _mark_migrated(deploy_id)
+            return True
+
+
+@deploy_cli.command('migrate')
+def migrate_command():
+    """Run the migrations under the migration lock (pre-start step)."""
+    with migration_lock() as acquired:
+        if acquired:
+            migrate()
+    click.echo('Migration abgeschlossen.')
+
+
+def init_app(app):
+    """Register "flask deploy" and the lock/marker paths in RUNTIME_DIR."""
+    runtime_dir = app.config['RUNTIME_DIR']
+    _state['marker'] = os.path.join(runtime_dir, 'migrated')
+    _state['lock'] = os.path.join(runtime_dir, 'migrate.lock')
+    app.cli.add_command(deploy_cli)
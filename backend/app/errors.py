@@ -1,13 +1,16 @@
 from flask import render_template
-from app import app, db
+from app import db
 
 
-@app.errorhandler(404)
 def not_found_error(error):
     return render_template('404.html'), 404
 
 
-@app.errorhandler(500)
 def internal_error(error):
     db.session.rollback()
     return render_template('500.html'), 500
+
+
+def init_app(app):
+    app.register_error_handler(404, not_found_error)
+    app.register_error_handler(500, internal_error)
@@ -0,0 +1,215 @@
+"""
+game_actor.py
+====================================
+Serialized commands per game.
+Views decorated with @command change a game: they used to run side by
+side, each reading and committing the whole game, so two quick clicks
+(distribute twice, vote_reveal racing pull_up_dice_cup) lost updates and
+sent duplicate reload_game events. Now each game has a queue and one
+worker (a greenlet under gevent, a thread otherwise) that runs its
+commands one after the other; different games still run in parallel.
+The request waits for its command and returns its response.
+
+Commands that queued up while a batch ran form the next batch (at most
+GAME_ACTOR_BATCH): one transaction with a savepoint per command, one
+commit and one reload_game per game at the end. A db.session.commit()
+of a view releases its savepoint, db.session.rollback() and returning
+without commit drop its changes, as a request would. If the batch cannot
+commit, its commands raise the error.
+The queue serializes the commands of one process; a batch also locks the
+game (SELECT ... FOR UPDATE, on SQLite BEGIN IMMEDIATE) against the
+batches of the other workers.
+broadcast_game() is the reload_game emit of the views; outside a batch
+it emits right away. A worker stops after GAME_ACTOR_IDLE seconds
+without commands.
+"""
+import functools
+import os
+import queue
+import threading
+
+from flask import current_app, g, has_app_context
+from flask.globals import request_ctx
+
+from sqlalchemy import select
+
+from app import db, socketio
+# RoutingSession hands commit()/rollback() of a batch to session.info[BATCH]
+from app.db_routing import BATCH
+
+_lock = threading.Lock()
+# game UUID -> queue of its worker
+_actors = {}
+_state = {'pid': None, 'enabled': True, 'batch': 20, 'idle': 30.0}
+
+
+class _Command(object):
+
+    def __init__(self, view, args, kwargs):
+        self.run = functools.partial(view, *args, **kwargs)
+        self.app = current_app._get_current_object()
+        self.context = request_ctx._get_current_object()
+        self.scope = g.get('_sql_scope')
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.committed = False
+
+
+class _Batch(object):
+    """Transaction of a batch; a savepoint per command."""
+
+    def __init__(self, session):
+        self.session = session
+        self.savepoint = None
+        self.command = None
+        self.games = []
+
+    def begin(self, command):
+        self.command = command
+        self.savepoint = self.session.begin_nested()
+
+    def commit(self):
+        self.session.flush()
+        self.savepoint.commit()
+        self.command.committed = True
+        # Like expire_on_commit: the view reads what it committed
+        self.session.expire_all()
+        self.savepoint = self.session.begin_nested()
+
+    def rollback(self):
+        self.savepoint.rollback()
+        self.savepoint = self.session.begin_nested()
+
+    def end(self):
+        # Changes after the last commit of the command are dropped
+        self.savepoint.rollback()
+        self.savepoint = self.command = None
+
+
+def _batch():
+    if not has_app_context():
+        return None
+    return db.session().info.get(BATCH)
+
+
+def broadcast_game(game):
+    """Send the game to its room (reload_game), in a batch once after its commit."""
+    batch = _batch()
+    if batch is not None:
+        if game.id not in batch.games:
+            batch.games.append(game.id)
+        return
+    socketio.emit('reload_game', game.to_dict(), room=game.UUID, namespace='/game')
+
+
+def _execute(batch, command):
+    # The waiting request's context is pushed once more (like
+    # stream_with_context); the app context (session, g) is the batch's
+    g._sql_scope = command.scope
+    batch.begin(command)
+    try:
+        with command.context:
+            command.result = command.run()
+    except Exception as e:
+        command.error = e
+    finally:
+        batch.end()
+        g.pop('_sql_scope', None)
+
+
+def _lock_game(session, gid):
+    from app.models import Game
+    if session.get_bind(Game).dialect.name == 'sqlite':
+        # No row locks; pysqlite would only begin before the first write
+        session.connection(bind_arguments={'mapper': Game}).exec_driver_sql('BEGIN IMMEDIATE')
+    else:
+        session.execute(select(Game.id).where(Game.UUID == gid).with_for_update())
+
+
+def _run_batch(gid, commands):
+    from app.models import Game
+    with commands[0].app.app_context():
+        session = db.session()
+        batch = _Batch(session)
+        try:
+            _lock_game(session, gid)
+            session.info[BATCH] = batch
+            for command in commands:
+                _execute(batch, command)
+            del session.info[BATCH]
+            session.commit()
+        except Exception as e:
+            session.info.pop(BATCH, None)
+            session.rollback()
+            for command in commands:
+                if command.error is None:
+                    command.error = e
+            batch.games = []
+        try:
+            for game in Game.query.filter(Game.id.in_(batch.games)):
+                socketio.emit('reload_game', game.to_dict(), room=game.UUID, namespace='/game')
+        finally:
+            for command in commands:
+                command.done.set()
+
+
+def _work(gid, commands):
+    while True:
+        try:
+            batch = [commands.get(timeout=_state['idle'])]
+        except queue.Empty:
+            with _lock:
+                if commands.empty():
+                    if _actors.get(gid) is commands:
+                        del _actors[gid]
+                    return
+            continue
+        while len(batch) < _state['batch']:
+            try:
+                batch.append(commands.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            _run_batch(gid, batch)
+        except Exception as e:
+            for command in batch:
+                if not command.done.is_set():
+                    command.error = command.error or e
+                    command.done.set()
+
+
+def _submit(gid, command):
+    with _lock:
+        if _state['pid'] != os.getpid():
+            # A forked worker has none of the parent's workers
+            _state['pid'] = os.getpid()
+            _actors.clear()
+        commands = _actors.get(gid)
+        if commands is None:
+            commands = _actors[gid] = queue.Queue()
+            threading.Thread(target=_work, args=(gid, commands), daemon=True).start()
+        commands.put(command)
+
+
+def command(f):
+    """View decorator: run the view in the worker of game <gid>."""
+    @functools.wraps(f)
+    def wrapper(*args, **kwargs):
+        gid = kwargs.get('gid')
+        # Inside a batch (a command calling another view) run directly
+        if not _state['enabled'] or gid is None or _batch() is not None:
+            return f(*args, **kwargs)
+        pending = _Command(f, args, kwargs)
+        _submit(gid, pending)
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+    return wrapper
+
+
+def init_app(app):
+    _state['enabled'] = app.config.get('GAME_ACTOR', True)
+    _state['batch'] = max(1, app.config.get('GAME_ACTOR_BATCH', 20))
+    _state['idle'] = app.config.get('GAME_ACTOR_IDLE', 30.0)
@@ -0,0 +1,210 @@
+"""
+game_counters.py
+====================================
+Coalesced roll statistics of the running games.
+roll_dice used to write game.refreshed, throw_dice_count and
+schockoutcount with every click, which made the game row a write hot
+spot. The values are now collected per game in memory and written
+- every GAME_COUNTER_FLUSH_INTERVAL seconds by a background thread, as
+  one relative UPDATE per game (several workers can count the same game),
+- at the end of a round, inside the commit that ends it (apply()); if
+  the transaction or savepoint of apply() is rolled back instead, the
+  values become pending again.
+Values whose UPDATE fails stay pending for the next flush.
+The stale-game janitor and "create-statistics" flush this worker first;
+other workers are at most one interval behind, far below the one day
+after which a game counts as stale. The counters are written past the
+session, so they are not part of the game journal.
+With GAME_COUNTER_FLUSH_INTERVAL = 0 the values are written in the
+request as before.
+"""
+import atexit
+import datetime
+import logging
+import os
+import threading
+import time
+
+from sqlalchemy import case, event, func, or_
+from sqlalchemy.orm import Session
+
+from app import db
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+# game_id -> {'throws': n, 'schockouts': n, 'refreshed': datetime}
+_pending = {}
+_state = {'app': None, 'pid': None, 'interval': 5.0}
+
+# session.info: [(game_id, entry)] moved into the session by apply()
+_APPLIED = 'game_counters_applied'
+# session.info: savepoint -> number of applied entries when it began
+_SAVEPOINTS = 'game_counters_savepoints'
+
+
+def _entry(game_id):
+    # Called with _lock held
+    if _state['pid'] != os.getpid():
+        # A forked worker starts empty, with its own writer
+        _state['pid'] = os.getpid()
+        _pending.clear()
+        threading.Thread(target=_write_loop, daemon=True).start()
+    entry = _pending.get(game_id)
+    if entry is None:
+        entry = _pending[game_id] = {'throws': 0, 'schockouts': 0, 'refreshed': None}
+    return entry
+
+
+def touch(game):
+    """The game was played just now (game.refreshed)."""
+    now = datetime.datetime.now()
+    if _state['interval'] <= 0:
+        game.refreshed = now
+        return
+    with _lock:
+        _entry(game.id)['refreshed'] = now
+
+
+def count_roll(game, schockout):
+    """Count a roll (and a Schock-Out) of the game."""
+    if _state['interval'] <= 0:
+        if schockout:
+            game.schockoutcount = game.schockoutcount + 1
+        game.throw_dice_count = game.throw_dice_count + 1
+        return
+    with _lock:
+        entry = _entry(game.id)
+        entry['throws'] += 1
+        entry['schockouts'] += 1 if schockout else 0
+
+
+def _values(columns, entry):
+    values = {}
+    if entry['throws']:
+        values['throw_dice_count'] = func.coalesce(columns.throw_dice_count, 0) + entry['throws']
+    if entry['schockouts']:
+        values['schockoutcount'] = func.coalesce(columns.schockoutcount, 0) + entry['schockouts']
+    if entry['refreshed'] is not None:
+        values['refreshed'] = case(
+            (or_(columns.refreshed.is_(None), columns.refreshed < entry['refreshed']),
+             entry['refreshed']), else_=columns.refreshed)
+    return values
+
+
+def apply(game):
+    """Move the pending values of game into the session (round end), so
+    they are written with the next commit."""
+    from app.models import Game
+    with _lock:
+        entry = _pending.pop(game.id, None)
+    if entry is None:
+        return
+    # Kept until the outermost commit, pending again after a rollback
+    db.session().info.setdefault(_APPLIED, []).append((game.id, entry))
+    for key, value in _values(Game, entry).items():
+        setattr(game, key, value)
+
+
+def _restore(pending):
+    # Put values that could not be written back, merged with newer ones
+    with _lock:
+        for game_id, entry in pending.items():
+            current = _pending.get(game_id)
+            if current is None:
+                _pending[game_id] = entry
+                continue
+            current['throws'] += entry['throws']
+            current['schockouts'] += entry['schockouts']
+            if current['refreshed'] is None or (
+                    entry['refreshed'] is not None and entry['refreshed'] > current['refreshed']):
+                current['refreshed'] = entry['refreshed']
+
+
+def flush():
+    """Write all pending values of this worker."""
+    from app.models import Game
+    with _lock:
+        pending = dict(_pending)
+        _pending.clear()
+    if not pending:
+        return 0
+    table = Game.__table__
+    # One short transaction per game, in id order: no row locks of several
+    # games held at once, so no deadlocks with other workers
+    game_ids = sorted(pending)
+    try:
+        with _state['app'].app_context():
+            while game_ids:
+                with db.engine.begin() as conn:
+                    conn.execute(table.update().where(table.c.id == game_ids[0]).values(
+                        _values(table.c, pending[game_ids[0]])))
+                game_ids.pop(0)
+    except Exception:
+        _restore({game_id: pending[game_id] for game_id in game_ids})
+        raise
+    return len(pending)
+
+
+def _after_commit(session):
+    # Releasing a savepoint fires after_commit as well; the values are
+    # only written with the outermost transaction
+    if session.in_nested_transaction():
+        return
+    session.info.pop(_APPLIED, None)
+    session.info.pop(_SAVEPOINTS, None)
+
+
+def _after_transaction_create(session, transaction):
+    if transaction.nested:
+        session.info.setdefault(_SAVEPOINTS, {})[transaction] = \
+            len(session.info.get(_APPLIED, ()))
+
+
+def _after_soft_rollback(session, previous_transaction):
+    if not previous_transaction.nested:
+        return
+    began = session.info.get(_SAVEPOINTS, {}).pop(previous_transaction, 0)
+    applied = session.info.get(_APPLIED, [])
+    _restore_applied(applied[began:])
+    del applied[began:]
+
+
+def _after_transaction_end(session, transaction):
+    # Rolled back or closed without a commit (a commit popped them before)
+    if transaction.parent is None:
+        session.info.pop(_SAVEPOINTS, None)
+        _restore_applied(session.info.pop(_APPLIED, ()))
+
+
+def _restore_applied(applied):
+    for game_id, entry in applied:
+        _restore({game_id: entry})
+
+
+@atexit.register
+def _flush_at_exit():
+    if _state['pid'] == os.getpid():
+        try:
+            flush()
+        except Exception:
+            logger.exception('Writing the game counters failed')
+
+
+def _write_loop():
+    while True:
+        time.sleep(_state['interval'])
+        try:
+            flush()
+        except Exception:
+            logger.exception('Writing the game counters failed')
+
+
+def init_app(app):
+    _state['app'] = app
+    _state['interval'] = app.config.get('GAME_COUNTER_FLUSH_INTERVAL', 5.0)
+    if not event.contains(Session, 'after_commit', _after_commit):
+        event.listen(Session, 'after_commit', _after_commit)
+        event.listen(Session, 'after_transaction_create', _after_transaction_create)
+        event.listen(Session, 'after_soft_rollback', _after_soft_rollback)
+        event.listen(Session, 'after_transaction_end', _after_transaction_end)
@@ -0,0 +1,82 @@
+"""
+hub_monitor.py
+====================================
+Detects greenlets that block the gevent hub.
+All games of a worker share one hub, so a single non-cooperative call
+(CPU-heavy statistics, blocking file I/O, a huge json.dumps) stalls every
+table on that worker. gevent's monitor thread notices when the hub has not
+switched for HUB_BLOCKING_THRESHOLD seconds; this module records those
+reports with the blocking greenlet's stack, counts them in the metrics
+and logs them.
+"""
+import collections
+import time
+
+from app import metrics
+
+HUB_BLOCKS = metrics.Counter(
+    'teleschocken_hub_blocked_total',
+    'Times a greenlet blocked the gevent hub longer than the threshold')
+
+_recent = collections.deque(maxlen=20)
+_state = {'logger': None, 'started': False}
+
+
+def recent_blocks():
+    """Return the latest blocking reports, newest first."""
+    return list(reversed(_recent))
+
+
+def _record(entry):
+    # Runs in the hub thread (scheduled via run_callback_threadsafe), so
+    # the gevent-patched locks used by metrics and logging are safe here.
+    _recent.append(entry)
+    HUB_BLOCKS.inc()
+    if _state['logger'] is not None:
+        _state['logger'].warning(
+            'gevent hub blocked for more than %.3f s by %s\n%s',
+            entry['threshold'], entry['greenlet'], '\n'.join(entry['report']))
+
+
+def _on_event(event):
+    from gevent.events import EventLoopBlocked
+    if not isinstance(event, EventLoopBlocked):
+        return
+    # Called in gevent's native monitor thread while the hub is still blocked.
+    entry = {
+        'time': time.time(),
+        'threshold': event.blocking_time,
+        'greenlet': repr(event.greenlet),
+        'report': list(event.info),
+    }
+    event.hub.loop.run_callback_threadsafe(_record, entry)
+
+
+def start(threshold, logger=None):
+    """Start gevent's monitor thread for the current hub."""
+    import gevent
+    from gevent import events
+
+    _state['logger'] = logger
+    gevent.config.max_blocking_time = threshold
+    gevent.config.print_blocking_reports = False
+    gevent.config.monitor_thread = True
+    if _on_event not in events.subscribers:
+        events.subscribers.append(_on_event)
+    gevent.get_hub().start_periodic_monitoring_thread()
+    _state['started'] = True
+
+
+def init_app(app):
+    """Start monitoring if the worker runs on a monkey-patched gevent hub."""
+    if not app.config.get('HUB_MONITOR', True):
+        return
+    try:
+        from gevent import monkey
+    except ImportError:
+        return
+    if not monkey.is_module_patched('socket'):
+        return
+    from app import prefork
+    prefork.per_worker(
+        lambda: start(app.config.get('HUB_BLOCKING_THRESHOLD', 0.1), app.logger))
@@ -0,0 +1,188 @@
+"""
+instrumentation.py
+====================================
+Per-request SQL statement counting and timing.
+SQLAlchemy cursor events feed counters on flask.g; the totals are sent
+back in a Server-Timing header, aggregated per endpoint / Socket.IO
+event and logged when a request is slower than SLOW_REQUEST_MS.
+"""
+import functools
+import heapq
+import threading
+import time
+
+from flask import current_app, g, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app import metrics
+
+_stats_lock = threading.Lock()
+_endpoint_stats = {}
+
+
+class _Scope(object):
+    """Counters for one HTTP request or one Socket.IO event."""
+
+    def __init__(self, name, keep_statements):
+        self.name = name
+        self.started = time.perf_counter()
+        self.query_count = 0
+        self.sql_time = 0.0
+        self.keep_statements = keep_statements
+        # Heap of the slowest statements: (elapsed, number, statement)
+        self.statements = []
+
+
+def _current_scope():
+    if not has_app_context():
+        return None
+    return g.get('_sql_scope')
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current_scope() is not None:
+        conn.info.setdefault('_query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    scope = _current_scope()
+    if scope is None:
+        return
+    starts = conn.info.get('_query_start')
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    scope.query_count += 1
+    scope.sql_time += elapsed
+    item = (elapsed, scope.query_count, statement)
+    if len(scope.statements) < scope.keep_statements:
+        heapq.heappush(scope.statements, item)
+    elif scope.statements and elapsed > scope.statements[0][0]:
+        heapq.heapreplace(scope.statements, item)
+
+
+def _handle_error(exception_context):
+    # after_cursor_execute does not run for a failed statement; drop its
+    # start time, or the pooled connection keeps it for later statements
+    # (a connection runs one statement at a time)
+    conn = exception_context.connection
+    if conn is not None:
+        conn.info.pop('_query_start', None)
+
+
+def start_scope(name):
+    """Start counting statements for the current app context."""
+    keep = current_app.config.get('SLOW_REQUEST_MAX_STATEMENTS', 20)
+    g._sql_scope = _Scope(name, keep)
+    return g._sql_scope
+
+
+def finish_scope(status=None):
+    """Stop counting, aggregate the scope, feed the metrics and log it if
+    it was slow. Returns the finished scope or None if none was running."""
+    scope = g.pop('_sql_scope', None)
+    if scope is None:
+        return None
+    duration = time.perf_counter() - scope.started
+    scope.duration = duration
+
+    with _stats_lock:
+        entry = _endpoint_stats.get(scope.name)
+        if entry is None:
+            entry = _endpoint_stats[scope.name] = {
+                'count': 0, 'queries_total': 0, 'queries_max': 0,
+                'sql_time_total': 0.0, 'duration_total': 0.0,
+                'duration_max': 0.0,
+            }
+        entry['count'] += 1
+        entry['queries_total'] += scope.query_count
+        entry['queries_max'] = max(entry['queries_max'], scope.query_count)
+        entry['sql_time_total'] += scope.sql_time
+        entry['duration_total'] += duration
+        entry['duration_max'] = max(entry['duration_max'], duration)
+
+    metrics.DB_TIME.observe(scope.sql_time, scope.name)
+    metrics.DB_QUERIES.inc(scope.name, amount=scope.query_count)
+    if scope.name.startswith('socket:'):
+        event_name = scope.name[len('socket:'):]
+        metrics.SOCKET_EVENTS.inc(event_name)
+        metrics.SOCKET_DURATION.observe(duration, event_name)
+    else:
+        metrics.HTTP_REQUESTS.inc(scope.name, request.method, status)
+        metrics.HTTP_DURATION.observe(duration, scope.name)
+
+    slow_ms = current_app.config.get('SLOW_REQUEST_MS')
+    if slow_ms is not None and duration * 1000 >= slow_ms:
+        # The slowest statements, in the order they ran
+        lines = ['#{}  {:.1f} ms  {}'.format(n, t * 1000, ' '.join(s.split()))
+                 for t, n, s in sorted(scope.statements, key=lambda item: item[1])]
+        current_app.logger.warning(
+            'Slow request %s: %.1f ms, %d queries, %.1f ms SQL\n%s',
+            scope.name, duration * 1000, scope.query_count,
+            scope.sql_time * 1000, '\n'.join(lines))
+    return scope
+
+
+def get_stats():
+    """Return the aggregated per-endpoint statistics."""
+    result = {}
+    with _stats_lock:
+        for name, e in _endpoint_stats.items():
+            count = e['count'] or 1
+            result[name] = {
+                'count': e['count'],
+                'queries_total': e['queries_total'],
+                'queries_avg': round(e['queries_total'] / count, 2),
+                'queries_max': e['queries_max'],
+                'sql_ms_total': round(e['sql_time_total'] * 1000, 2),
+                'sql_ms_avg': round(e['sql_time_total'] * 1000 / count, 2),
+                'duration_ms_avg': round(e['duration_total'] * 1000 / count, 2),
+                'duration_ms_max': round(e['duration_max'] * 1000, 2),
+            }
+    return result
+
+
+def reset_stats():
+    with _stats_lock:
+        _endpoint_stats.clear()
+
+
+def instrument_socket_event(name):
+    """Decorator for Socket.IO handlers: counts their statements like a request."""
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            start_scope('socket:{}'.format(name))
+            try:
+                return f(*args, **kwargs)
+            finally:
+                finish_scope()
+        return wrapper
+    return decorator
+
+
+def init_app(app):
+    """Register the cursor listeners and the request hooks."""
+    if not app.config.get('SQL_INSTRUMENTATION', True):
+        return
+
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(Engine, 'handle_error', _handle_error)
+
+    @app.before_request
+    def _start_request_scope():
+        start_scope(request.endpoint or 'unknown')
+
+    @app.after_request
+    def _add_server_timing(response):
+        scope = finish_scope(response.status_code)
+        if scope is not None:
+            response.headers.add(
+                'Server-Timing',
+                'db;dur={:.1f};desc="{} queries", app;dur={:.1f}'.format(
+                    scope.sql_time * 1000, scope.query_count,
+                    scope.duration * 1000))
+        return response
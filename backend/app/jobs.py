@@ -0,0 +1,189 @@
+"""
+jobs.py
+====================================
+Execution layer that keeps CPU-heavy protokoll work off the gevent hub.
+
+offload() runs a pure function (plain data in, plain data out) on a
+bounded pool of native threads, or of processes with
+JOB_CPU_EXECUTOR = "process", while the calling greenlet waits
+cooperatively. Database access stays in the greenlets: pooled
+connections belong to the hub that opened them.
+
+start_job() runs long imports/restores in a bounded background pool with
+their own app context. Job state and progress are written to
+RUNTIME_DIR/jobs/<id>.json so every worker can answer the status request.
+"""
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import time
+import traceback
+import uuid
+
+_state = {
+    'pid': None,
+    'cpu_pool': None,
+    'process_pool': None,
+    'job_pool': None,
+    'app': None,
+    'dir': None,
+}
+
+_job_types = {}
+
+
+def _gevent_patched():
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched('threading')
+
+
+def _pools():
+    """Create the pools lazily and again after a fork."""
+    if _state['pid'] != os.getpid():
+        config = _state['app'].config
+        cpu_workers = config.get('JOB_CPU_WORKERS', 2)
+        if _gevent_patched():
+            from gevent.threadpool import ThreadPool
+            _state['cpu_pool'] = ThreadPool(cpu_workers)
+        else:
+            _state['cpu_pool'] = concurrent.futures.ThreadPoolExecutor(cpu_workers)
+        _state['process_pool'] = None
+        if config.get('JOB_CPU_EXECUTOR', 'thread') == 'process':
+            _state['process_pool'] = concurrent.futures.ProcessPoolExecutor(
+                cpu_workers, mp_context=multiprocessing.get_context('spawn'))
+        # Under gevent these "threads" are greenlets: jobs do DB I/O cooperatively
+        _state['job_pool'] = concurrent.futures.ThreadPoolExecutor(
+            config.get('JOB_MAX_CONCURRENT', 2))
+        _state['pid'] = os.getpid()
+    return _state
+
+
+def offload(fn, *args):
+    """Run fn(*args) off the hub and return its result.
+    fn must be a module-level function working on plain data only."""
+    pools = _pools()
+    if pools['process_pool'] is not None:
+        future = pools['process_pool'].submit(fn, *args)
+        fn, args = future.result, ()
+    cpu_pool = pools['cpu_pool']
+    if isinstance(cpu_pool, concurrent.futures.Executor):
+        return cpu_pool.submit(fn, *args).result()
+    return cpu_pool.spawn(fn, *args).get()
+
+
+# --------------- Background jobs ---------------
+
+def job_type(name):
+    """Register fn(payload, progress) -> (result, status_code) as a job type."""
+    def decorator(fn):
+        _job_types[name] = fn
+        return fn
+    return decorator
+
+
+def _job_path(job_id):
+    return os.path.join(_state['dir'], '{}.json'.format(job_id))
+
+
+def _write_job(job):
+    os.makedirs(_state['dir'], exist_ok=True)
+    tmp = _job_path(job['id']) + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(job, f)
+    os.replace(tmp, _job_path(job['id']))
+
+
+def get_job(job_id):
+    """Return the stored job state or None."""
+    try:
+        uuid.UUID(job_id)
+    except ValueError:
+        return None
+    try:
+        with open(_job_path(job_id)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+class _Progress(object):
+    """Progress callback handed to job functions. Also yields to the hub."""
+
+    def __init__(self, job):
+        self.job = job
+        self.last_write = 0.0
+
+    def __call__(self, fraction, message=None):
+        self.job['progress'] = round(min(max(fraction, 0.0), 1.0), 3)
+        if message is not None:
+            self.job['message'] = message
+        now = time.monotonic()
+        if now - self.last_write > 0.5:
+            self.last_write = now
+            _write_job(self.job)
+        # time.sleep is gevent.sleep on a patched worker
+        time.sleep(0)
+
+
+def _run_job(job, fn, payload):
+    app = _state['app']
+    job['status'] = 'running'
+    job['started'] = time.time()
+    _write_job(job)
+    try:
+        with app.app_context():
+            result, status = fn(payload, _Progress(job))
+        job['status'] = 'done' if status < 400 else 'failed'
+        job['result'] = result
+        job['status_code'] = status
+        job['progress'] = 1.0
+    except Exception as e:
+        app.logger.error('Job %s failed:\n%s', job['id'], traceback.format_exc())
+        job['status'] = 'failed'
+        job['error'] = '{}: {}'.format(type(e).__name__, e)
+    job['finished'] = time.time()
+    _write_job(job)
+
+
+def start_job(name, payload):
+    """Queue a registered job type and return its initial state."""
+    fn = _job_types[name]
+    job = {
+        'id': str(uuid.uuid4()),
+        'type': name,
+        'status': 'queued',
+        'progress': 0.0,
+        'message': None,
+        'result': None,
+        'error': None,
+        'created': time.time(),
+    }
+    _write_job(job)
+    cleanup_jobs(_state['app'].config.get('JOB_RETENTION', 24 * 3600))
+    _pools()['job_pool'].submit(_run_job, job, fn, payload)
+    return job
+
+
+def cleanup_jobs(max_age):
+    """Remove finished job files older than max_age seconds."""
+    try:
+        names = os.listdir(_state['dir'])
+    except OSError:
+        return
+    cutoff = time.time() - max_age
+    for name in names:
+        path = os.path.join(_state['dir'], name)
+        try:
+            if os.stat(path).st_mtime < cutoff:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+def init_app(app):
+    _state['app'] = app
+    _state['dir'] = os.path.join(app.config['RUNTIME_DIR'], 'jobs')
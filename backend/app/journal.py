@@ -0,0 +1,380 @@
+"""
+journal.py
+====================================
+Append-only action journal of every game (table game_journal).
+The session events record, per commit, game and action, the Game and
+User columns the action changed (absolute values, deleted players, new rows
+in full) together with the action (start, roll, diceturn, visible,
+finish, passive, distribute, admin, ...) and the acting user. The
+entries are queued in memory and written in batches by a background
+thread, never in the request. Every JOURNAL_SNAPSHOT_EVERY entries of a
+game the thread also stores a full snapshot of it.
+
+replay() rebuilds a game at any point in time (or after any number of
+actions) from the last snapshot before it plus the entries after it;
+since entries hold absolute values, an entry already contained in a
+snapshot can be applied again without harm.
+"flask journal show <game>" lists the actions, "flask journal replay"
+prints the rebuilt state.
+"""
+import atexit
+import copy
+import datetime
+import enum
+import json
+import logging
+import os
+import threading
+import time
+
+import click
+from flask import has_request_context, request
+from flask.cli import AppGroup
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import Session
+
+from app import db
+
+logger = logging.getLogger(__name__)
+
+_PENDING = 'journal_changes'
+# session.info: savepoint -> pending changes when it began
+_SAVEPOINTS = 'journal_savepoints'
+SNAPSHOT = 'snapshot'
+
+# View function -> journal action; other views of admin_endpoints are "admin"
+ACTIONS = {
+    'api.create_Game': 'create',
+    'api.set_game_user': 'join',
+    'api.start_game': 'start',
+    'api.roll_dice': 'roll',
+    'api.turn_dice': 'diceturn',
+    'api.undo_turn_dice': 'diceturn_undo',
+    'api.pull_up_dice_cup': 'visible',
+    'api.finish_throwing': 'finish',
+    'api.set_user_passiv': 'passive',
+    'api.distribute_chips': 'distribute',
+    'api.transfer_chips': 'chips',
+    'api.sort_dice': 'sort',
+    'api.vote_reveal_all': 'reveal',
+}
+
+_lock = threading.Lock()
+_wakeup = threading.Event()
+_queue = []
+# game_id -> entries since its last snapshot (this worker)
+_since_snapshot = {}
+_state = {'app': None, 'pid': None, 'enabled': False, 'interval': 1.0,
+          'batch': 200, 'snapshot_every': 50, 'retention': 30, 'pruned': 0.0}
+
+journal_cli = AppGroup('journal', help='Game journal.')
+
+
+# --------------- Recording ---------------
+
+def _plain(value):
+    if isinstance(value, enum.Enum):
+        return value.name
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return value
+
+
+def _columns(state, only_changed):
+    values = {}
+    for attr in state.mapper.column_attrs:
+        if only_changed:
+            history = state.attrs[attr.key].history
+            if history.added:
+                values[attr.key] = _plain(history.added[0])
+        elif attr.key in state.dict:
+            values[attr.key] = _plain(state.dict[attr.key])
+    return values
+
+
+def _after_flush(session, flush_context):
+    if not _state['enabled']:
+        return
+    from app.models import Game, User
+    changes = None
+    for obj, deleted in [(o, False) for o in session.new | session.dirty] + \
+            [(o, True) for o in session.deleted]:
+        if not isinstance(obj, (Game, User)):
+            continue
+        state = inspect(obj)
+        game_id = state.dict.get('id' if isinstance(obj, Game) else 'game_id')
+        if game_id is None:
+            continue
+        values = {} if deleted else _columns(state, only_changed=obj not in session.new)
+        if not values and not deleted:
+            continue
+        if changes is None:
+            changes = session.info.setdefault(_PENDING, {})
+            # Known only now: the commit may come after the request (game_actor)
+            action = _action()
+        delta = changes.setdefault((game_id,) + action, {})
+        if isinstance(obj, Game):
+            if deleted:
+                delta['gdel'] = True
+            else:
+                delta.setdefault('g', {}).update(values)
+        elif deleted:
+            delta.setdefault('del', []).append(state.dict.get('id'))
+            delta.get('u', {}).pop(str(state.dict.get('id')), None)
+        else:
+            delta.setdefault('u', {}).setdefault(str(obj.id), {}).update(values)
+
+
+def _action():
+    if not has_request_context():
+        return 'system', None
+    actor = (request.view_args or {}).get('uid')
+    try:
+        actor = int(actor) if actor is not None else None
+    except ValueError:
+        actor = None
+    socket_event = getattr(request, 'event', None)
+    if socket_event:
+        return 'socket:' + str(socket_event.get('message'))[:13], actor
+    action = ACTIONS.get(request.endpoint)
+    if action is None:
+        from flask import current_app
+        view = current_app.view_functions.get(request.endpoint)
+        action = 'admin' if getattr(view, '__module__', '').endswith('admin_endpoints') \
+            else (request.endpoint or 'unknown').split('.')[-1][:20]
+    return action, actor
+
+
+def _after_commit(session):
+    # Releasing a savepoint fires after_commit as well; the changes are
+    # only committed with the outermost transaction
+    if session.in_nested_transaction():
+        return
+    session.info.pop(_SAVEPOINTS, None)
+    changes = session.info.pop(_PENDING, None)
+    if not changes:
+        return
+    ts = int(time.time() * 1000)
+    entries = [{'game_id': game_id, 'ts': ts, 'action': action, 'actor': actor,
+                'data': json.dumps(delta, separators=(',', ':'), default=str)}
+               for (game_id, action, actor), delta in changes.items()]
+    with _lock:
+        _ensure_writer()
+        _queue.extend(entries)
+        if len(_queue) >= _state['batch']:
+            _wakeup.set()
+
+
+def _after_rollback(session):
+    # A savepoint rollback fires this as well; _after_soft_rollback handles it
+    if session.in_nested_transaction():
+        return
+    session.info.pop(_PENDING, None)
+    session.info.pop(_SAVEPOINTS, None)
+
+
+def _after_transaction_create(session, transaction):
+    if transaction.nested:
+        session.info.setdefault(_SAVEPOINTS, {})[transaction] = \
+            copy.deepcopy(session.info.get(_PENDING))
+
+
+def _after_soft_rollback(session, previous_transaction):
+    # A rolled back savepoint (a command of a game_actor batch) drops the
+    # changes made since it began
+    if not previous_transaction.nested:
+        return
+    pending = session.info.get(_SAVEPOINTS, {}).pop(previous_transaction, None)
+    if pending is None:
+        session.info.pop(_PENDING, None)
+    else:
+        session.info[_PENDING] = pending
+
+
+# --------------- Writing ---------------
+
+def _ensure_writer():
+    # Called with _lock held; a forked worker starts its own writer
+    if _state['pid'] == os.getpid():
+        return
+    _state['pid'] = os.getpid()
+    del _queue[:]
+    _since_snapshot.clear()
+    threading.Thread(target=_write_loop, daemon=True).start()
+
+
+def _snapshot_entry(conn, game_id):
+    from app.models import Game, User
+    game = conn.execute(select(Game.__table__).where(Game.id == game_id)).mappings().first()
+    if game is None:
+        return None
+    users = conn.execute(select(User.__table__).where(User.game_id == game_id)).mappings()
+    data = {'g': {k: _plain(v) for k, v in game.items()},
+            'u': {str(u['id']): {k: _plain(v) for k, v in u.items()} for u in users}}
+    return {'game_id': game_id, 'ts': int(time.time() * 1000), 'action': SNAPSHOT,
+            'actor': None, 'data': json.dumps(data, separators=(',', ':'), default=str)}
+
+
+def flush():
+    """Write the queued entries (and due snapshots) now."""
+    from app.models import GameJournal
+    with _lock:
+        entries = _queue[:]
+        del _queue[:]
+    if not entries:
+        return 0
+    table = GameJournal.__table__
+    with _state['app'].app_context():
+        with db.engine.begin() as conn:
+            conn.execute(table.insert(), entries)
+        due = []
+        for entry in entries:
+            count = _since_snapshot.get(entry['game_id'], 0) + 1
+            _since_snapshot[entry['game_id']] = count
+            if count >= _state['snapshot_every'] and entry['game_id'] not in due:
+                due.append(entry['game_id'])
+        if due:
+            with db.engine.begin() as conn:
+                snapshots = [s for s in (_snapshot_entry(conn, g) for g in due) if s]
+                if snapshots:
+                    conn.execute(table.insert(), snapshots)
+            for game_id in due:
+                _since_snapshot.pop(game_id, None)
+        _prune(table)
+    return len(entries)
+
+
+def _prune(table):
+    now = time.time()
+    if now - _state['pruned'] < 3600:
+        return
+    _state['pruned'] = now
+    cutoff = int((now - _state['retention'] * 86400) * 1000)
+    with db.engine.begin() as conn:
+        conn.execute(table.delete().where(table.c.ts < cutoff))
+
+
+@atexit.register
+def _flush_at_exit():
+    if _state['pid'] == os.getpid():
+        try:
+            flush()
+        except Exception:
+            logger.exception('Writing the game journal failed')
+
+
+def _write_loop():
+    while True:
+        _wakeup.wait(_state['interval'])
+        _wakeup.clear()
+        try:
+            flush()
+        except Exception:
+            logger.exception('Writing the game journal failed')
+
+
+# --------------- Replay ---------------
+
+def _apply(game, entry):
+    data = json.loads(entry['data'])
+    if entry['action'] == SNAPSHOT:
+        game['game'] = data['g']
+        game['users'] = data['u']
+        return
+    if data.get('gdel'):
+        game['game'] = None
+    if 'g' in data:
+        game['game'] = dict(game['game'] or {}, **data['g'])
+    for user_id, values in data.get('u', {}).items():
+        game['users'].setdefault(user_id, {}).update(values)
+    for user_id in data.get('del', ()):
+        game['users'].pop(str(user_id), None)
+
+
+def entries(game_id, until=None):
+    """Journal entries of a game (oldest first), up to the ms timestamp until."""
+    from app.models import GameJournal
+    table = GameJournal.__table__
+    query = select(table).where(table.c.game_id == game_id)
+    if until is not None:
+        query = query.where(table.c.ts <= until)
+    return [dict(r) for r in db.session.execute(
+        query.order_by(table.c.ts, table.c.id)).mappings()]
+
+
+def replay(game_id, until=None, steps=None):
+    """State of a game ({'game': columns, 'users': {id: columns}, 'ts',
+    'action'}) at the ms timestamp until or after the first steps actions."""
+    from app.models import GameJournal
+    table = GameJournal.__table__
+    start = None
+    if steps is None:
+        query = select(table).where(table.c.game_id == game_id,
+                                    table.c.action == SNAPSHOT)
+        if until is not None:
+            query = query.where(table.c.ts <= until)
+        start = db.session.execute(
+            query.order_by(table.c.ts.desc(), table.c.id.desc()).limit(1)).mappings().first()
+    game = {'game': None, 'users': {}, 'ts': None, 'action': None}
+    history = entries(game_id, until)
+    if start is not None:
+        _apply(game, start)
+        game['ts'], game['action'] = start['ts'], SNAPSHOT
+        history = [e for e in history if e['ts'] > start['ts']]
+    applied = 0
+    for entry in history:
+        if entry['action'] == SNAPSHOT:
+            continue
+        if steps is not None and applied >= steps:
+            break
+        _apply(game, entry)
+        game['ts'], game['action'] = entry['ts'], entry['action']
+        applied += 1
+    return game
+
+
+def _game_id(game):
+    from app.models import Game
+    if game.isdigit():
+        return int(game)
+    found = Game.query.filter_by(UUID=game).first()
+    if found is None:
+        raise click.ClickException('Spiel nicht gefunden')
+    return found.id
+
+
+@journal_cli.command('show')
+@click.argument('game')
+def show_command(game):
+    """List the journaled actions of a game (id or UUID)."""
+    for entry in entries(_game_id(game)):
+        click.echo('{} {:<14} {:>6} {}'.format(
+            datetime.datetime.fromtimestamp(entry['ts'] / 1000).isoformat(timespec='milliseconds'),
+            entry['action'], entry['actor'] or '', entry['data'] if entry['action'] != SNAPSHOT else ''))
+
+
+@journal_cli.command('replay')
+@click.argument('game')
+@click.option('--at', 'at', help='Point in time (ISO format, local time).')
+@click.option('--steps', type=int, help='Number of actions to replay.')
+def replay_command(game, at, steps):
+    """Print a game as it was at a point in time / after some actions."""
+    until = int(datetime.datetime.fromisoformat(at).timestamp() * 1000) if at else None
+    click.echo(json.dumps(replay(_game_id(game), until, steps), indent=1, sort_keys=True))
+
+
+def init_app(app):
+    """Register the session events and "flask journal"."""
+    _state['app'] = app
+    _state['enabled'] = app.config.get('JOURNAL', True)
+    _state['interval'] = app.config.get('JOURNAL_FLUSH_INTERVAL', 1.0)
+    _state['batch'] = app.config.get('JOURNAL_BATCH_SIZE', 200)
+    _state['snapshot_every'] = app.config.get('JOURNAL_SNAPSHOT_EVERY', 50)
+    _state['retention'] = app.config.get('JOURNAL_RETENTION_DAYS', 30)
+    app.cli.add_command(journal_cli)
+    if not event.contains(Session, 'after_flush', _after_flush):
+        event.listen(Session, 'after_flush', _after_flush)
+        event.listen(Session, 'after_commit', _after_commit)
+        event.listen(Session, 'after_rollback', _after_rollback)
+        event.listen(Session, 'after_transaction_create', _after_transaction_create)
+        event.listen(Session, 'after_soft_rollback', _after_soft_rollback)
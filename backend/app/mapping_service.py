@@ -0,0 +1,187 @@
+"""
+mapping_service.py
+====================================
+Bulk nick-to-person mapping for the game protocol.
+Upserts NickMapping rows with one dialect specific INSERT ... ON
+CONFLICT / ON DUPLICATE KEY UPDATE statement, sets the person of all
+affected GameLogPlayer rows with one UPDATE and recomputes
+GameLog.mapping_complete in SQL, instead of one query per player.
+
+Nick resolutions are cached per worker for NICK_CACHE_TTL seconds,
+including nicks without a mapping. The entries belong to the protokoll
+data version of stats_cache, which every commit writing NickMapping or
+Person bumps for all workers, so a mapping change is seen by the next
+resolution in every worker.
+"""
+import threading
+import time
+
+from flask import current_app
+
+from app import db, metrics, stats_cache
+from app.models import GameLog, GameLogPlayer, NickMapping, Person
+
+# Maximum number of values per IN list / multi-row INSERT
+CHUNK_SIZE = 500
+# Resolved nicks kept per worker before the cache is emptied
+MAX_CACHED_NICKS = 2048
+
+NICK_CACHE = metrics.Counter(
+    'teleschocken_nick_cache_total', 'Nick resolution cache lookups by result',
+    ('result',))
+
+_lock = threading.Lock()
+# nick -> (expires, data version, (person_id, person_name) or None)
+_resolved = {}
+
+
+def _chunks(values):
+    values = list(values)
+    for i in range(0, len(values), CHUNK_SIZE):
+        yield values[i:i + CHUNK_SIZE]
+
+
+# --------------- Resolution cache ---------------
+
+def resolve_nicks(nicks):
+    """Return {nick: (person_id, person_name)} for the mapped nicks among
+    nicks. Unknown nicks are missing from the result."""
+    nicks = set(nicks)
+    now = time.monotonic()
+    version = stats_cache.data_version()
+    result = {}
+    missing = []
+    with _lock:
+        for nick in nicks:
+            entry = _resolved.get(nick)
+            if entry is not None and entry[0] > now and entry[1] == version:
+                if entry[2] is not None:
+                    result[nick] = entry[2]
+            else:
+                missing.append(nick)
+    if len(missing) < len(nicks):
+        NICK_CACHE.inc('hit', amount=len(nicks) - len(missing))
+    if not missing:
+        return result
+
+    NICK_CACHE.inc('miss', amount=len(missing))
+    found = {}
+    for chunk in _chunks(missing):
+        for nick, person_id, name in db.session.query(
+                NickMapping.nick, Person.id, Person.name).join(
+                Person, Person.id == NickMapping.person_id).filter(
+                NickMapping.nick.in_(chunk)):
+            found[nick] = (person_id, name)
+    expires = now + current_app.config.get('NICK_CACHE_TTL', 60)
+    with _lock:
+        if len(_resolved) + len(missing) > MAX_CACHED_NICKS:
+            _resolved.clear()
+        for nick in missing:
+            # Read before the query: a commit in between makes them stale
+            _resolved[nick] = (expires, version, found.get(nick))
+    result.update(found)
+    return result
+
+
+def resolve_nick(nick):
+    """Return (person_id, person_name) for a mapped nick, else None."""
+    return resolve_nicks([nick]).get(nick)
+
+
+def lookup_person_ids(nicks):
+    """Return {nick: person_id} for the mapped nicks among nicks."""
+    return {nick: person[0] for nick, person in resolve_nicks(nicks).items()}
+
+
+def clear_resolution_cache():
+    with _lock:
+        _resolved.clear()
+
+
+stats_cache.watch_commits((NickMapping, Person), clear_resolution_cache)
+
+
+# --------------- Bulk writes ---------------
+
+
+def _upsert_statement(rows, overwrite):
+    dialect = db.session.get_bind(mapper=NickMapping).dialect.name
+    if dialect == 'mysql':
+        from sqlalchemy.dialects.mysql import insert
+        stmt = insert(NickMapping).values(rows)
+        return stmt.on_duplicate_key_update(
+            person_id=stmt.inserted.person_id if overwrite else NickMapping.person_id)
+    if dialect in ('sqlite', 'postgresql'):
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+        stmt = insert(NickMapping).values(rows)
+        if overwrite:
+            return stmt.on_conflict_do_update(
+                index_elements=[NickMapping.nick],
+                set_={'person_id': stmt.excluded.person_id})
+        return stmt.on_conflict_do_nothing(index_elements=[NickMapping.nick])
+    return None
+
+
+def upsert_nick_mappings(mappings, overwrite=True):
+    """Store {nick: person_id}; nicks mapped to None are skipped.
+    Without overwrite, existing mappings of a nick are kept."""
+    mappings = {nick: pid for nick, pid in mappings.items() if pid}
+    for chunk in _chunks(mappings):
+        rows = [{'nick': nick, 'person_id': mappings[nick]} for nick in chunk]
+        stmt = _upsert_statement(rows, overwrite)
+        if stmt is not None:
+            db.session.execute(stmt)
+            continue
+        # Other databases: one SELECT, then bulk INSERT / UPDATE
+        existing = dict(db.session.query(NickMapping.nick, NickMapping.id).filter(
+            NickMapping.nick.in_(chunk)).all())
+        new_rows = [r for r in rows if r['nick'] not in existing]
+        if new_rows:
+            db.session.execute(db.insert(NickMapping), new_rows)
+        if overwrite:
+            updates = [{'id': existing[r['nick']], 'person_id': r['person_id']}
+                       for r in rows if r['nick'] in existing]
+            if updates:
+                db.session.execute(db.update(NickMapping), updates)
+
+
+def recompute_mapping_complete(log_ids):
+    """Set mapping_complete of the given logs from their players, in SQL:
+    a log is complete when none of its players lacks a person."""
+    unmapped = db.select(GameLogPlayer.id).where(
+        GameLogPlayer.game_log_id == GameLog.id,
+        GameLogPlayer.person_id.is_(None)).exists()
+    for chunk in _chunks(log_ids):
+        GameLog.query.filter(GameLog.id.in_(chunk)).update(
+            {'mapping_complete': ~unmapped}, synchronize_session=False)
+
+
+def apply_nick_mappings(mappings, log_ids=None):
+    """Assign {nick: person_id_or_None} to the players of the given logs
+    (all logs if log_ids is None), store the non-empty mappings as
+    NickMapping and fix mapping_complete of every affected log.
+    Returns the ids of the affected logs."""
+    if not mappings:
+        return []
+    upsert_nick_mappings(mappings)
+
+    affected = set()
+    for nicks in _chunks(mappings):
+        players = GameLogPlayer.query.filter(GameLogPlayer.nick.in_(nicks))
+        if log_ids is not None:
+            players = players.filter(GameLogPlayer.game_log_id.in_(log_ids))
+        affected.update(r[0] for r in players.with_entities(
+            GameLogPlayer.game_log_id).distinct().all())
+        players.update(
+            {'person_id': db.case(
+                {nick: mappings[nick] for nick in nicks},
+                value=GameLogPlayer.nick, else_=GameLogPlayer.person_id)},
+            synchronize_session=False)
+
+    affected = sorted(affected)
+    recompute_mapping_complete(affected)
+    return affected
+
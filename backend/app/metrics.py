@@ -0,0 +1,406 @@
+"""
+metrics.py
+====================================
+Low-overhead in-process counters, gauges and histograms with a
+Prometheus text exposition on /metrics.
+Every worker process periodically writes a snapshot of its values to
+RUNTIME_DIR/metrics/<pid>.json; the worker answering the scrape merges
+all snapshots so the numbers are correct under gunicorn with several
+workers. Counters of exited workers are kept in _dead.json.
+"""
+import contextlib
+import hmac
+import json
+import os
+import tempfile
+import threading
+import time
+
+_lock = threading.Lock()
+_registry = []
+_collectors = []
+
+_config = {
+    'dir': os.path.join(os.environ.get('TELESCHOCKEN_RUNTIME_DIR') or
+                        os.path.join(tempfile.gettempdir(), 'teleschocken'), 'metrics'),
+    'flush_interval': 5.0,
+}
+_flusher_pid = None
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BYTE_BUCKETS = (256, 1024, 2048, 4096, 8192, 16384, 32768, 65536, 131072)
+
+
+class _Metric(object):
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        _registry.append(self)
+
+    def _key(self, labels):
+        if len(labels) != len(self.labelnames):
+            raise ValueError('{} expects labels {}'.format(self.name, self.labelnames))
+        return tuple(str(v) for v in labels)
+
+    def snapshot(self):
+        with _lock:
+            return [[list(k), _copy(v)] for k, v in self._values.items()]
+
+
+def _copy(value):
+    return list(value) if isinstance(value, list) else value
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+        _ensure_flusher()
+
+
+class Gauge(_Metric):
+    """A per-process value; the values of all live workers are summed."""
+    kind = 'gauge'
+
+    def set(self, value, *labels):
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = value
+        _ensure_flusher()
+
+    def inc(self, *labels, amount=1):
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+        _ensure_flusher()
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        key = self._key(labels)
+        with _lock:
+            # [bucket counts..., +Inf count, sum]
+            data = self._values.get(key)
+            if data is None:
+                data = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    data[i] += 1
+                    break
+            else:
+                data[len(self.buckets)] += 1
+            data[-1] += value
+        _ensure_flusher()
+
+    def time(self, *labels):
+        """Context manager / decorator that observes the elapsed seconds."""
+        return _TimerDecorator(self, labels)
+
+
+class _TimerDecorator(contextlib.ContextDecorator):
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self._start, *self.labels)
+        return False
+
+
+def collector(f):
+    """Register a function that refreshes gauges before each flush/scrape."""
+    _collectors.append(f)
+    return f
+
+
+# --------------- Metric definitions ---------------
+
+HTTP_REQUESTS = Counter(
+    'teleschocken_http_requests_total', 'HTTP requests by endpoint',
+    ('endpoint', 'method', 'status'))
+HTTP_DURATION = Histogram(
+    'teleschocken_http_request_duration_seconds', 'HTTP request latency',
+    ('endpoint',))
+SOCKET_EVENTS = Counter(
+    'teleschocken_socketio_events_total', 'Received Socket.IO events',
+    ('event',))
+SOCKET_DURATION = Histogram(
+    'teleschocken_socketio_event_duration_seconds', 'Socket.IO handler latency',
+    ('event',))
+SOCKET_EMIT_BYTES = Histogram(
+    'teleschocken_socketio_emit_bytes', 'Encoded size of emitted Socket.IO events',
+    ('event',), buckets=BYTE_BUCKETS)
+SOCKET_CLIENTS = Gauge(
+    'teleschocken_socketio_connected_clients', 'Connected Socket.IO clients')
+SOCKET_ROOMS = Gauge(
+    'teleschocken_socketio_rooms', 'Socket.IO game rooms with listeners')
+DB_TIME = Histogram(
+    'teleschocken_db_time_seconds', 'SQL time spent per request or socket event',
+    ('endpoint',))
+DB_QUERIES = Counter(
+    'teleschocken_db_queries_total', 'SQL statements executed', ('endpoint',))
+DICE_ROLLS = Counter(
+    'teleschocken_dice_rolls_total', 'Dice rolls')
+SCORING_DURATION = Histogram(
+    'teleschocken_scoring_duration_seconds', 'Time spent in calculate_scoring',
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1))
+
+
+# --------------- Multi-process snapshots ---------------
+
+def _snapshot_path(pid):
+    return os.path.join(_config['dir'], '{}.json'.format(pid))
+
+
+def _run_collectors():
+    for f in _collectors:
+        try:
+            f()
+        except Exception:
+            pass
+
+
+def _local_snapshot():
+    return {m.name: m.snapshot() for m in _registry}
+
+
+def flush():
+    """Write this process' snapshot so other workers can serve it."""
+    _run_collectors()
+    data = json.dumps(_local_snapshot())
+    os.makedirs(_config['dir'], exist_ok=True)
+    path = _snapshot_path(os.getpid())
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def _flush_loop():
+    while True:
+        time.sleep(_config['flush_interval'])
+        try:
+            flush()
+        except Exception:
+            pass
+
+
+def _ensure_flusher():
+    global _flusher_pid
+    if _flusher_pid == os.getpid():
+        return
+    _flusher_pid = os.getpid()
+    threading.Thread(target=_flush_loop, daemon=True).start()
+
+
+def mark_process_dead(pid):
+    """Called from gunicorn's child_exit: keep counters, drop gauges."""
+    path = _snapshot_path(pid)
+    try:
+        with open(path) as f:
+            dead = json.load(f)
+    except (OSError, ValueError):
+        return
+    archive_path = os.path.join(_config['dir'], '_dead.json')
+    try:
+        with open(archive_path) as f:
+            archive = json.load(f)
+    except (OSError, ValueError):
+        archive = {}
+    kinds = {m.name: m.kind for m in _registry}
+    for name, samples in dead.items():
+        if kinds.get(name) == 'gauge':
+            continue
+        merged = _merge_samples([archive.get(name, []), samples])
+        archive[name] = [[list(k), v] for k, v in merged.items()]
+    with open(archive_path + '.tmp', 'w') as f:
+        json.dump(archive, f)
+    os.replace(archive_path + '.tmp', archive_path)
+    os.remove(path)
+
+
+def _merge_samples(sample_lists):
+    merged = {}
+    for samples in sample_lists:
+        for labels, value in samples:
+            key = tuple(labels)
+            if key not in merged:
+                merged[key] = _copy(value)
+            elif isinstance(value, list):
+                merged[key] = [a + b for a, b in zip(merged[key], value)]
+            else:
+                merged[key] += value
+    return merged
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(int(pid), 0)
+    except (ValueError, ProcessLookupError):
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def reset():
+    """Forget this process' values, e.g. those a forked worker inherited."""
+    with _lock:
+        for metric in _registry:
+            metric._values.clear()
+
+
+def clear():
+    """Remove all snapshots, e.g. when the gunicorn master starts."""
+    try:
+        names = os.listdir(_config['dir'])
+    except OSError:
+        return
+    for name in names:
+        try:
+            os.remove(os.path.join(_config['dir'], name))
+        except OSError:
+            pass
+
+
+def _all_snapshots():
+    snapshots = [_local_snapshot()]
+    own = '{}.json'.format(os.getpid())
+    try:
+        names = os.listdir(_config['dir'])
+    except OSError:
+        names = []
+    for name in names:
+        if not name.endswith('.json') or name == own:
+            continue
+        if name != '_dead.json' and not _pid_alive(name[:-len('.json')]):
+            continue
+        try:
+            with open(os.path.join(_config['dir'], name)) as f:
+                snapshots.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return snapshots
+
+
+# --------------- Exposition ---------------
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(
+        k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for k, v in pairs) + '}'
+
+
+def _game_lines():
+    """Database wide values; queried per scrape instead of summed per worker."""
+    from sqlalchemy import func
+    from app import db
+    from app.models import Game
+    lines = ['# HELP teleschocken_games Games in the database by status',
+             '# TYPE teleschocken_games gauge']
+    rows = db.session.query(Game.status, func.count(Game.id)).group_by(Game.status).all()
+    for status, count in rows:
+        lines.append('teleschocken_games{}'.format(
+            _format_labels(('status',), (status.value if status else 'none',))) +
+            ' {}'.format(count))
+    return lines
+
+
+def generate_latest():
+    """Return all metrics of all workers in Prometheus text format."""
+    _run_collectors()
+    snapshots = _all_snapshots()
+    lines = []
+    for metric in _registry:
+        merged = _merge_samples([s.get(metric.name, []) for s in snapshots])
+        lines.append('# HELP {} {}'.format(metric.name, metric.documentation))
+        lines.append('# TYPE {} {}'.format(metric.name, metric.kind))
+        for labels, value in sorted(merged.items()):
+            if metric.kind == 'histogram':
+                cumulative = 0
+                for bound, count in zip(metric.buckets + ('+Inf',), value[:-1]):
+                    cumulative += count
+                    lines.append('{}_bucket{} {}'.format(
+                        metric.name,
+                        _format_labels(metric.labelnames, labels, ('le', bound)),
+                        cumulative))
+                lines.append('{}_sum{} {}'.format(
+                    metric.name, _format_labels(metric.labelnames, labels), value[-1]))
+                lines.append('{}_count{} {}'.format(
+                    metric.name, _format_labels(metric.labelnames, labels), cumulative))
+            else:
+                lines.append('{}{} {}'.format(
+                    metric.name, _format_labels(metric.labelnames, labels), value))
+    try:
+        lines.extend(_game_lines())
+    except Exception:
+        pass
+    return '\n'.join(lines) + '\n'
+
+
+class EmitSizeJSON(object):
+    """json module for Socket.IO that records the encoded size per event."""
+
+    @staticmethod
+    def dumps(obj, *args, **kwargs):
+        encoded = json.dumps(obj, *args, **kwargs)
+        if isinstance(obj, list) and obj and isinstance(obj[0], str):
+            SOCKET_EMIT_BYTES.observe(len(encoded), obj[0])
+        return encoded
+
+    @staticmethod
+    def loads(*args, **kwargs):
+        return json.loads(*args, **kwargs)
+
+
+def configure(runtime_dir):
+    """Use RUNTIME_DIR/metrics; the gunicorn master must agree with the workers."""
+    if runtime_dir:
+        _config['dir'] = os.path.join(runtime_dir, 'metrics')
+
+
+def init_app(app):
+    """Configure the snapshot directory and register /metrics."""
+    from flask import Response, request, session
+
+    configure(app.config.get('RUNTIME_DIR'))
+    _config['flush_interval'] = app.config.get('METRICS_FLUSH_INTERVAL', 5.0)
+
+    def metrics_view():
+        # The bearer token of the scraper or a protokoll login; nothing else,
+        # every scrape also queries the database
+        token = app.config.get('METRICS_TOKEN')
+        if not (token and hmac.compare_digest(request.headers.get('Authorization', ''),
+                                              'Bearer {}'.format(token))) \
+                and not session.get('protokoll_auth', False):
+            return Response('Unauthorized\n', status=401, mimetype='text/plain')
+        return Response(generate_latest(),
+                        mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
@@ -273,3 +273,16 @@ class NickMapping(db.Model):
     nick = db.Column(db.String(200), unique=True, index=True)
     person_id = db.Column(db.Integer, db.ForeignKey('person.id'), nullable=False)
     person = db.relationship('Person')
+
+
+class GameJournal(db.Model):
+    """Append-only journal of a game (see app/journal.py): the changed
+    columns of each committed action, or a full snapshot."""
+    id = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True)
+    game_id = db.Column(db.Integer, nullable=False)
+    # Milliseconds since the epoch
+    ts = db.Column(db.BigInteger, nullable=False)
+    action = db.Column(db.String(20), nullable=False)
+    actor = db.Column(db.Integer)
+    data = db.Column(db.Text, nullable=False)
+    __table_args__ = (db.Index('ix_game_journal_game_ts', 'game_id', 'ts'),)
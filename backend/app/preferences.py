@@ -0,0 +1,102 @@
+"""
+preferences.py
+====================================
+Per-nick preference bundle for the game page: personal sound URLs, the
+nick's keyboard bindings and the saved bindings of all persons (for the
+"load from" menu) in one payload with an ETag.
+Decoded bindings are held in memory and rebuilt when the protokoll data
+version changes, i.e. after any Person or NickMapping write in any
+worker. save_keybindings() also invalidates them directly.
+"""
+import hashlib
+import json
+import threading
+
+from app import db, stats_cache, mapping_service, audio_manifest
+from app.models import Person
+
+# Preference payloads kept per worker before the cache is emptied
+MAX_CACHED_NICKS = 1024
+
+_lock = threading.Lock()
+_state = {'key': None, 'persons': None}
+# nick -> (key, payload, etag)
+_payloads = {}
+
+
+def _cache_key():
+    return (stats_cache.data_version(), audio_manifest.version())
+
+
+def invalidate():
+    with _lock:
+        _state['key'] = None
+        _state['persons'] = None
+        _payloads.clear()
+
+
+def _check_key():
+    key = _cache_key()
+    with _lock:
+        changed = key != _state['key']
+        if changed:
+            _state['key'] = key
+            _state['persons'] = None
+            _payloads.clear()
+    if changed:
+        # Mappings may have changed in another worker
+        mapping_service.clear_resolution_cache()
+    return key
+
+
+def persons_with_bindings():
+    """[{id, name, bindings}] of all persons with saved keyboard bindings."""
+    _check_key()
+    persons = _state['persons']
+    if persons is not None:
+        return persons
+    rows = db.session.query(Person.id, Person.name, Person.keyboard_bindings).filter(
+        Person.keyboard_bindings.isnot(None),
+        Person.keyboard_bindings != ''
+    ).order_by(Person.name).all()
+    persons = []
+    for pid, name, raw in rows:
+        try:
+            bindings = json.loads(raw)
+        except (ValueError, TypeError):
+            continue
+        persons.append({'id': pid, 'name': name, 'bindings': bindings})
+    _state['persons'] = persons
+    return persons
+
+
+def get_preferences(nick):
+    """Return (payload, etag) for a nick (may be empty for anonymous users)."""
+    key = _check_key()
+    with _lock:
+        cached = _payloads.get(nick)
+    if cached is not None and cached[0] == key:
+        return cached[1], cached[2]
+
+    persons = persons_with_bindings()
+    person = mapping_service.resolve_nick(nick) if nick else None
+    bindings = None
+    if person:
+        for p in persons:
+            if p['id'] == person[0]:
+                bindings = p['bindings']
+                break
+    payload = {
+        'nick': nick,
+        'person_id': person[0] if person else None,
+        'person_name': person[1] if person else None,
+        'sounds': audio_manifest.sound_urls(person[1] if person else None),
+        'bindings': bindings,
+        'persons': persons,
+    }
+    etag = hashlib.sha1(json.dumps(payload, sort_keys=True).encode('utf-8')).hexdigest()
+    with _lock:
+        if len(_payloads) >= MAX_CACHED_NICKS:
+            _payloads.clear()
+        _payloads[nick] = (key, payload, etag)
+    return payload, etag
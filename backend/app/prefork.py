@@ -0,0 +1,87 @@
+"""
+prefork.py
+====================================
+Support for gunicorn's preload_app.
+The master builds the app once and forks the workers, which then share
+its memory copy-on-write. State that must not be shared is set up again
+in every worker:
+- after_fork() (gunicorn post_fork): drop the SQLAlchemy connections
+  inherited from the master, reseed the RNG, forget metric values and
+  Socket.IO clients of the master
+- start_worker() (post_worker_init, after gevent re-initialised the hub):
+  start the background threads registered with per_worker()
+warm_up() fills the shared caches in the master (templates, rulesets and
+their complete rule tables, SQLAlchemy mappers); freeze() moves all
+objects into gc's permanent generation so collections in the workers do
+not write to (and thereby copy) the shared pages.
+"""
+import gc
+import os
+import random
+
+# Set by gunicorn.conf.py to the master's pid when preload_app is on
+PRELOAD_ENV = 'TELESCHOCKEN_PRELOAD_PID'
+
+_per_worker = []
+
+
+def preloading():
+    """True while running in the gunicorn master of a preload_app setup."""
+    return os.environ.get(PRELOAD_ENV) == str(os.getpid())
+
+
+def per_worker(fn):
+    """Run fn() now, or in every worker (start_worker) when preloading."""
+    if preloading():
+        _per_worker.append(fn)
+    else:
+        fn()
+
+
+def warm_up(app):
+    """Load everything the workers only read into the master."""
+    from sqlalchemy.orm import configure_mappers
+    from app import rulesets
+
+    for name in app.jinja_env.list_templates():
+        if name.endswith('.html'):
+            app.jinja_env.get_template(name)
+    rulesets.compile_all()
+    configure_mappers()
+
+
+def freeze():
+    """Call in the master right before forking."""
+    gc.collect()
+    gc.freeze()
+
+
+def _reset_socketio():
+    from app import socketio
+
+    eio = socketio.server.eio
+    eio.sockets.clear()
+    if eio.service_task_handle is not None:
+        eio.service_task_handle = None
+        eio.service_task_event = None
+        eio.start_service_task = True
+    socketio.server.manager.rooms.clear()
+
+
+def after_fork(app):
+    """Fork hygiene, first thing in a new worker."""
+    from app import db, metrics
+
+    with app.app_context():
+        for engine in db.engines.values():
+            # Keep the master's sockets open for it, just forget them here
+            engine.dispose(close=False)
+    random.seed()
+    metrics.reset()
+    _reset_socketio()
+
+
+def start_worker():
+    """Start the per-worker background work deferred by per_worker()."""
+    for fn in _per_worker:
+        fn()
@@ -0,0 +1,215 @@
+"""
+profiling.py
+====================================
+On-demand cProfile sampling of production requests.
+Protokoll admins switch it on for selected endpoints and/or a random
+sample rate. The settings live in RUNTIME_DIR/profiles/settings.json so
+every worker picks them up; profiles are written as .pstats files into a
+bounded ring in the same directory.
+cProfile measures the whole worker thread; under gevent a greenlet
+tracer pauses it while other greenlets run, so a profile only covers its
+request (waits show up as the switch to the hub). game_actor commands run
+in the game's worker greenlet and are not part of the request's profile.
+One request per worker is profiled at a time.
+"""
+import cProfile
+import json
+import os
+import random
+import re
+import time
+
+from flask import g, request
+
+try:
+    import greenlet
+except ImportError:  # pragma: no cover - threaded server without gevent
+    greenlet = None
+
+DEFAULT_SETTINGS = {
+    'enabled': False,
+    'endpoints': [],
+    'sample_rate': 0.0,
+}
+
+_state = {
+    'dir': None,
+    'ring_size': 50,
+    'settings': dict(DEFAULT_SETTINGS),
+    'checked': 0.0,
+    'mtime': None,
+    'active': False,
+}
+
+_SETTINGS_CHECK_INTERVAL = 2.0
+_PROFILE_NAME = re.compile(r'^[\w.\-]+\.pstats$')
+
+
+def _settings_path():
+    return os.path.join(_state['dir'], 'settings.json')
+
+
+def get_settings():
+    """Return the current settings, re-reading the shared file every few seconds."""
+    now = time.monotonic()
+    if now - _state['checked'] < _SETTINGS_CHECK_INTERVAL:
+        return _state['settings']
+    _state['checked'] = now
+    try:
+        mtime = os.stat(_settings_path()).st_mtime_ns
+    except OSError:
+        _state['settings'] = dict(DEFAULT_SETTINGS)
+        _state['mtime'] = None
+        return _state['settings']
+    if mtime != _state['mtime']:
+        try:
+            with open(_settings_path()) as f:
+                settings = dict(DEFAULT_SETTINGS)
+                settings.update(json.load(f))
+            _state['settings'] = settings
+            _state['mtime'] = mtime
+        except (OSError, ValueError):
+            pass
+    return _state['settings']
+
+
+def save_settings(data):
+    """Validate and store new settings for all workers. Returns the settings."""
+    settings = dict(get_settings())
+    if 'enabled' in data:
+        settings['enabled'] = bool(data['enabled'])
+    if 'endpoints' in data:
+        settings['endpoints'] = [str(e) for e in (data['endpoints'] or [])]
+    if 'sample_rate' in data:
+        settings['sample_rate'] = min(max(float(data['sample_rate'] or 0), 0.0), 1.0)
+    os.makedirs(_state['dir'], exist_ok=True)
+    tmp = _settings_path() + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(settings, f)
+    os.replace(tmp, _settings_path())
+    _state['settings'] = settings
+    _state['checked'] = 0.0
+    return settings
+
+
+def _should_profile():
+    settings = get_settings()
+    if not settings['enabled'] or _state['active']:
+        return False
+    if request.endpoint in settings['endpoints'] or request.path in settings['endpoints']:
+        return True
+    return settings['sample_rate'] > 0 and random.random() < settings['sample_rate']
+
+
+def list_profiles():
+    """Return the stored profiles, newest first."""
+    try:
+        names = [n for n in os.listdir(_state['dir']) if _PROFILE_NAME.match(n)]
+    except OSError:
+        return []
+    result = []
+    for name in names:
+        st = os.stat(os.path.join(_state['dir'], name))
+        result.append({'name': name, 'size': st.st_size, 'created': st.st_mtime})
+    result.sort(key=lambda p: p['created'], reverse=True)
+    return result
+
+
+def profile_path(name):
+    """Return the path of a stored profile or None for unknown/unsafe names."""
+    if not _PROFILE_NAME.match(name):
+        return None
+    path = os.path.join(_state['dir'], name)
+    return path if os.path.isfile(path) else None
+
+
+def clear_profiles():
+    for p in list_profiles():
+        try:
+            os.remove(os.path.join(_state['dir'], p['name']))
+        except OSError:
+            pass
+
+
+def _prune():
+    for p in list_profiles()[_state['ring_size']:]:
+        try:
+            os.remove(os.path.join(_state['dir'], p['name']))
+        except OSError:
+            pass
+
+
+def _save(profiler, endpoint, duration):
+    os.makedirs(_state['dir'], exist_ok=True)
+    name = '{}_{}_{}_{}ms.pstats'.format(
+        time.strftime('%Y%m%d-%H%M%S'), os.getpid(),
+        re.sub(r'[^\w\-]', '-', endpoint or 'unknown'), int(duration * 1000))
+    profiler.dump_stats(os.path.join(_state['dir'], name))
+    _prune()
+
+
+def _enable(profiler):
+    try:
+        profiler.enable()
+    except ValueError:
+        # another profiler is already active in this thread
+        return False
+    return True
+
+
+def _follow_greenlet(profiler):
+    """Profile only the current greenlet; returns a function that stops it."""
+    if greenlet is None:
+        return profiler.disable
+    current = greenlet.getcurrent()
+    previous = greenlet.gettrace()
+    state = {'on': True}
+
+    def trace(event, args):
+        if state['on'] and event in ('switch', 'throw'):
+            origin, target = args
+            if origin is current:
+                profiler.disable()
+            elif target is current:
+                _enable(profiler)
+        if previous is not None:
+            previous(event, args)
+
+    def stop():
+        profiler.disable()
+        state['on'] = False
+        # A tracer installed after ours keeps calling it (as a no-op)
+        if greenlet.gettrace() is trace:
+            greenlet.settrace(previous)
+
+    greenlet.settrace(trace)
+    return stop
+
+
+def init_app(app):
+    """Register the request hooks that start and stop the profiler."""
+    _state['dir'] = os.path.join(app.config['RUNTIME_DIR'], 'profiles')
+    _state['ring_size'] = app.config.get('PROFILE_RING_SIZE', 50)
+
+    @app.before_request
+    def _start_profile():
+        if not _should_profile():
+            return
+        profiler = cProfile.Profile()
+        if not _enable(profiler):
+            return
+        _state['active'] = True
+        g._profiler = (profiler, _follow_greenlet(profiler), time.perf_counter())
+
+    @app.teardown_request
+    def _stop_profile(exc):
+        entry = g.pop('_profiler', None)
+        if entry is None:
+            return
+        profiler, stop, started = entry
+        stop()
+        _state['active'] = False
+        try:
+            _save(profiler, request.endpoint, time.perf_counter() - started)
+        except OSError as e:
+            app.logger.warning('Could not store profile: %s', e)
@@ -0,0 +1,84 @@
+"""
+rng.py
+====================================
+Random numbers of the games (dice, falling dice, random starters).
+for_game(game) normally returns the worker's BufferedSystemRandom: it
+reads os.urandom in blocks of DICE_BUFFER_BYTES instead of reseeding a
+Mersenne Twister per roll, so a die costs a byte (randint() rejects
+values above 5, every face is equally likely) and no system call.
+With DICE_SEED set every game gets its own random.Random, seeded with
+DICE_SEED and the game id: the same actions replay the same game,
+whatever else happens on the worker (tests, benchmarks).
+"""
+import collections
+import os
+import random
+import threading
+
+# Seeded games kept per worker (least recently used are dropped)
+SEEDED_GAMES = 1024
+
+_lock = threading.Lock()
+_state = {'pid': None, 'buffer': b'', 'pos': 0, 'size': 4096, 'seed': None}
+_seeded = collections.OrderedDict()
+
+
+def _take(count):
+    with _lock:
+        # A forked worker must not reuse the bytes the master read
+        if _state['pid'] != os.getpid() or \
+                _state['pos'] + count > len(_state['buffer']):
+            _state['buffer'] = os.urandom(max(_state['size'], count))
+            _state['pos'] = 0
+            _state['pid'] = os.getpid()
+        start = _state['pos']
+        _state['pos'] = start + count
+        return _state['buffer'][start:start + count]
+
+
+class BufferedSystemRandom(random.SystemRandom):
+    """SystemRandom that reads the OS source in blocks."""
+
+    def random(self):
+        # 53 random bits, like random.random()
+        return (int.from_bytes(_take(7), 'big') >> 3) * 2 ** -53
+
+    def getrandbits(self, k):
+        if k < 0:
+            raise ValueError('number of bits must be non-negative')
+        count = (k + 7) // 8
+        return int.from_bytes(_take(count), 'big') >> (count * 8 - k)
+
+
+_system = BufferedSystemRandom()
+
+
+def for_game(game):
+    """The random source for game (a random.Random)."""
+    if _state['seed'] is None:
+        return _system
+    with _lock:
+        generator = _seeded.get(game.id)
+        if generator is None:
+            generator = _seeded[game.id] = random.Random(
+                '{}:{}'.format(_state['seed'], game.id))
+            while len(_seeded) > SEEDED_GAMES:
+                _seeded.popitem(last=False)
+        else:
+            _seeded.move_to_end(game.id)
+        return generator
+
+
+def configure(seed=None, buffer_bytes=None):
+    """Switch the seeded mode on (seed) or off (None) and start over."""
+    with _lock:
+        _state['seed'] = seed
+        if buffer_bytes is not None:
+            _state['size'] = buffer_bytes
+        _state['buffer'] = b''
+        _state['pos'] = 0
+        _seeded.clear()
+
+
+def init_app(app):
+    configure(app.config.get('DICE_SEED'), app.config.get('DICE_BUFFER_BYTES', 4096))
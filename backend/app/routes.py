@@ -1,45 +1,62 @@
-from flask import render_template, redirect, url_for
+from flask import Blueprint, current_app, render_template, redirect, url_for, request
 
-from app import app, db
+from app import db, preferences
 from app.forms import CreateGameFrom
 from app.models import Game
+from app.api.game_endpoints import game_snapshot
 
+bp = Blueprint('main', __name__)
 
-@app.route('/index2')
+
+@bp.route('/index2')
 def index2():
     return render_template('index2.html')
 
 
-@app.route('/')
-@app.route('/index', methods=['GET', 'POST'])
+@bp.route('/')
+@bp.route('/index', methods=['GET', 'POST'])
 def index():
     form = CreateGameFrom()
     if form.validate_on_submit():
         game = Game()
         db.session.add(game)
         db.session.commit()
-        next_page = url_for('game')
-        next_page = url_for('game', variable=game.UUID)
+        next_page = url_for('main.game')
+        next_page = url_for('main.game', variable=game.UUID)
         return redirect(next_page)
     return render_template('index.html', title='Home', form=form)
 
 
-@app.route('/game_waiting/<gid>', methods=['GET'])
+@bp.route('/game_waiting/<gid>', methods=['GET'])
 def game(gid):
     game = Game.query.filter_by(UUID=gid).first()
     if game is None:
         return render_template('404.html')
-    return render_template('game.html', title='Spiel starten', game=game)
+    return render_template('game.html', title='Spiel starten', game=game,
+                           snapshot=_initial_state(game))
 
 
-@app.route('/game/<gid>', methods=['GET', 'POST'])
+@bp.route('/game/<gid>', methods=['GET', 'POST'])
 def game_play(gid):
     game = Game.query.filter_by(UUID=gid).first()
     if game is None:
         return render_template('404.html')
-    return render_template('gameplay.html', title='Schocken', game=game)
+    prefs = None
+    nick = request.cookies.get('ts_nick')
+    if nick and current_app.config.get('EMBED_PREFERENCES', True):
+        prefs, _ = preferences.get_preferences(nick)
+    return render_template('gameplay.html', title='Schocken', game=game,
+                           preferences=prefs, snapshot=_initial_state(game))
+
+
+def _initial_state(game):
+    """Game snapshot embedded into the page so it renders without an
+    initial /api/game request. The player is taken from the ts_uid cookie."""
+    if not current_app.config.get('EMBED_GAME_STATE', True):
+        return None
+    return game_snapshot(game, request.cookies.get('ts_uid'))
 
 
-@app.route('/protokoll')
+@bp.route('/protokoll')
 def protokoll():
     return render_template('protokoll.html', title='Protokoll')
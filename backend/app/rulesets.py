@@ -8,6 +8,8 @@ import json
 import os
 
 _rulesets_cache = None
+# ruleset id -> complete rule list (see get_complete_rules)
+_complete_rules_cache = {}
 
 
 def _load_rulesets():
@@ -67,8 +69,23 @@ def get_complete_rules(ruleset):
     return explicit_rules
 
 
+def complete_rules_for(ruleset):
+    """Cached get_complete_rules(ruleset); treat the result as read-only."""
+    rules = _complete_rules_cache.get(ruleset['id'])
+    if rules is None:
+        rules = _complete_rules_cache[ruleset['id']] = get_complete_rules(ruleset)
+    return rules
+
+
+def compile_all():
+    """Load all rulesets and build their complete rule lists."""
+    for ruleset in _load_rulesets():
+        complete_rules_for(ruleset)
+
+
 def reload_rulesets():
     """Force reload of rulesets from disk (for future admin UI)."""
     global _rulesets_cache
     _rulesets_cache = None
+    _complete_rules_cache.clear()
     return _load_rulesets()
@@ -4,7 +4,8 @@ scoring.py
 Server-side scoring logic for Schocken.
 Determines High/Low players and chip transfers based on the game's active ruleset.
 """
-from app.rulesets import get_ruleset, get_complete_rules
+from app.rulesets import get_ruleset, complete_rules_for
+from app.metrics import SCORING_DURATION
 
 
 def get_dice_value(user):
@@ -86,6 +87,7 @@ def _format_result(entry):
         entry['name'], entry['scoring']['name'], entry['number_dice'], suffix)
 
 
+@SCORING_DURATION.time()
 def calculate_scoring(game):
     """
     Calculate the scoring for a completed round.
@@ -99,7 +101,7 @@ def calculate_scoring(game):
     if ruleset is None:
         return None
 
-    complete_rules = get_complete_rules(ruleset)
+    complete_rules = complete_rules_for(ruleset)
 
     # Build list of playing users, ordered starting from first_user_id
     active = game.active_users
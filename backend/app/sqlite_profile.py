@@ -0,0 +1,162 @@
+"""
+sqlite_profile.py
+====================================
+SQLite settings for small self-hosted installs.
+Every new connection to a SQLite file gets the SQLITE_* pragmas: WAL lets
+readers continue while a game commits (the default rollback journal locks
+the whole file, so one roll_dice commit stalls all games), synchronous
+NORMAL drops the fsync per commit (WAL stays consistent, only the last
+commits can be lost on power failure), busy_timeout waits for the lock
+of another worker instead of failing and mmap_size serves reads from
+the page cache. The wait blocks the gevent hub, so keep it short.
+
+The migrations target MySQL; a SQLite file database without
+alembic_version gets its (missing) tables from create_all()
+(SQLITE_CREATE_SCHEMA).
+"flask sqlite bench" compares roll-like commits per second with the
+rollback journal and with these settings.
+"""
+import os
+import random
+import shutil
+import tempfile
+import time
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import create_engine, event, inspect, select
+
+from app import db
+
+# Settings of SQLite itself (rollback journal, fsync on every commit)
+JOURNAL_PRAGMAS = (('journal_mode', 'DELETE'), ('synchronous', 'FULL'))
+
+sqlite_cli = AppGroup('sqlite', help='SQLite database.')
+
+
+def is_sqlite_file(engine):
+    return engine.dialect.name == 'sqlite' and \
+        engine.url.database not in (None, '', ':memory:')
+
+
+def pragmas(config):
+    """The pragmas of the SQLITE_* settings, in the order they are set."""
+    return (
+        ('journal_mode', config.get('SQLITE_JOURNAL_MODE', 'WAL')),
+        ('synchronous', config.get('SQLITE_SYNCHRONOUS', 'NORMAL')),
+        ('busy_timeout', int(config.get('SQLITE_BUSY_TIMEOUT', 2000))),
+        ('mmap_size', int(config.get('SQLITE_MMAP_SIZE', 64 * 1024 * 1024))),
+    )
+
+
+def apply_pragmas(engine, settings):
+    """Set the pragmas on every connection the engine opens."""
+    statements = ['PRAGMA {}={}'.format(name, value) for name, value in settings]
+
+    @event.listens_for(engine, 'connect')
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for statement in statements:
+                cursor.execute(statement)
+        finally:
+            cursor.close()
+
+
+# --------------- Benchmark ---------------
+
+def _seed(engine, games):
+    from app.models import Game, User, Status
+    db.metadata.create_all(engine)
+    with engine.begin() as conn:
+        for n in range(games):
+            game_id = conn.execute(Game.__table__.insert().values(
+                UUID='bench-{}'.format(n), status=Status.STARTED, stack=13)
+            ).inserted_primary_key[0]
+            for name in ('a', 'b', 'c'):
+                conn.execute(User.__table__.insert().values(
+                    name=name, game_id=game_id, chips=0, number_dice=0))
+
+
+def _roll_loop(url, settings, games, seconds, readers_only):
+    # One process: roll_dice's statements (read game and players, write the
+    # dice and the game, commit) on random games until the time is up
+    from app.models import Game, User
+    engine = create_engine(url)
+    apply_pragmas(engine, settings)
+    done, locked = 0, 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        game_id = random.randint(1, games)
+        try:
+            with engine.begin() as conn:
+                conn.execute(select(Game.__table__).where(Game.id == game_id)).all()
+                users = conn.execute(select(User.id).where(User.game_id == game_id)).all()
+                if not readers_only:
+                    user_id = random.choice(users)[0]
+                    conn.execute(User.__table__.update().where(User.id == user_id).values(
+                        dice1=random.randint(1, 6), dice2=random.randint(1, 6),
+                        dice3=random.randint(1, 6), number_dice=User.number_dice + 1))
+                    conn.execute(Game.__table__.update().where(Game.id == game_id).values(
+                        move_user_id=user_id))
+            done += 1
+        except Exception as e:
+            if 'locked' not in str(e):
+                raise
+            locked += 1
+    engine.dispose()
+    return done, locked
+
+
+def _run_mode(settings, writers, readers, games, seconds):
+    import multiprocessing
+    directory = tempfile.mkdtemp(prefix='teleschocken-bench-')
+    try:
+        url = 'sqlite:///' + os.path.join(directory, 'bench.db')
+        engine = create_engine(url)
+        apply_pragmas(engine, settings)
+        _seed(engine, games)
+        engine.dispose()
+        jobs = [(url, settings, games, seconds, False)] * writers + \
+            [(url, settings, games, seconds, True)] * readers
+        with multiprocessing.get_context('fork').Pool(len(jobs)) as pool:
+            results = pool.starmap(_roll_loop, jobs)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    rolls = sum(done for done, _ in results[:writers])
+    reads = sum(done for done, _ in results[writers:])
+    locked = sum(n for _, n in results)
+    return rolls / seconds, reads / seconds, locked
+
+
+@sqlite_cli.command('bench')
+@click.option('--writers', default=4, show_default=True, help='Processes rolling dice.')
+@click.option('--readers', default=2, show_default=True, help='Processes reading games.')
+@click.option('--games', default=20, show_default=True)
+@click.option('--seconds', default=5.0, show_default=True, help='Duration per mode.')
+def bench_command(writers, readers, games, seconds):
+    """Rolls per second: rollback journal versus the SQLITE_* settings."""
+    from flask import current_app
+    modes = (('journal', JOURNAL_PRAGMAS + (('busy_timeout', 2000),)),
+             ('wal', pragmas(current_app.config)))
+    click.echo('{:>8} {:>10} {:>10} {:>8}'.format('mode', 'rolls/s', 'reads/s', 'locked'))
+    for name, settings in modes:
+        rolls, reads, locked = _run_mode(settings, writers, readers, games, seconds)
+        click.echo('{:>8} {:>10.0f} {:>10.0f} {:>8}'.format(name, rolls, reads, locked))
+
+
+def init_app(app):
+    """Register "flask sqlite", the pragmas for SQLite file databases and
+    create their missing tables."""
+    app.cli.add_command(sqlite_cli)
+    with app.app_context():
+        if app.config.get('SQLITE_PROFILE', True):
+            settings = pragmas(app.config)
+            for engine in db.engines.values():
+                if is_sqlite_file(engine):
+                    apply_pragmas(engine, settings)
+        if app.config.get('SQLITE_CREATE_SCHEMA', True) and is_sqlite_file(db.engine) \
+                and not inspect(db.engine).has_table('alembic_version'):
+            # Adds the tables of new models to an existing database as well
+            db.create_all(bind_key=None)
+            db.session.remove()
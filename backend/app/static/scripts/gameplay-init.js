@@ -0,0 +1,89 @@
+// Game page, runs before adminpanel.js and socket.io.js
+// Handle device switch: read params from URL and set localStorage
+(function() {
+  var params = new URLSearchParams(window.location.search);
+  var switchId = params.get('switch_id');
+  var switchName = params.get('switch_name');
+  if (switchId && switchName) {
+    localStorage.setItem('id', switchId);
+    localStorage.setItem('name', switchName);
+    params.delete('switch_id');
+    params.delete('switch_name');
+    var newUrl = window.location.pathname;
+    var remaining = params.toString();
+    if (remaining) newUrl += '?' + remaining;
+    window.history.replaceState({}, '', newUrl);
+  }
+})();
+
+(function() {
+  var loc = window.location;
+  var gameUUID = document.getElementById('UUID').innerHTML.replace(/['"]+/g, '');
+  var fullUrl = loc.protocol + '//' + loc.host + '/game_waiting/' + gameUUID;
+  document.getElementById('share_link_input').value = fullUrl;
+  new QRCode(document.getElementById('share_qrcode'), {
+    text: fullUrl,
+    width: 160,
+    height: 160,
+    colorDark: '#000000',
+    colorLight: '#ffffff',
+    correctLevel: QRCode.CorrectLevel.M
+  });
+})();
+
+// Toggle bottom panel (admin & links)
+function toggleBottomPanel() {
+  var panel = document.getElementById('bottom_panel');
+  var arrow = document.getElementById('disclosure_arrow');
+  var toggle = document.getElementById('bottom_panel_toggle');
+  var isOpen = panel.style.display !== 'none';
+  panel.style.display = isOpen ? 'none' : '';
+  arrow.classList.toggle('open', !isOpen);
+  if (toggle) toggle.setAttribute('aria-expanded', !isOpen);
+}
+
+// Toggle between invite link and device-switch link
+var _showingDeviceSwitch = false;
+function toggleDeviceSwitch() {
+  var myId = localStorage.getItem('id');
+  var myName = localStorage.getItem('name');
+  if (!myId || !myName) {
+    alert('Du musst erst dem Spiel beitreten.');
+    return;
+  }
+  var btn = document.getElementById('switch_device_btn');
+  var linkInput = document.getElementById('share_link_input');
+  var qrContainer = document.getElementById('share_qrcode');
+  var loc = window.location;
+  var gameUUID = document.getElementById('UUID').innerHTML.replace(/['"]+/g, '').trim();
+
+  var heading = document.getElementById('share_heading');
+
+  if (!_showingDeviceSwitch) {
+    var deviceUrl = loc.protocol + '//' + loc.host + '/game_waiting/' + gameUUID
+                  + '?switch_id=' + encodeURIComponent(myId)
+                  + '&switch_name=' + encodeURIComponent(myName);
+    linkInput.value = deviceUrl;
+    qrContainer.innerHTML = '';
+    new QRCode(qrContainer, {
+      text: deviceUrl, width: 160, height: 160,
+      colorDark: '#000000', colorLight: '#ffffff',
+      correctLevel: QRCode.CorrectLevel.M
+    });
+    btn.textContent = 'Spieler einladen';
+    heading.textContent = 'Behalte diesen Link für dich:';
+    _showingDeviceSwitch = true;
+  } else {
+    var inviteUrl = loc.protocol + '//' + loc.host + '/game_waiting/' + gameUUID;
+    linkInput.value = inviteUrl;
+    qrContainer.innerHTML = '';
+    new QRCode(qrContainer, {
+      text: inviteUrl, width: 160, height: 160,
+      colorDark: '#000000', colorLight: '#ffffff',
+      correctLevel: QRCode.CorrectLevel.M
+    });
+    btn.textContent = 'Ger\u00e4t wechseln';
+    heading.textContent = 'Verteile diesen Link an alle Mitspieler:';
+    _showingDeviceSwitch = false;
+  }
+}
@@ -0,0 +1,2576 @@
+// Game page. Per-page values (sound URLs, embedded preferences and game
+// state) come from the JSON block #gameplay-data rendered by gameplay.html.
+var _pageData = JSON.parse(document.getElementById('gameplay-data').textContent);
+
+// ============= H3: Sound handling =============
+var audioUnlocked = false;
+
+var soundDice  = new Audio(_pageData.sounds.rolling_dice);
+soundDice.preload = 'auto';
+var soundLift  = new Audio(_pageData.sounds.lift_cup);
+soundLift.preload = 'auto';
+var soundDiceY = new Audio(_pageData.sounds.roll_now);
+soundDiceY.preload = 'auto';
+
+try { soundDice.load(); soundLift.load(); soundDiceY.load(); } catch(e) {}
+
+// ============= Preferences (sounds, keyboard bindings) =============
+// Embedded by the server when it knows the nick, otherwise loaded once
+var _prefs = _pageData.preferences;
+var _prefsCallbacks = null;
+
+function withPreferences(callback) {
+  var nick = localStorage.getItem('name');
+  if (!nick) return;
+  if (_prefs && _prefs.nick === nick) { callback(_prefs); return; }
+  if (_prefsCallbacks) { _prefsCallbacks.push(callback); return; }
+  _prefsCallbacks = [callback];
+  var xhr = new XMLHttpRequest();
+  xhr.open('GET', '/api/preferences?nick=' + encodeURIComponent(nick));
+  xhr.onreadystatechange = function() {
+    if (xhr.readyState !== 4) return;
+    var callbacks = _prefsCallbacks;
+    _prefsCallbacks = null;
+    if (xhr.status !== 200) return;
+    try { _prefs = JSON.parse(xhr.responseText); } catch(e) { return; }
+    for (var i = 0; i < callbacks.length; i++) callbacks[i](_prefs);
+  };
+  xhr.send();
+}
+
+// Replace with person-specific sounds if a NickMapping exists for this nick
+withPreferences(function(prefs) {
+  var urls = prefs.sounds;
+  function replaceIfDifferent(current, url) {
+    if (!url || current.src.endsWith(url)) return current;
+    var a = new Audio(url);
+    a.preload = 'auto';
+    try { a.load(); } catch(e) {}
+    return a;
+  }
+  soundDice  = replaceIfDifferent(soundDice, urls.rolling_dice);
+  soundDiceY = replaceIfDifferent(soundDiceY, urls.roll_now);
+  soundLift  = replaceIfDifferent(soundLift, urls.lift_cup);
+});
+
+// Unlock audio on first user interaction.
+// Play each element muted so the browser marks it as user-initiated.
+// (On iOS, audio.volume is read-only and always 1, so we must use .muted instead.)
+function unlockAudio() {
+  if (audioUnlocked) return;
+  audioUnlocked = true;
+  [soundDice, soundLift, soundDiceY].forEach(function(audio) {
+    audio.muted = true;
+    var p = audio.play();
+    if (p) {
+      p.then(function() {
+        if (audio.muted) {
+          audio.pause();
+          audio.currentTime = 0;
+        }
+        audio.muted = false;
+      }).catch(function() {
+        audio.muted = false;
+      });
+    } else {
+      setTimeout(function() {
+        if (audio.muted) {
+          audio.pause();
+          audio.currentTime = 0;
+        }
+        audio.muted = false;
+      }, 250);
+    }
+  });
+  document.removeEventListener('click', unlockAudio);
+  document.removeEventListener('touchstart', unlockAudio);
+  document.removeEventListener('touchend', unlockAudio);
+}
+document.addEventListener('click', unlockAudio);
+document.addEventListener('touchstart', unlockAudio);
+document.addEventListener('touchend', unlockAudio);
+
+function playSound(audio) {
+  if (!audio) return;
+  audio.muted = false;
+  try { audio.currentTime = 0; } catch(e) {}
+  var p = audio.play();
+  if (p !== undefined) {
+    p.catch(function(e) { console.log('Sound konnte nicht abgespielt werden:', e.message); });
+  }
+}
+
+// ============= Screenshot =============
+var _screenshotBlob = null;
+var _screenshotDataUrl = null;
+
+function captureScreenshot() {
+  var area = document.getElementById('screenshot_area');
+  if (!area) return;
+  html2canvas(area, {
+    backgroundColor: getComputedStyle(document.body).backgroundColor,
+    scale: 2,
+    useCORS: true
+  }).then(function(canvas) {
+    _screenshotDataUrl = canvas.toDataURL('image/png');
+    canvas.toBlob(function(blob) {
+      _screenshotBlob = blob;
+      var camBtn = document.getElementById('screenshot_floating_btn');
+      if (camBtn) camBtn.style.display = '';
+    }, 'image/png');
+  }).catch(function(err) {
+    console.log('Screenshot fehlgeschlagen:', err);
+  });
+}
+
+function copyScreenshotToClipboard() {
+  if (!_screenshotBlob) return;
+  var camBtn = document.getElementById('screenshot_floating_btn');
+  if (navigator.clipboard && navigator.clipboard.write) {
+    navigator.clipboard.write([
+      new ClipboardItem({ 'image/png': _screenshotBlob })
+    ]).then(function() {
+      if (camBtn) {
+        camBtn.classList.add('screenshot-copied');
+        setTimeout(function() { camBtn.classList.remove('screenshot-copied'); }, 1500);
+      }
+    }).catch(function(err) {
+      console.log('Clipboard-Fehler:', err);
+      fallbackDownloadScreenshot();
+    });
+  } else {
+    fallbackDownloadScreenshot();
+  }
+}
+
+function fallbackDownloadScreenshot() {
+  if (!_screenshotDataUrl) return;
+  var a = document.createElement('a');
+  a.href = _screenshotDataUrl;
+  a.download = 'rundenergebnis.png';
+  document.body.appendChild(a);
+  a.click();
+  document.body.removeChild(a);
+}
+
+// ============= Beer Summary =============
+function showBeerSummary() {
+  var modal = document.getElementById('beerModal');
+  var content = document.getElementById('beer_content');
+  modal.style.display = 'block';
+  content.innerHTML = '<p style="color:var(--text-muted);">Lade...</p>';
+
+  var gameUuid = getGameId();
+  var myName = localStorage.getItem('name') || '';
+  if (!myName) {
+    content.innerHTML = '<p>Kein Spielername bekannt.</p>';
+    return;
+  }
+
+  var xhr = new XMLHttpRequest();
+  xhr.open('GET', '/api/protokoll/beer_summary_live?game_uuid=' + encodeURIComponent(gameUuid) + '&user_nick=' + encodeURIComponent(myName));
+  xhr.setRequestHeader('Content-Type', 'application/json');
+  xhr.onreadystatechange = function() {
+    if (xhr.readyState === XMLHttpRequest.DONE) {
+      if (xhr.status !== 200) {
+        content.innerHTML = '<p>Noch keine Spieldaten für heute.</p>';
+        return;
+      }
+      var res = {};
+      try { res = JSON.parse(xhr.responseText); } catch(e) {}
+
+      var html = '';
+
+      // Current game evening (nick-based)
+      if (res.opponents && res.opponents.length > 0) {
+        var summary = [{heading: 'Aktuelles Spiel', person: myName, opponents: res.opponents}];
+        html += buildBeerHtmlLive(summary);
+      } else {
+        html += '<h3 style="margin-bottom:4px;border-bottom:2px solid var(--border-color);padding-bottom:4px;">Aktuelles Spiel</h3>';
+        html += '<p style="color:var(--text-muted);">Noch keine Spieldaten für heute.</p>';
+      }
+
+      // Person-based historical stats (if mapping exists)
+      if (res.person_name && res.overall && res.overall.length > 0) {
+        var yr = res.year_range || {};
+        var overallHeading = (yr.first && yr.last) ? (yr.first + ' - ' + yr.last) : 'Gesamt';
+
+        html += '<hr style="margin:24px 0 16px 0;">';
+        html += buildBeerHtmlLive([{heading: overallHeading, person: res.person_name, opponents: res.overall}]);
+
+        // Per-year stats
+        if (res.per_year) {
+          var yearKeys = Object.keys(res.per_year).sort().reverse();
+          for (var yi = 0; yi < yearKeys.length; yi++) {
+            var yrKey = yearKeys[yi];
+            html += buildBeerHtmlLive([{heading: yrKey, person: res.person_name, opponents: res.per_year[yrKey]}]);
+          }
+        }
+      }
+
+      if (!html) {
+        html = '<p>Noch keine Spieldaten.</p>';
+      }
+      content.innerHTML = html;
+    }
+  };
+  xhr.send();
+}
+
+function buildBeerHtmlLive(summary) {
+  var html = '';
+  for (var i = 0; i < summary.length; i++) {
+    var s = summary[i];
+    var heading = s.heading || s.person;
+    html += '<h3 style="margin-bottom:4px;border-bottom:2px solid var(--border-color);padding-bottom:4px;">' + _esc(heading) + '</h3>';
+    html += '<table class="table table-striped" style="max-width:600px;">';
+    html += '<thead><tr><th></th><th>bekommt</th><th>gibt aus</th><th>Differenz</th></tr></thead><tbody>';
+    var totalGives = 0, totalGets = 0, totalDiff = 0;
+    for (var j = 0; j < s.opponents.length; j++) {
+      var o = s.opponents[j];
+      totalGives += o.gives;
+      totalGets += o.gets;
+      totalDiff += o.diff;
+      var diffClass = o.diff > 0 ? 'color:#4CAF50;' : (o.diff < 0 ? 'color:#e53935;' : '');
+      var diffPrefix = o.diff > 0 ? '+' : '';
+      html += '<tr><td><strong>' + _esc(o.opponent) + '</strong></td>' +
+        '<td>' + o.gives + '</td>' +
+        '<td>' + o.gets + '</td>' +
+        '<td style="font-weight:bold;' + diffClass + '">' + diffPrefix + o.diff + '</td></tr>';
+    }
+    var totalDiffClass = totalDiff > 0 ? 'color:#4CAF50;' : (totalDiff < 0 ? 'color:#e53935;' : '');
+    var totalDiffPrefix = totalDiff > 0 ? '+' : '';
+    html += '<tr style="font-weight:bold;border-top:2px solid var(--border-color);"><td>Gesamt</td>' +
+      '<td>' + totalGives + '</td>' +
+      '<td>' + totalGets + '</td>' +
+      '<td style="' + totalDiffClass + '">' + totalDiffPrefix + totalDiff + '</td></tr>';
+    html += '</tbody></table>';
+  }
+  return html;
+}
+
+function _esc(s) {
+  if (!s) return '';
+  var d = document.createElement('div');
+  d.textContent = s;
+  return d.innerHTML;
+}
+
+// ============= Helpers =============
+var _lastGameState = null;  // cache for checking player status etc.
+var _wasInRevealPhase = false; // track reveal phase to play sound only on transition
+var _pullupWasGreen = false;   // track pullup button state for sound trigger
+var _currentRoundPhase = null; // track round row phase to avoid restarting countdowns
+var _lastWaitingUserId = undefined; // undefined = first load (suppress sound on page load)
+
+// Table ordering state
+var _tableOrder = [];          // current display order of user IDs (strings)
+var _tableAnimating = false;
+var _runningAnims = [];        // active Animation objects for cancellation
+var _isFirstTableLoad = true;
+
+// Dice cup state
+var _diceInCup = [true, true, true];
+var _myDiceValues = [0, 0, 0];
+var _diceSwapped = [false, false, false];
+var _diceSwapCupIdx = -1;
+var _diceHiddenAfterRoll = false;
+var _diceOutAtRoll = [false, false, false];
+var _diceAnimating = false;
+var _rollInProgress = false;
+var _needsDiceRestore = true;
+
+function getGameId() {
+  var el = document.getElementById('UUID');
+  return el.innerHTML.replace(/['"]+/g, '');
+}
+
+function getMyId() {
+  return parseInt(localStorage.getItem('id'));
+}
+
+// C2: Updated dicehelper -- returns null for null/0/undefined
+function dicehelper(eyes) {
+  if (eyes === null || eyes === undefined || eyes === 0) return null;
+  switch (eyes) {
+    case 1: {
+      var div = document.createElement('div');
+      div.className = 'dice dice-first-face';
+      var span = document.createElement('span');
+      span.className = 'dot';
+      div.appendChild(span);
+      return div;
+    }
+    case 2: {
+      var div = document.createElement('div');
+      div.className = 'dice dice-second-face';
+      var span = document.createElement('span');
+      span.className = 'dot';
+      var span2 = document.createElement('span');
+      span2.className = 'dot';
+      div.appendChild(span);
+      div.appendChild(span2);
+      return div;
+    }
+    case 3: {
+      var div = document.createElement('div');
+      div.className = 'dice dice-third-face';
+      var span = document.createElement('span');
+      span.className = 'dot';
+      var span2 = document.createElement('span');
+      span2.className = 'dot';
+      var span3 = document.createElement('span');
+      span3.className = 'dot';
+      div.appendChild(span);
+      div.appendChild(span2);
+      div.appendChild(span3);
+      return div;
+    }
+    case 4: {
+      var div = document.createElement('div');
+      div.className = 'dice dice-fourth-face';
+      var divc1 = document.createElement('div');
+      divc1.className = 'dice-column';
+      var divc2 = document.createElement('div');
+      divc2.className = 'dice-column';
+      var span = document.createElement('span');
+      span.className = 'dot';
+      var span2 = document.createElement('span');
+      span2.className = 'dot';
+      var span3 = document.createElement('span');
+      span3.className = 'dot';
+      var span4 = document.createElement('span');
+      span4.className = 'dot';
+      divc1.appendChild(span);
+      divc1.appendChild(span2);
+      divc2.appendChild(span3);
+      divc2.appendChild(span4);
+      div.appendChild(divc1);
+      div.appendChild(divc2);
+      return div;
+    }
+    case 5: {
+      var div = document.createElement('div');
+      div.className = 'dice dice-fifth-face';
+      var divc1 = document.createElement('div');
+      divc1.className = 'dice-column';
+      var divc2 = document.createElement('div');
+      divc2.className = 'dice-column';
+      var divc3 = document.createElement('div');
+      divc3.className = 'dice-column';
+      var span = document.createElement('span');
+      span.className = 'dot';
+      var span2 = document.createElement('span');
+      span2.className = 'dot';
+      var span3 = document.createElement('span');
+      span3.className = 'dot';
+      var span4 = document.createElement('span');
+      span4.className = 'dot';
+      var span5 = document.createElement('span');
+      span5.className = 'dot';
+      divc1.appendChild(span);
+      divc1.appendChild(span2);
+      divc2.appendChild(span3);
+      divc3.appendChild(span4);
+      divc3.appendChild(span5);
+      div.appendChild(divc1);
+      div.appendChild(divc2);
+      div.appendChild(divc3);
+      return div;
+    }
+    case 6: {
+      var div = document.createElement('div');
+      div.className = 'dice dice-fourth-face';
+      var divc1 = document.createElement('div');
+      divc1.className = 'dice-column';
+      var divc2 = document.createElement('div');
+      divc2.className = 'dice-column';
+      var span = document.createElement('span');
+      span.className = 'dot';
+      var span2 = document.createElement('span');
+      span2.className = 'dot';
+      var span3 = document.createElement('span');
+      span3.className = 'dot';
+      var span4 = document.createElement('span');
+      span4.className = 'dot';
+      var span5 = document.createElement('span');
+      span5.className = 'dot';
+      var span6 = document.createElement('span');
+      span6.className = 'dot';
+      divc1.appendChild(span);
+      divc1.appendChild(span2);
+      divc1.appendChild(span3);
+      divc2.appendChild(span4);
+      divc2.appendChild(span5);
+      divc2.appendChild(span6);
+      div.appendChild(divc1);
+      div.appendChild(divc2);
+      return div;
+    }
+    default: return null;
+  }
+}
+
+// Format a scoring object (from game.Scoring or game.Last_Scoring) into display HTML
+function formatScoringText(scoring) {
+  if (!scoring) return '';
+  var chipsPart;
+  if (scoring.From === 'schockaus') {
+    chipsPart = scoring.From_Name + '! Alle Chips an ' + scoring.To_Name;
+  } else {
+    chipsPart = scoring.Chips + ' Chip(s) von '
+              + scoring.From_Name + ' an ' + scoring.To_Name;
+  }
+  return '<b>Hoch:</b> ' + scoring.High
+       + ' — <b>Tief:</b> ' + scoring.Low
+       + ' — ' + chipsPart;
+}
+
+// Append dice element if non-null
+function appendDice(container, eyes) {
+  var el = dicehelper(eyes);
+  if (el) container.appendChild(el);
+}
+
+// ============= 3D Dice Roll Animation =============
+var DICE_FACE_ROTATION = {
+  1: { x: 0,   y: 0   },
+  2: { x: 0,   y: -90 },
+  3: { x: 90,  y: 0   },
+  4: { x: -90, y: 0   },
+  5: { x: 0,   y: 90  },
+  6: { x: 0,   y: 180 }
+};
+
+function animateDiceCupRoll(oldValues, newValues, inCup) {
+  var ANIM_DURATION = 2000;
+  var pending = 0;
+
+  for (var i = 0; i < 3; i++) {
+    if (inCup[i] && newValues[i] > 0) pending++;
+  }
+  if (pending === 0) { _rollInProgress = false; renderDiceCup(); return; }
+
+  _diceAnimating = true;
+  var maxDelay = 0;
+
+  for (var i = 0; i < 3; i++) {
+    if (!inCup[i] || !newValues[i] || newValues[i] === 0) continue;
+
+    var delay = Math.floor(Math.random() * 100) + 30;
+    if (delay > maxDelay) maxDelay = delay;
+
+    (function(idx, d) {
+      var cupCell = document.getElementById('dcell' + idx);
+      cupCell.innerHTML = '';
+      cupCell.className = 'dcell dcell-cup';
+
+      var scene = document.createElement('div');
+      scene.className = 'dice-3d-scene';
+      var cube = document.createElement('div');
+      cube.className = 'dice-3d-cube';
+      scene.appendChild(cube);
+      cupCell.appendChild(scene);
+
+      var size = scene.offsetWidth;
+      if (!size || size < 10) size = 50;
+      var half = (size / 2 + 1).toFixed(1);
+
+      var faceTransforms = [
+        'translateZ(' + half + 'px)',
+        'rotateY(90deg) translateZ(' + half + 'px)',
+        'rotateX(-90deg) translateZ(' + half + 'px)',
+        'rotateX(90deg) translateZ(' + half + 'px)',
+        'rotateY(-90deg) translateZ(' + half + 'px)',
+        'rotateY(180deg) translateZ(' + half + 'px)'
+      ];
+
+      for (var face = 1; face <= 6; face++) {
+        var faceEl = dicehelper(face);
+        if (!faceEl) continue;
+        faceEl.style.position = 'absolute';
+        faceEl.style.top = '0';
+        faceEl.style.left = '0';
+        faceEl.style.width = '100%';
+        faceEl.style.height = '100%';
+        faceEl.style.margin = '0';
+        faceEl.style.boxSizing = 'border-box';
+        faceEl.style.backfaceVisibility = 'hidden';
+        faceEl.style.webkitBackfaceVisibility = 'hidden';
+        faceEl.style.transform = faceTransforms[face - 1];
+        cube.appendChild(faceEl);
+      }
+
+      var oldFace = (oldValues[idx] > 0 && oldValues[idx] <= 6) ? oldValues[idx] : Math.ceil(Math.random() * 6);
+      var oldRot = DICE_FACE_ROTATION[oldFace];
+      var newRot = DICE_FACE_ROTATION[newValues[idx]];
+
+      cube.style.transform = 'rotateX(' + oldRot.x + 'deg) rotateY(' + oldRot.y + 'deg)';
+
+      cupCell.classList.add('dcell-clickable');
+      cupCell.onclick = function() { toggleDice(idx); };
+
+      setTimeout(function() {
+        void cube.offsetHeight;
+        var spinsX = (Math.floor(Math.random() * 3) + 2) * 360;
+        var spinsY = (Math.floor(Math.random() * 3) + 2) * 360;
+        var dirX = Math.random() > 0.5 ? 1 : -1;
+        var dirY = Math.random() > 0.5 ? 1 : -1;
+
+        cube.style.transition = 'transform ' + ANIM_DURATION + 'ms cubic-bezier(0.08, 0.82, 0.17, 1)';
+        cube.style.transform = 'rotateX(' + (newRot.x + spinsX * dirX) + 'deg) rotateY(' + (newRot.y + spinsY * dirY) + 'deg)';
+      }, d);
+    })(i, delay);
+  }
+
+  setTimeout(function() {
+    _diceAnimating = false;
+    _rollInProgress = false;
+    renderDiceCup();
+  }, ANIM_DURATION + maxDelay + 100);
+}
+
+var _lastRollAnimTimer = null;
+
+function cancelLastRollAnim() {
+  if (_lastRollAnimTimer) {
+    clearTimeout(_lastRollAnimTimer);
+    _lastRollAnimTimer = null;
+  }
+  _diceAnimating = false;
+  _rollInProgress = false;
+}
+
+function animateLastRoll(oldValues, inCup) {
+  var ANIM_DURATION = 1500;
+  var pending = 0;
+  for (var i = 0; i < 3; i++) {
+    if (inCup[i]) pending++;
+  }
+  if (pending === 0) {
+    _diceHiddenAfterRoll = true;
+    _rollInProgress = false;
+    renderDiceCup();
+    return;
+  }
+
+  _diceAnimating = true;
+
+  for (var i = 0; i < 3; i++) {
+    if (!inCup[i]) continue;
+
+    (function(idx) {
+      var cupCell = document.getElementById('dcell' + idx);
+      cupCell.innerHTML = '';
+      cupCell.className = 'dcell dcell-cup';
+
+      var randomTarget = Math.ceil(Math.random() * 6);
+
+      var scene = document.createElement('div');
+      scene.className = 'dice-3d-scene';
+      var cube = document.createElement('div');
+      cube.className = 'dice-3d-cube';
+      scene.appendChild(cube);
+      cupCell.appendChild(scene);
+
+      var size = scene.offsetWidth;
+      if (!size || size < 10) size = 50;
+      var half = (size / 2 + 1).toFixed(1);
+
+      var faceTransforms = [
+        'translateZ(' + half + 'px)',
+        'rotateY(90deg) translateZ(' + half + 'px)',
+        'rotateX(-90deg) translateZ(' + half + 'px)',
+        'rotateX(90deg) translateZ(' + half + 'px)',
+        'rotateY(-90deg) translateZ(' + half + 'px)',
+        'rotateY(180deg) translateZ(' + half + 'px)'
+      ];
+
+      for (var face = 1; face <= 6; face++) {
+        var faceEl = dicehelper(face);
+        if (!faceEl) continue;
+        faceEl.style.position = 'absolute';
+        faceEl.style.top = '0';
+        faceEl.style.left = '0';
+        faceEl.style.width = '100%';
+        faceEl.style.height = '100%';
+        faceEl.style.margin = '0';
+        faceEl.style.boxSizing = 'border-box';
+        faceEl.style.backfaceVisibility = 'hidden';
+        faceEl.style.webkitBackfaceVisibility = 'hidden';
+        faceEl.style.transform = faceTransforms[face - 1];
+        cube.appendChild(faceEl);
+      }
+
+      var oldFace = (oldValues[idx] > 0 && oldValues[idx] <= 6) ? oldValues[idx] : Math.ceil(Math.random() * 6);
+      var oldRot = DICE_FACE_ROTATION[oldFace];
+      var newRot = DICE_FACE_ROTATION[randomTarget];
+
+      cube.style.transform = 'rotateX(' + oldRot.x + 'deg) rotateY(' + oldRot.y + 'deg)';
+
+      setTimeout(function() {
+        void cube.offsetHeight;
+        var spinsX = (Math.floor(Math.random() * 3) + 2) * 360;
+        var spinsY = (Math.floor(Math.random() * 3) + 2) * 360;
+        var dirX = Math.random() > 0.5 ? 1 : -1;
+        var dirY = Math.random() > 0.5 ? 1 : -1;
+
+        cube.style.transition = 'transform ' + ANIM_DURATION + 'ms linear';
+        cube.style.transform = 'rotateX(' + (newRot.x + spinsX * dirX) + 'deg) rotateY(' + (newRot.y + spinsY * dirY) + 'deg)';
+
+        scene.style.transition = 'opacity ' + ANIM_DURATION + 'ms ease-in';
+        scene.style.opacity = '0';
+      }, 30);
+    })(i);
+  }
+
+  _lastRollAnimTimer = setTimeout(function() {
+    _lastRollAnimTimer = null;
+    _diceAnimating = false;
+    _rollInProgress = false;
+    _diceHiddenAfterRoll = true;
+    renderDiceCup();
+  }, ANIM_DURATION + 100);
+}
+
+// C4: Check if any non-passive, non-pending user still has hidden dice
+function isUndecided(game) {
+  var undecided = false;
+  game.User.forEach(function(user) {
+    if (!undecided && user.Passive !== true && user.Pending_Join !== true && user.Dices.length < 3)
+      undecided = true;
+  });
+  return undecided;
+}
+
+// ============= Dice cup rendering =============
+function clearSwapState() {
+  _diceSwapped = [false, false, false];
+  _diceSwapCupIdx = -1;
+}
+
+function isSwapActive() {
+  return _diceSwapped[0] || _diceSwapped[1] || _diceSwapped[2];
+}
+
+function addPlaceholder(cell) {
+  var ph = document.createElement('div');
+  ph.className = 'dice dice-placeholder';
+  cell.appendChild(ph);
+}
+
+function renderDiceCup() {
+  for (var i = 0; i < 6; i++) {
+    var cell = document.getElementById('dcell' + i);
+    cell.innerHTML = '';
+    cell.onclick = null;
+    cell.className = (i < 3) ? 'dcell dcell-cup' : 'dcell dcell-out';
+  }
+
+  for (var i = 0; i < 3; i++) {
+    var val = _myDiceValues[i];
+    var isNull = (val === null || val === undefined);
+    var cupCell = document.getElementById('dcell' + i);
+    var outCell = document.getElementById('dcell' + (3 + i));
+
+    if (isNull && _diceSwapped[i] && i === _diceSwapCupIdx) {
+      appendDice(cupCell, 6);
+      cupCell.classList.add('dcell-disabled');
+      addPlaceholder(outCell);
+      continue;
+    }
+
+    if (!val || val === 0) {
+      addPlaceholder(cupCell);
+      addPlaceholder(outCell);
+      continue;
+    }
+
+    if (_diceInCup[i]) {
+      appendDice(cupCell, val);
+      cupCell.classList.add('dcell-clickable');
+      cupCell.onclick = (function(idx) { return function() { toggleDice(idx); }; })(i);
+      addPlaceholder(outCell);
+    } else {
+      addPlaceholder(cupCell);
+      appendDice(outCell, val);
+      if (_diceSwapped[i]) {
+        outCell.classList.add('dcell-swapped', 'dcell-clickable');
+        outCell.onclick = (function(idx) { return function() { undoSwap(idx); }; })(i);
+      } else {
+        outCell.classList.add('dcell-clickable');
+        outCell.onclick = (function(idx) { return function() { toggleDice(idx); }; })(i);
+      }
+    }
+  }
+
+  updateTurnButtons();
+
+  // Disable roll button if no dice are in the cup
+  var anyInCup = _diceInCup[0] || _diceInCup[1] || _diceInCup[2];
+  var btnDice = document.getElementById('btn_dice');
+  if (btnDice) {
+    if (!anyInCup) {
+      btnDice.disabled = true;
+    } else if (btnDice.getAttribute('data-cooldown') !== 'true') {
+      btnDice.disabled = false;
+    }
+  }
+}
+
+function toggleDice(diceIdx) {
+  _diceInCup[diceIdx] = !_diceInCup[diceIdx];
+  if (_diceAnimating) {
+    _toggleDiceVisual(diceIdx);
+  } else {
+    renderDiceCup();
+  }
+}
+
+function _toggleDiceVisual(diceIdx) {
+  var cupCell = document.getElementById('dcell' + diceIdx);
+  var outCell = document.getElementById('dcell' + (3 + diceIdx));
+  if (_diceInCup[diceIdx]) {
+    outCell.innerHTML = '';
+    outCell.onclick = null;
+    outCell.className = 'dcell dcell-out';
+    addPlaceholder(outCell);
+    cupCell.innerHTML = '';
+    cupCell.className = 'dcell dcell-cup dcell-clickable';
+    appendDice(cupCell, _myDiceValues[diceIdx]);
+    cupCell.onclick = function() { toggleDice(diceIdx); };
+  } else {
+    cupCell.innerHTML = '';
+    cupCell.onclick = null;
+    cupCell.className = 'dcell dcell-cup';
+    addPlaceholder(cupCell);
+    outCell.innerHTML = '';
+    outCell.className = 'dcell dcell-out dcell-clickable';
+    appendDice(outCell, _myDiceValues[diceIdx]);
+    outCell.onclick = function() { toggleDice(diceIdx); };
+  }
+}
+
+function updateTurnButtons() {
+  var btn2 = document.getElementById('btn_turn_2');
+  var btn3 = document.getElementById('btn_turn_3');
+  btn2.style.display = 'none';
+  btn3.style.display = 'none';
+
+  if (_rollInProgress) return;
+  if (isSwapActive()) return;
+  if (_diceHiddenAfterRoll) return;
+
+  var sixes = 0;
+  for (var i = 0; i < 3; i++) {
+    if (_myDiceValues[i] === 6) sixes++;
+  }
+
+  var me = _lastGameState ? _lastGameState.User.find(function(u) { return u.Id === getMyId(); }) : null;
+  if (!me || me.Number_Dice === 0) return;
+  var firstDiceCount = parseInt(document.getElementById('first_user_dice_count_id').innerHTML) || 3;
+  var amFirst = (getMyId() == _lastGameState.First);
+  var canRoll = amFirst ? me.Number_Dice < 3 : me.Number_Dice < firstDiceCount;
+  if (!canRoll) return;
+
+  if (sixes >= 3) {
+    btn3.style.display = '';
+  } else if (sixes >= 2) {
+    btn2.style.display = '';
+  }
+}
+
+function turnSixes(count) {
+  var gameid = getGameId();
+  var id = localStorage.getItem('id');
+  var xhttp = new XMLHttpRequest();
+  xhttp.open("POST", "/api/game/" + gameid + "/user/" + id + "/diceturn");
+  xhttp.setRequestHeader("Content-Type", "application/json");
+  xhttp.onreadystatechange = function () {
+    if (xhttp.readyState == XMLHttpRequest.DONE) {
+      var res = JSON.parse(xhttp.responseText);
+      if (xhttp.status == 201) {
+        var newVals = [res.dice1, res.dice2, res.dice3];
+        for (var i = 0; i < 3; i++) {
+          if (newVals[i] === null || newVals[i] === undefined || newVals[i] === 0) {
+            _diceSwapCupIdx = i;
+            _diceInCup[i] = true;
+            _diceSwapped[i] = true;
+            _myDiceValues[i] = null;
+          } else if (_myDiceValues[i] === 6 && newVals[i] === 1) {
+            _diceInCup[i] = false;
+            _diceSwapped[i] = true;
+            _myDiceValues[i] = 1;
+          } else {
+            _myDiceValues[i] = newVals[i];
+          }
+        }
+        renderDiceCup();
+      } else {
+        alert('' + res.Message);
+      }
+    }
+  }
+  xhttp.send(JSON.stringify({ count: count }));
+}
+
+function undoSwap(diceIdx) {
+  var remainingSwapped1s = 0;
+  for (var i = 0; i < 3; i++) {
+    if (i !== diceIdx && _diceSwapped[i] && _myDiceValues[i] === 1) {
+      remainingSwapped1s++;
+    }
+  }
+  var restoreIdx = null;
+  if (remainingSwapped1s === 0 && _diceSwapCupIdx >= 0) {
+    restoreIdx = _diceSwapCupIdx + 1;
+  }
+
+  var gameid = getGameId();
+  var id = localStorage.getItem('id');
+  var xhttp = new XMLHttpRequest();
+  xhttp.open("POST", "/api/game/" + gameid + "/user/" + id + "/diceturn_undo");
+  xhttp.setRequestHeader("Content-Type", "application/json");
+  xhttp.onreadystatechange = function () {
+    if (xhttp.readyState == XMLHttpRequest.DONE) {
+      var res = JSON.parse(xhttp.responseText);
+      if (xhttp.status == 201) {
+        _myDiceValues[diceIdx] = 6;
+        _diceSwapped[diceIdx] = false;
+        if (restoreIdx !== null) {
+          var cupIdx = _diceSwapCupIdx;
+          _myDiceValues[cupIdx] = 6;
+          _diceInCup[cupIdx] = false;
+          _diceSwapped[cupIdx] = false;
+          _diceSwapCupIdx = -1;
+        }
+        renderDiceCup();
+      } else {
+        alert('' + res.Message);
+      }
+    }
+  }
+  var body = { revert_index: diceIdx + 1 };
+  if (restoreIdx !== null) body.restore_index = restoreIdx;
+  xhttp.send(JSON.stringify(body));
+}
+
+// ============= Game Actions =============
+function dice() {
+  _rollInProgress = true;
+  var _btnDice = document.getElementById("btn_dice");
+  _btnDice.disabled = true;
+  _btnDice.setAttribute('data-cooldown', 'true');
+  setTimeout(function () {
+    _btnDice.removeAttribute('data-cooldown');
+    var anyInCup = _diceInCup[0] || _diceInCup[1] || _diceInCup[2];
+    _btnDice.disabled = !anyInCup;
+    var throwBtn = document.getElementById('startgame_id');
+    if (_lastGameState && _lastGameState.Move === getMyId() && throwBtn) {
+      throwBtn.className = 'buttongreen containerturner';
+    }
+  }, 2500);
+
+  clearSwapState();
+  document.getElementById('btn_turn_2').style.display = 'none';
+  document.getElementById('btn_turn_3').style.display = 'none';
+
+  var gameid = getGameId();
+  var id = localStorage.getItem('id');
+
+  var dicenumber = document.getElementById('Number_Dice' + id);
+  if (dicenumber) {
+    var dn = parseInt(dicenumber.innerHTML);
+    if (dn == 0) {
+      if (!_diceInCup[0] || !_diceInCup[1] || !_diceInCup[2]) {
+        alert('Beim ersten Wurf alle Würfel in den Becher Packen!');
+        document.getElementById("btn_dice").disabled = false;
+        _rollInProgress = false;
+        return;
+      }
+    }
+  }
+
+  var xhttp = new XMLHttpRequest();
+  xhttp.open("POST", "/api/game/" + gameid + "/user/" + id + "/dice");
+  xhttp.setRequestHeader("Content-Type", "application/json");
+  xhttp.onreadystatechange = function () {
+    if (xhttp.readyState == XMLHttpRequest.DONE) {
+      var res = JSON.parse(xhttp.responseText);
+      if (xhttp.status == 201) {
+        if (res.fallen) {
+          _rollInProgress = false;
+          alert('Würfel vom Tisch gefallen Schnapsrunde!');
+        } else {
+          playSound(soundDice);
+
+          var firstDiceCount = document.getElementById('first_user_dice_count_id').innerHTML;
+          var first_user_id = document.getElementById('first_user_id').innerHTML;
+          var me = localStorage.getItem('id');
+          var isLastRoll = false;
+
+          if (first_user_id == me) {
+            isLastRoll = (res.number_dice >= 3);
+          } else {
+            isLastRoll = (String(res.number_dice) == firstDiceCount);
+          }
+
+          var oldDiceValues = [_myDiceValues[0], _myDiceValues[1], _myDiceValues[2]];
+          var rolledInCup = [_diceInCup[0], _diceInCup[1], _diceInCup[2]];
+
+          _myDiceValues = [
+            res.dice1 || 0,
+            res.dice2 || 0,
+            res.dice3 || 0
+          ];
+
+          if (isLastRoll) {
+            _diceHiddenAfterRoll = true;
+            animateLastRoll(oldDiceValues, rolledInCup);
+          } else {
+            _diceHiddenAfterRoll = false;
+            animateDiceCupRoll(oldDiceValues, _myDiceValues, rolledInCup);
+          }
+        }
+      } else {
+        _rollInProgress = false;
+        alert('' + res.Message);
+      }
+    }
+  }
+  _diceOutAtRoll = [!_diceInCup[0], !_diceInCup[1], !_diceInCup[2]];
+  xhttp.send(JSON.stringify({ dice1: _diceInCup[0], dice2: _diceInCup[1], dice3: _diceInCup[2] }));
+}
+
+// Combined End/Pause button handler
+function endpause_click() {
+  var btn = document.getElementById('btn_endpause');
+  var mode = btn.getAttribute('data-mode');
+  var id = localStorage.getItem('id');
+  var gameid = getGameId();
+
+  if (mode === 'pause') {
+    // Check if player is currently passive -> un-pause
+    var me = _lastGameState ? _lastGameState.User.find(function(u) { return u.Id === getMyId(); }) : null;
+    var userstate = !(me && me.Passive);
+    var xhttp = new XMLHttpRequest();
+    xhttp.open("POST", "/api/game/" + gameid + "/user/" + id + "/passiv");
+    xhttp.setRequestHeader("Content-Type", "application/json");
+    xhttp.onreadystatechange = function () {
+      if (xhttp.readyState == XMLHttpRequest.DONE) {
+        var res = JSON.parse(xhttp.responseText);
+        if (xhttp.status != 200 && xhttp.status != 201) {
+          if (res.Penalty) {
+            alert(res.Message);
+          } else {
+            alert('' + res.Message);
+          }
+        }
+      }
+    }
+    xhttp.send(JSON.stringify({ userstate: userstate }));
+  } else if (mode === 'ende') {
+    var xhttp = new XMLHttpRequest();
+    xhttp.open("POST", "/api/game/" + gameid + "/user/" + id + "/finisch");
+    xhttp.setRequestHeader("Content-Type", "application/json");
+    xhttp.onreadystatechange = function () {
+      if (xhttp.readyState == XMLHttpRequest.DONE) {
+        var res = JSON.parse(xhttp.responseText);
+        if (xhttp.status != 200) { alert('' + res.Message); }
+      }
+    }
+    xhttp.send(JSON.stringify({}));
+  }
+}
+
+function pullup() {
+  cancelLastRollAnim();
+  var id = localStorage.getItem('id');
+  var gameid = getGameId();
+  var xhttp = new XMLHttpRequest();
+  xhttp.open("POST", "/api/game/" + gameid + "/user/" + id + "/visible");
+  xhttp.setRequestHeader("Content-Type", "application/json");
+  xhttp.onreadystatechange = function () {
+    if (xhttp.readyState == XMLHttpRequest.DONE) {
+      var res = JSON.parse(xhttp.responseText);
+      if (xhttp.status == 201) {
+        _diceHiddenAfterRoll = false;
+        renderDiceCup();
+      } else {
+        alert('' + res.Message);
+      }
+    }
+  }
+  xhttp.send(JSON.stringify({ visible: true }));
+}
+
+function pulldown() {
+  var id = localStorage.getItem('id');
+  var gameid = getGameId();
+  var xhttp = new XMLHttpRequest();
+  xhttp.open("POST", "/api/game/" + gameid + "/user/" + id + "/visible");
+  xhttp.setRequestHeader("Content-Type", "application/json");
+  xhttp.onreadystatechange = function () {
+    if (xhttp.readyState == XMLHttpRequest.DONE) {
+      var res = JSON.parse(xhttp.responseText);
+      if (xhttp.status == 201) {
+        _diceHiddenAfterRoll = true;
+        renderDiceCup();
+      } else {
+        alert('' + res.Message);
+      }
+    }
+  }
+  xhttp.send(JSON.stringify({
+    dice1_visible: _diceOutAtRoll[0],
+    dice2_visible: _diceOutAtRoll[1],
+    dice3_visible: _diceOutAtRoll[2]
+  }));
+}
+
+// ============= Player/Admin checks =============
+function checkIfPlayer(game) {
+  var myId = getMyId();
+  var isPlayer = game.User.some(function(u) { return u.Id === myId; });
+  var gameControls = document.getElementById('game_controls');
+  var joinForm = document.getElementById('join_form');
+  var pendingNotice = document.getElementById('pending_notice');
+
+  if (!isPlayer) {
+    var wasHidden = (joinForm.style.display === 'none' || joinForm.style.display === '');
+    gameControls.style.display = 'none';
+    joinForm.style.display = 'block';
+    pendingNotice.style.display = 'none';
+    var joinBtn = document.getElementById('join_btn');
+    var joinInput = document.getElementById('join_name');
+    if (joinBtn) joinBtn.disabled = false;
+    if (joinInput) joinInput.disabled = false;
+    if (wasHidden && joinInput) {
+      joinInput.focus();
+    }
+  } else {
+    var me = game.User.find(function(u) { return u.Id === myId; });
+    if (me && me.Pending_Join) {
+      gameControls.style.display = 'none';
+      joinForm.style.display = 'none';
+      pendingNotice.style.display = 'block';
+    } else {
+      gameControls.style.display = 'block';
+      joinForm.style.display = 'none';
+      pendingNotice.style.display = 'none';
+    }
+  }
+}
+
+// ============= Table reorder helpers =============
+
+function buildSortedOrder(users, firstId) {
+  var active = [];
+  var passive = [];
+  var pending = [];
+  for (var i = 0; i < users.length; i++) {
+    if (users[i].Pending_Join) pending.push(users[i]);
+    else if (users[i].Passive) passive.push(users[i]);
+    else active.push(users[i]);
+  }
+
+  var firstIdx = -1;
+  for (var i = 0; i < active.length; i++) {
+    if (String(active[i].Id) == String(firstId)) { firstIdx = i; break; }
+  }
+  if (firstIdx > 0) {
+    active = active.slice(firstIdx).concat(active.slice(0, firstIdx));
+  }
+
+  return active.concat(passive).concat(pending);
+}
+
+function getOrderIds(tbody) {
+  var rows = tbody.querySelectorAll('tr');
+  var ids = [];
+  for (var i = 0; i < rows.length; i++) {
+    if (rows[i].id && rows[i].id.startsWith('row')) {
+      ids.push(rows[i].id.replace('row', ''));
+    }
+  }
+  return ids;
+}
+
+function updateRowCounters(tbody) {
+  var rows = tbody.querySelectorAll('tr');
+  for (var i = 0; i < rows.length; i++) {
+    if (rows[i].cells && rows[i].cells[0]) {
+      rows[i].cells[0].textContent = i + 1;
+    }
+  }
+}
+
+function flashRowColor(rowId, cssVar) {
+  var row = document.getElementById(rowId);
+  if (!row) return;
+  var color = getComputedStyle(document.documentElement).getPropertyValue(cssVar).trim();
+  if (!color) return;
+  var cells = row.querySelectorAll('td:not(.dice-cell)');
+  for (var i = 0; i < cells.length; i++) {
+    var endColor = getComputedStyle(cells[i]).backgroundColor || 'transparent';
+    cells[i].animate([
+      { backgroundColor: color },
+      { backgroundColor: endColor }
+    ], { duration: 8000, easing: 'ease-out' });
+  }
+}
+
+function cancelTableAnimations() {
+  for (var i = 0; i < _runningAnims.length; i++) {
+    _runningAnims[i].anim.cancel();
+    var el = _runningAnims[i].row;
+    if (_runningAnims[i].isDeparting) {
+      if (el.parentNode) el.parentNode.removeChild(el);
+    } else {
+      el.style.transform = '';
+      el.style.position = '';
+      el.style.willChange = '';
+      el.style.pointerEvents = '';
+    }
+  }
+  _runningAnims = [];
+  _tableAnimating = false;
+}
+
+function animateTableTransition(tbody, oldSnapshot, desiredOrder, removedIds, onComplete) {
+  if (_tableAnimating) cancelTableAnimations();
+
+  // Early exit: nothing to animate
+  if (removedIds.length === 0) {
+    var curDom = getOrderIds(tbody);
+    var match = curDom.length === desiredOrder.length;
+    if (match) {
+      for (var ci = 0; ci < desiredOrder.length; ci++) {
+        if (curDom[ci] !== desiredOrder[ci]) { match = false; break; }
+      }
+    }
+    var hasAdded = false;
+    for (var ni = 0; ni < desiredOrder.length; ni++) {
+      if (!oldSnapshot[desiredOrder[ni]]) { hasAdded = true; break; }
+    }
+    if (match && !hasAdded) {
+      updateRowCounters(tbody);
+      _tableOrder = desiredOrder.slice();
+      if (onComplete) onComplete();
+      return;
+    }
+  }
+
+  _tableAnimating = true;
+  _runningAnims = [];
+
+  var addedSet = {};
+  for (var ni = 0; ni < desiredOrder.length; ni++) {
+    if (!oldSnapshot[desiredOrder[ni]]) addedSet[desiredOrder[ni]] = true;
+  }
+
+  // ---- Phase 1: Collect departing rows ----
+  var departingRows = [];
+  for (var ri = 0; ri < removedIds.length; ri++) {
+    var rRow = document.getElementById('row' + removedIds[ri]);
+    if (rRow) departingRows.push(rRow);
+  }
+
+  // ---- Phase 2: Measure positions ----
+  // Working order = current DOM (includes departing rows + new rows at end).
+  var workingOrder = getOrderIds(tbody);
+
+  var currentPositions = {};
+  for (var woi = 0; woi < workingOrder.length; woi++) {
+    var wuid = workingOrder[woi];
+    var wRow = document.getElementById('row' + wuid);
+    if (wRow) currentPositions[wuid] = wRow.getBoundingClientRect().top;
+  }
+
+  // Hide departing rows from layout, temporarily reorder to desired,
+  // measure target positions, then restore — all synchronous, no paint.
+  for (var hi = 0; hi < departingRows.length; hi++)
+    departingRows[hi].style.display = 'none';
+
+  for (var di = 0; di < desiredOrder.length; di++) {
+    var dr = document.getElementById('row' + desiredOrder[di]);
+    if (dr) tbody.appendChild(dr);
+  }
+  var targetPositions = {};
+  for (var ti = 0; ti < desiredOrder.length; ti++) {
+    var tuid = desiredOrder[ti];
+    var tRow = document.getElementById('row' + tuid);
+    if (tRow) targetPositions[tuid] = tRow.getBoundingClientRect().top;
+  }
+
+  // Restore: show departing rows, restore working order
+  for (var shi = 0; shi < departingRows.length; shi++)
+    departingRows[shi].style.display = '';
+
+  for (var roi = 0; roi < workingOrder.length; roi++) {
+    var rr = document.getElementById('row' + workingOrder[roi]);
+    if (rr) tbody.appendChild(rr);
+  }
+
+  // ---- Phase 3: Calculate animation offsets ----
+  var lastOldBottom = 0;
+  for (var sk in oldSnapshot) {
+    var sb = oldSnapshot[sk].top + oldSnapshot[sk].height;
+    if (sb > lastOldBottom) lastOldBottom = sb;
+  }
+
+  var SETTLE_THRESHOLD = 15;
+  var animData = [];
+  for (var ai = 0; ai < desiredOrder.length; ai++) {
+    var auid = desiredOrder[ai];
+    if (addedSet[auid]) continue;
+    var aRow = document.getElementById('row' + auid);
+    if (!aRow || currentPositions[auid] === undefined
+        || targetPositions[auid] === undefined) continue;
+
+    var oldTop = oldSnapshot[auid] ? oldSnapshot[auid].top : lastOldBottom;
+    var curTop = currentPositions[auid];
+    var tgtTop = targetPositions[auid];
+
+    var startOff = oldTop - curTop;
+    var endOff   = tgtTop - curTop;
+
+    if (Math.abs(startOff) < 1 && Math.abs(endOff) < 1) continue;
+
+    animData.push({
+      uid: auid, row: aRow,
+      startOff: startOff, endOff: endOff,
+      direction: tgtTop - oldTop,
+      travelDist: Math.abs(endOff - startOff),
+      oldTop: oldTop
+    });
+  }
+
+  // ---- Phase 4: Stagger order (upper/lower groups) ----
+  var upper = [];
+  var lower = [];
+  var settlers = [];
+  for (var gi = 0; gi < animData.length; gi++) {
+    var ad = animData[gi];
+    if (ad.travelDist < SETTLE_THRESHOLD) {
+      settlers.push(ad);
+    } else if (ad.direction > 0) {
+      upper.push(ad);
+    } else {
+      lower.push(ad);
+    }
+  }
+
+  upper.sort(function(a, b) { return b.oldTop - a.oldTop; });
+  lower.sort(function(a, b) { return a.oldTop - b.oldTop; });
+
+  var sequence = [];
+  var uIdx = 0, lIdx = 0, pickU = true;
+  while (uIdx < upper.length || lIdx < lower.length) {
+    if (pickU && uIdx < upper.length) {
+      sequence.push(upper[uIdx++]); pickU = false;
+    } else if (!pickU && lIdx < lower.length) {
+      sequence.push(lower[lIdx++]); pickU = true;
+    } else if (uIdx < upper.length) {
+      sequence.push(upper[uIdx++]);
+    } else {
+      sequence.push(lower[lIdx++]);
+    }
+  }
+
+  var totalRows = sequence.length;
+  var stagger = totalRows > 0 ? Math.max(55, Math.min(120, 500 / totalRows)) : 80;
+  var flightMs = totalRows > 0 ? Math.max(750, Math.min(1300, 550 + totalRows * 80)) : 800;
+
+  // ---- Phase 5: Animate departing rows flying left ----
+  var departDelay = 0;
+  for (var dri = 0; dri < departingRows.length; dri++) {
+    var dRow = departingRows[dri];
+    dRow.style.position = 'relative';
+    dRow.style.willChange = 'transform, opacity';
+    dRow.style.pointerEvents = 'none';
+    var dAnim = dRow.animate([
+      { transform: 'translateX(0)',     opacity: 1, offset: 0 },
+      { transform: 'translateX(-60%)',  opacity: 1, offset: 0.4 },
+      { transform: 'translateX(-120%)', opacity: 0, offset: 1.0 }
+    ], { duration: 500, delay: departDelay, easing: 'cubic-bezier(0.25, 0, 0.9, 0.3)', fill: 'forwards' });
+    _runningAnims.push({ anim: dAnim, row: dRow, isDeparting: true });
+    departDelay += 60;
+  }
+
+  var baseDelay = removedIds.length > 0 ? 200 : 0;
+
+  // ---- Phase 5b: Animate arriving rows flying in from left ----
+  var arriveBaseDelay = baseDelay;
+  if (sequence.length > 0 || settlers.length > 0) {
+    arriveBaseDelay += flightMs * 0.4;
+  }
+  var addedKeys = Object.keys(addedSet);
+  for (var ari = 0; ari < addedKeys.length; ari++) {
+    var arUid = addedKeys[ari];
+    var arRow = document.getElementById('row' + arUid);
+    if (!arRow) continue;
+    var arCur = currentPositions[arUid];
+    var arTgt = targetPositions[arUid];
+    var arEndOff = (arTgt !== undefined && arCur !== undefined) ? (arTgt - arCur) : 0;
+    arRow.style.position = 'relative';
+    arRow.style.willChange = 'transform, opacity';
+    arRow.style.pointerEvents = 'none';
+    var arAnim = arRow.animate([
+      { transform: 'translateX(-120%) translateY(' + arEndOff + 'px)', opacity: 0, offset: 0 },
+      { transform: 'translateX(-60%) translateY(' + arEndOff + 'px)',  opacity: 1, offset: 0.6 },
+      { transform: 'translateX(0) translateY(' + arEndOff + 'px)',     opacity: 1, offset: 1.0 }
+    ], { duration: 500, delay: arriveBaseDelay + ari * 60, easing: 'cubic-bezier(0.1, 0.7, 0.75, 1)', fill: 'both' });
+    _runningAnims.push({ anim: arAnim, row: arRow, isArriving: true });
+  }
+
+  // ---- Phase 6a: Settle animations ----
+  for (var sti = 0; sti < settlers.length; sti++) {
+    var s = settlers[sti];
+    s.row.style.position = 'relative';
+    s.row.style.willChange = 'transform';
+    var sAnim = s.row.animate([
+      { transform: 'translateY(' + s.startOff + 'px)' },
+      { transform: 'translateY(' + s.endOff + 'px)' }
+    ], { duration: flightMs, delay: baseDelay, easing: 'ease-in-out', fill: 'both' });
+    _runningAnims.push({ anim: sAnim, row: s.row });
+  }
+
+  // ---- Phase 6b: Forward animate movers ----
+  // DOM stays in working (old) order → natural table stacking gives
+  // lower-group rows (later in DOM) the foreground. No z-index needed.
+  for (var si = 0; si < sequence.length; si++) {
+    var fd = sequence[si];
+    var row = fd.row;
+    var delay = baseDelay + si * stagger;
+    var isUpper = fd.direction > 0;
+
+    row.style.position = 'relative';
+    row.style.willChange = 'transform, opacity';
+
+    var midOff = ((fd.startOff + fd.endOff) / 2).toFixed(1);
+    var kf;
+    if (isUpper) {
+      kf = [
+        { transform: 'translateY(' + fd.startOff + 'px) scale(1)',  opacity: 1,   offset: 0,   easing: 'cubic-bezier(0.4, 0, 0.7, 0.4)' },
+        { transform: 'translateY(' + midOff + 'px) scale(0.95)',    opacity: 0.8, offset: 0.5, easing: 'cubic-bezier(0.3, 0.6, 0.6, 1)' },
+        { transform: 'translateY(' + fd.endOff + 'px) scale(1)',    opacity: 1,   offset: 1.0 }
+      ];
+    } else {
+      kf = [
+        { transform: 'translateY(' + fd.startOff + 'px) scale(1)',  opacity: 1, offset: 0,   easing: 'cubic-bezier(0.4, 0, 0.7, 0.4)' },
+        { transform: 'translateY(' + midOff + 'px) scale(1.04)',    opacity: 1, offset: 0.5, easing: 'cubic-bezier(0.3, 0.6, 0.6, 1)' },
+        { transform: 'translateY(' + fd.endOff + 'px) scale(1)',    opacity: 1, offset: 1.0 }
+      ];
+    }
+
+    var fAnim = row.animate(kf, {
+      duration: flightMs,
+      delay: delay,
+      easing: 'linear',
+      fill: 'both'
+    });
+    _runningAnims.push({ anim: fAnim, row: row });
+  }
+
+  // ---- Phase 7: Completion ----
+  function finalize() {
+    for (var i = 0; i < _runningAnims.length; i++) {
+      var a = _runningAnims[i];
+      a.anim.cancel();
+      if (a.isDeparting) {
+        if (a.row.parentNode) a.row.parentNode.removeChild(a.row);
+      } else {
+        a.row.style.transform = '';
+        a.row.style.position = '';
+        a.row.style.willChange = '';
+        a.row.style.pointerEvents = '';
+      }
+    }
+    for (var i = 0; i < desiredOrder.length; i++) {
+      var r = document.getElementById('row' + desiredOrder[i]);
+      if (r) tbody.appendChild(r);
+    }
+    _runningAnims = [];
+    _tableAnimating = false;
+    updateRowCounters(tbody);
+    _tableOrder = desiredOrder.slice();
+    if (onComplete) onComplete();
+  }
+
+  if (_runningAnims.length === 0) {
+    finalize();
+    return;
+  }
+
+  Promise.all(_runningAnims.map(function(a) { return a.anim.finished; }))
+    .then(finalize).catch(finalize);
+}
+
+// H2: Dynamically rebuild table rows to match game.User
+function updateTableRows(game) {
+  var tbody = document.getElementById('game_tbody');
+  var myId = getMyId();
+  var isAdmin = game.Admins && game.Admins.indexOf(myId) !== -1;
+  var showFinal = game.Ruleset && game.Ruleset.play_final;
+  var halfHeader = document.getElementById('halfcount_header');
+  if (halfHeader) halfHeader.style.display = showFinal ? '' : 'none';
+  var finalHeader = document.getElementById('finalcount_header');
+
+  // Check if any player has penalty > 0
+  var anyPenalty = game.User.some(function(u) { return (u.Penalty_Count || 0) > 0; });
+  var penaltyHeader = document.getElementById('penalty_header');
+  if (penaltyHeader) penaltyHeader.style.display = anyPenalty ? '' : 'none';
+
+  // Build current set of user IDs in table
+  var existingRows = {};
+  var rows = tbody.querySelectorAll('tr');
+  for (var i = 0; i < rows.length; i++) {
+    var rowId = rows[i].id;
+    if (rowId && rowId.startsWith('row')) {
+      existingRows[rowId.replace('row', '')] = rows[i];
+    }
+  }
+
+  // Add/update rows for each user
+  game.User.forEach(function(juser, idx) {
+    var row = document.getElementById('row' + juser.Id);
+    if (!row) {
+      // Create new row
+      row = document.createElement('tr');
+      row.id = 'row' + juser.Id;
+      row.innerHTML = '<td class="col-counter"></td>'
+        + '<td id="user' + juser.Id + '" class="col-name"></td>'
+        + '<td id="chips' + juser.Id + '" class="col-chips"></td>'
+        + '<td id="Number_Dice' + juser.Id + '" class="col-throws"></td>'
+        + '<td id="dice1' + juser.Id + '" class="dice-cell col-dice"></td>'
+        + '<td id="dice2' + juser.Id + '" class="dice-cell col-dice"></td>'
+        + '<td id="dice3' + juser.Id + '" class="dice-cell col-dice"></td>'
+        + '<td id="first' + juser.Id + '" class="col-half"' + (showFinal ? '' : ' style="display:none"') + '></td>'
+        + '<td id="finalcount' + juser.Id + '" class="col-final"></td>'
+        + '<td id="penalty' + juser.Id + '" class="col-penalty"' + (anyPenalty ? '' : ' style="display:none"') + '></td>';
+      tbody.appendChild(row);
+    }
+
+    // Counter: use first cell directly
+    row.cells[0].textContent = idx + 1;
+
+    // G5: Pending player display
+    if (juser.Pending_Join) {
+      row.className = 'pending-row';
+    } else {
+      row.className = '';
+    }
+
+    // F4: Name + admin badge + leave icon
+    var nameCell = document.getElementById('user' + juser.Id);
+    var nameHtml = juser.Name;
+
+    // Second line: status and/or leave icon
+    var secondLine = '';
+    if (juser.Pending_Join) secondLine += '<small>(wartet)</small> ';
+    // Leave icon: green if active, gray only if user can toggle it (own or admin)
+    var clickable = (juser.Id === myId || isAdmin);
+    var leaveIconSvg = '<svg viewBox="0 0 512 512" fill="currentColor" width="14" height="14"><path d="M497 273L329 441c-15 15-41 4.5-41-17v-96H152c-13.3 0-24-10.7-24-24v-96c0-13.3 10.7-24 24-24h136V88c0-21.4 25.9-32.1 41-17l168 168c9.3 9.4 9.3 24.6 0 34zM192 436v-40c0-6.6-5.4-12-12-12H96c-17.7 0-32-14.3-32-32V160c0-17.7 14.3-32 32-32h84c6.6 0 12-5.4 12-12V76c0-6.6-5.4-12-12-12H96c-53 0-96 43-96 96v192c0 53 43 96 96 96h84c6.6 0 12-5.4 12-12z"/></svg>';
+    if (juser.Leave_After_Game) {
+      secondLine += '<span class="leave-icon leave-active"'
+        + ' title="Verlassen vorgemerkt (klicken zum Aufheben)"'
+        + (clickable ? ' onclick="toggle_leave(' + juser.Id + ')"' : '')
+        + '>' + leaveIconSvg + '</span>';
+    } else if (clickable) {
+      secondLine += '<span class="leave-icon leave-inactive"'
+        + ' title="Nach dem Spiel verlassen"'
+        + ' onclick="toggle_leave(' + juser.Id + ')"'
+        + '>' + leaveIconSvg + '</span>';
+    }
+    if (secondLine) nameHtml += '<div>' + secondLine + '</div>';
+    nameCell.innerHTML = nameHtml;
+
+    // Chips
+    document.getElementById('chips' + juser.Id).innerHTML = juser.Chips;
+
+    // Halfcount (only visible in finale mode)
+    var hcEl = document.getElementById('first' + juser.Id);
+    if (hcEl) {
+      hcEl.innerHTML = juser.Halfcount;
+      hcEl.style.display = showFinal ? '' : 'none';
+    }
+
+    // Finalcount (always visible — "Runden")
+    var fcEl = document.getElementById('finalcount' + juser.Id);
+    if (fcEl) {
+      fcEl.innerHTML = juser.Finalcount;
+    }
+
+    // Penalty count
+    var pcEl = document.getElementById('penalty' + juser.Id);
+    if (pcEl) {
+      var pc = juser.Penalty_Count || 0;
+      pcEl.innerHTML = pc > 0 ? pc : '';
+      pcEl.style.display = anyPenalty ? '' : 'none';
+    }
+
+    // Number of dice throws
+    document.getElementById('Number_Dice' + juser.Id).innerHTML = juser.Number_Dice;
+
+    // Dices in table
+    var d1 = document.getElementById('dice1' + juser.Id);
+    var d2 = document.getElementById('dice2' + juser.Id);
+    var d3 = document.getElementById('dice3' + juser.Id);
+    d1.innerHTML = '';
+    d2.innerHTML = '';
+    d3.innerHTML = '';
+    if (juser.Dices && juser.Dices.length > 0) {
+      for (var dn in juser.Dices) {
+        var jdice = juser.Dices[dn];
+        if (jdice['Dice1'] !== undefined) appendDice(d1, jdice['Dice1']);
+        if (jdice['Dice2'] !== undefined) appendDice(d2, jdice['Dice2']);
+        if (jdice['Dice3'] !== undefined) appendDice(d3, jdice['Dice3']);
+      }
+    }
+
+    // Row background color via CSS classes (dark-mode safe).
+    // Cancel any running flash animations on cells first so they
+    // cannot override the new CSS background (Web Animations API
+    // has higher priority than CSS on the same element).
+    row.classList.remove('row-passive', 'row-normal', 'row-stripe', 'row-own-player', 'row-active-turn');
+    row.style.backgroundColor = '';
+    var bgCells = row.querySelectorAll('td:not(.dice-cell)');
+    for (var ci = 0; ci < bgCells.length; ci++) {
+      var cellAnims = bgCells[ci].getAnimations ? bgCells[ci].getAnimations() : [];
+      for (var ai = 0; ai < cellAnims.length; ai++) cellAnims[ai].cancel();
+    }
+    if (juser.Pending_Join) {
+      // Already handled by pending-row class
+    } else if (juser.Passive) {
+      row.classList.add('row-passive');
+    } else if (juser.Id == game.Move) {
+      row.classList.add('row-active-turn');
+    } else {
+      row.classList.add('row-normal');
+      if (idx % 2 === 1) {
+        row.classList.add('row-stripe');
+      }
+    }
+    if (juser.Id == myId) {
+      row.classList.add('row-own-player');
+    }
+  });
+}
+
+// ============= Main refresh function =============
+function refresh_game(game) {
+  _lastGameState = game;
+  var gameid = getGameId();
+  var waiting_user_id = game.Move;
+  var waitinguserstorage = document.getElementById('waiting_id');
+  var throwbutton = document.getElementById('startgame_id');
+  var id = getMyId();
+  var isAdmin = game.Admins && game.Admins.indexOf(id) !== -1;
+
+  // Admin info
+  var admininfo = document.getElementById('admin_information');
+  if (admininfo) admininfo.innerHTML = 'Admin gespielte Hälften: ' + game['Game_Half_Count'];
+
+  // H2: Toggle admin panel visibility dynamically
+  var adminPanel = document.getElementById('admin_interface');
+  if (adminPanel) {
+    adminPanel.style.display = isAdmin ? 'block' : 'none';
+  }
+
+  // Check if player / pending / spectator
+  checkIfPlayer(game);
+
+  // Redirect to lobby if game returned to waiting
+  var game_state = game['State'];
+  if (game_state == 'waiting') {
+    var getUrl = window.location;
+    var baseUrl = getUrl.protocol + "//" + getUrl.host;
+    window.location.replace(baseUrl + '/game_waiting/' + gameid);
+    return;
+  }
+
+  var me_inactive = false;
+  for (var num in game.User) {
+    if (game.User[num]['Id'] == id && game.User[num]['Passive']) {
+      me_inactive = true;
+    }
+  }
+
+  // Stack chips
+  document.getElementById('StackChips_id').innerHTML = 'Chips: ' + game.Stack;
+
+  // Game phase indicator (1. Hälfte / 2. Hälfte / Finale)
+  var phaseCol = document.getElementById('game_phase_col');
+  var phaseText = document.getElementById('game_phase_text');
+  var chipsCol = document.getElementById('chips_col');
+  var showFinalPhase = game.Ruleset && game.Ruleset.play_final;
+  if (showFinalPhase) {
+    var phaseLabel = '';
+    if (game_state == 'playfinal') {
+      phaseLabel = 'Finale';
+    } else if (game['Game_Half_Count'] >= 1) {
+      phaseLabel = '2. H\u00e4lfte';
+    } else {
+      phaseLabel = '1. H\u00e4lfte';
+    }
+    phaseText.innerHTML = phaseLabel;
+    phaseCol.style.display = '';
+  } else {
+    phaseCol.style.display = 'none';
+  }
+
+  // First user
+  var firstuser_id = game['First'];
+  document.getElementById('first_user_id').innerHTML = firstuser_id;
+
+  // First user dice count
+  for (var num in game.User) {
+    if (game.User[num].Id == firstuser_id) {
+      var anzahlel = document.getElementById('throw_id');
+      var anzahl_number_el = document.getElementById('throw_number_id');
+      anzahlel.innerHTML = 'Würfe: ' + game.User[num]['Number_Dice'];
+      anzahl_number_el.innerHTML = game.User[num]['Number_Dice'];
+      document.getElementById('first_user_dice_count_id').innerHTML = game.User[num]['Number_Dice'];
+      break;
+    }
+  }
+
+  // Game message (uses CSS transition instead of animation for compositing)
+  var el_message = document.getElementById('Message');
+  if (game.Message) {
+    if (el_message.innerHTML != game.Message) {
+      el_message.style.transition = 'none';
+      el_message.style.color = 'var(--message-start)';
+      el_message.offsetHeight;
+      el_message.style.transition = '';
+      el_message.style.color = '';
+    }
+    el_message.innerHTML = game.Message;
+  } else {
+    el_message.innerHTML = '';
+  }
+
+  // Count active (non-pending) players
+  var activePlayerCount = 0;
+  for (var num in game.User) {
+    if (!game.User[num].Pending_Join) activePlayerCount++;
+  }
+  var notEnoughPlayers = activePlayerCount < 2 &&
+      (game_state == 'started' || game_state == 'playfinal');
+
+  // C4: Improved "Warten auf" display
+  if (notEnoughPlayers) {
+    waitinguserstorage.innerHTML = 'Warten auf: Mitspieler';
+  } else if (waiting_user_id == -1) {
+    if (isUndecided(game)) {
+      waitinguserstorage.innerHTML = 'Warten auf: Aufdecken';
+    } else {
+      waitinguserstorage.innerHTML = 'Warten auf: Chip Verteilung';
+    }
+  } else {
+    // Find the waiting user's name
+    for (var num in game.User) {
+      if (game.User[num]['Id'] == waiting_user_id) {
+        waitinguserstorage.innerHTML = 'Warten auf: ' + game.User[num]['Name'];
+        break;
+      }
+    }
+  }
+
+  // Play "your turn" sound when the waiting user changes to me.
+  // _lastWaitingUserId === undefined on first load → suppress sound on page load.
+  if (_lastWaitingUserId !== undefined
+      && waiting_user_id !== _lastWaitingUserId
+      && waiting_user_id === id) {
+    playSound(soundDiceY);
+  }
+  _lastWaitingUserId = waiting_user_id;
+
+  // Sort users so the round starter is first
+  if (game.First) {
+    game.User = buildSortedOrder(game.User, game.First);
+  }
+
+  // H2: Update table rows dynamically
+  var tbody = document.getElementById('game_tbody');
+  var desiredOrder = game.User.map(function(u) { return String(u.Id); });
+
+  // Snapshot old positions before any DOM changes
+  var oldSnapshot = {};
+  var snapshotRows = tbody.querySelectorAll('tr');
+  for (var si = 0; si < snapshotRows.length; si++) {
+    if (snapshotRows[si].id && snapshotRows[si].id.startsWith('row')) {
+      var suid = snapshotRows[si].id.replace('row', '');
+      oldSnapshot[suid] = snapshotRows[si].getBoundingClientRect();
+    }
+  }
+
+  // Detect removed users (in DOM but not in game data)
+  var gameUserIds = {};
+  game.User.forEach(function(u) { gameUserIds[String(u.Id)] = true; });
+  var removedIds = [];
+  Object.keys(oldSnapshot).forEach(function(uid) {
+    if (!gameUserIds[uid]) removedIds.push(uid);
+  });
+
+  updateTableRows(game);
+
+  if (_isFirstTableLoad) {
+    removedIds.forEach(function(uid) {
+      var r = document.getElementById('row' + uid);
+      if (r && r.parentNode) r.parentNode.removeChild(r);
+    });
+    for (var i = 0; i < desiredOrder.length; i++) {
+      var r = document.getElementById('row' + desiredOrder[i]);
+      if (r) tbody.appendChild(r);
+    }
+    updateRowCounters(tbody);
+    _tableOrder = desiredOrder.slice();
+    _isFirstTableLoad = false;
+  } else {
+    animateTableTransition(tbody, oldSnapshot, desiredOrder, removedIds);
+  }
+
+  // C1: Restore own dice cup from server state
+  var me_data = null;
+  for (var num in game.User) {
+    if (game.User[num].Id == id) {
+      me_data = game.User[num];
+      break;
+    }
+  }
+  if (me_data) {
+    // Reset dice state at the start of each round (before first roll)
+    if (me_data.Number_Dice == 0) {
+      _diceInCup = [true, true, true];
+      _myDiceValues = [0, 0, 0];
+      _diceOutAtRoll = [false, false, false];
+      clearSwapState();
+      _diceHiddenAfterRoll = false;
+    }
+
+    // Fill in dice values from server state (page reload or after pullup)
+    if (me_data.Number_Dice > 0 && me_data.Dices && me_data.Dices.length > 0) {
+      var anyFilled = false;
+      for (var dn in me_data.Dices) {
+        var jdice = me_data.Dices[dn];
+        if (jdice['Dice1'] !== undefined && _myDiceValues[0] === 0) {
+          _myDiceValues[0] = jdice['Dice1'];
+          anyFilled = true;
+        }
+        if (jdice['Dice2'] !== undefined && _myDiceValues[1] === 0) {
+          _myDiceValues[1] = jdice['Dice2'];
+          anyFilled = true;
+        }
+        if (jdice['Dice3'] !== undefined && _myDiceValues[2] === 0) {
+          _myDiceValues[2] = jdice['Dice3'];
+          anyFilled = true;
+        }
+      }
+      // After pullup reveals all dice, clear hidden state
+      if (_myDiceValues[0] > 0 && _myDiceValues[1] > 0 && _myDiceValues[2] > 0) {
+        _diceHiddenAfterRoll = false;
+      }
+      if (anyFilled) {
+        _diceOutAtRoll = [!_diceInCup[0], !_diceInCup[1], !_diceInCup[2]];
+      }
+    } else if (me_data.Number_Dice > 0 && (!me_data.Dices || me_data.Dices.length === 0)
+               && _myDiceValues[0] === 0 && _myDiceValues[1] === 0 && _myDiceValues[2] === 0
+               && waiting_user_id != id) {
+      _diceHiddenAfterRoll = true;
+    }
+
+    if (!_diceAnimating) renderDiceCup();
+  }
+
+  // End/Pause button logic
+  var btnEP = document.getElementById('btn_endpause');
+  var controlsRight = document.querySelector('.controls-right');
+  var gameControls = document.getElementById('game_controls');
+  var onlyTwoPlayers = (activePlayerCount <= 2);
+  if (btnEP && me_data) {
+    var isMyTurn = (id == waiting_user_id);
+    var myDiceCount = me_data.Number_Dice;
+    var firstDiceCount = parseInt(document.getElementById('first_user_dice_count_id').innerHTML) || 3;
+    var amFirst = (id == game['First']);
+    var penaltyCount = me_data.Penalty_Count || 0;
+    var canPause = (game.Stack == 0 && me_data.Chips == 0 && game_state != 'playfinal');
+
+    // Remove paused overlay by default
+    gameControls.classList.remove('controls-paused');
+
+    if (me_data.Passive && game_state == 'playfinal') {
+      // Non-finalist in finale: fully disabled controls, no unpause
+      btnEP.textContent = 'Pause';
+      btnEP.setAttribute('data-mode', 'pause');
+      btnEP.disabled = true;
+      btnEP.className = 'btn btn-endpause btn-pause-locked';
+      gameControls.classList.add('controls-paused');
+    } else if (me_data.Passive) {
+      // Player is paused: show Pause button to un-pause, gray out controls
+      btnEP.textContent = 'Pause';
+      btnEP.setAttribute('data-mode', 'pause');
+      btnEP.disabled = false;
+      btnEP.className = 'btn btn-endpause btn-pause-locked';
+      gameControls.classList.add('controls-paused');
+    } else if (myDiceCount == 0) {
+      // Start of round: show Pause button (available to all players, not just active)
+      btnEP.textContent = 'Pause';
+      btnEP.setAttribute('data-mode', 'pause');
+      btnEP.className = 'btn btn-primary btn-endpause';
+
+      if (onlyTwoPlayers) {
+        btnEP.disabled = true;
+      } else if (game_state == 'playfinal') {
+        // Finale: pause is never allowed
+        btnEP.disabled = true;
+      } else if (notEnoughPlayers) {
+        btnEP.disabled = true;
+      } else if (canPause && penaltyCount > 0) {
+        // Must roll instead of pausing (penalty)
+        btnEP.disabled = true;
+      } else {
+        // Either can legitimately pause, or pressing will trigger penalty
+        btnEP.disabled = false;
+      }
+    } else {
+      // After rolling: show Ende button
+      btnEP.textContent = 'Ende';
+      btnEP.setAttribute('data-mode', 'ende');
+      btnEP.className = 'btn btn-primary btn-endpause';
+
+      if (!isMyTurn || notEnoughPlayers) {
+        btnEP.disabled = true;
+      } else if (isSwapActive()) {
+        btnEP.disabled = true;
+      } else {
+        // Active while player can still roll
+        var canStillRoll = false;
+        if (amFirst) {
+          canStillRoll = myDiceCount < 3;
+        } else {
+          canStillRoll = myDiceCount < firstDiceCount;
+        }
+        btnEP.disabled = !canStillRoll;
+      }
+    }
+  }
+
+  // Throw button color and state
+  var diceOnCooldown = document.getElementById('btn_dice').getAttribute('data-cooldown') === 'true';
+  if (notEnoughPlayers) {
+    throwbutton.className = 'buttongray containerturner';
+    throwbutton.disabled = true;
+  } else if (id == waiting_user_id && !diceOnCooldown) {
+    throwbutton.className = 'buttongreen containerturner';
+    throwbutton.disabled = false;
+  } else {
+    throwbutton.className = 'buttongray containerturner';
+    throwbutton.disabled = false;
+  }
+
+  // Unified round status row
+  var roundRow = document.getElementById('round_status_row');
+  var roundFinished = (waiting_user_id == -1);
+  var needsReveal = roundFinished && isUndecided(game);
+
+  // Aufdecken button: green when waiting for reveal and player has hidden dice
+  var pullupBtn = document.getElementById('btn_pullup_container');
+  var pullupIsGreen = false;
+  if (pullupBtn) {
+    var myDicesRevealed = me_data && me_data.Dices && me_data.Dices.length >= 3;
+    if (needsReveal && me_data && me_data.Number_Dice > 0 && !myDicesRevealed) {
+      pullupBtn.className = 'buttongreen containercup';
+      pullupIsGreen = true;
+    } else {
+      pullupBtn.className = 'buttongray containercup';
+    }
+  }
+  var readyToDistribute = roundFinished && !needsReveal;
+
+  // Play reveal sound whenever the Aufdecken button becomes green
+  if (pullupIsGreen && !_pullupWasGreen) {
+    playSound(soundLift);
+  }
+  _pullupWasGreen = pullupIsGreen;
+  _wasInRevealPhase = needsReveal;
+
+  var newPhase = 'idle';
+  if (readyToDistribute && game.Scoring) {
+    newPhase = 'distribute';
+  } else if (needsReveal) {
+    newPhase = 'reveal';
+  } else if (!roundFinished) {
+    newPhase = 'running';
+  }
+
+  if (newPhase === 'distribute') {
+    var fullInfo = formatScoringText(game.Scoring);
+    if (_currentRoundPhase !== 'distribute') {
+      // Flash high (green) and low (red) rows when distribute button appears
+      if (game.Scoring) {
+        if (game.Scoring.High_Id) flashRowColor('row' + game.Scoring.High_Id, '--flash-high');
+        if (game.Scoring.Low_Id)  flashRowColor('row' + game.Scoring.Low_Id, '--flash-low');
+      }
+      roundRow.innerHTML = '<button class="btn btn-success" id="distribute_btn" '
+        + 'onclick="distribute()" disabled>Verteilen</button> '
+        + '<span id="round_info_text">' + fullInfo + '</span>';
+      setTimeout(function() {
+        var btn = document.getElementById('distribute_btn');
+        if (btn) btn.disabled = false;
+      }, 3000);
+      // Capture screenshot once the final result is rendered
+      setTimeout(captureScreenshot, 500);
+    } else {
+      var infoSpan = document.getElementById('round_info_text');
+      if (infoSpan) infoSpan.innerHTML = fullInfo;
+    }
+  } else if (newPhase === 'reveal') {
+    var voteHtml = '';
+    if (game.Reveal_Votes > 0) {
+      voteHtml = ' <span id="reveal_votes">(' + game.Reveal_Votes + ' Stimme(n))</span>';
+    }
+    if (_currentRoundPhase !== 'reveal') {
+      roundRow.innerHTML = '<button class="btn btn-warning" id="reveal_all_btn" onclick="vote_reveal_all()" disabled>'
+        + 'Alles aufdecken</button>' + voteHtml;
+      setTimeout(function() {
+        var btn = document.getElementById('reveal_all_btn');
+        if (btn) btn.disabled = false;
+      }, 15000);
+    } else {
+      var existingVotes = document.getElementById('reveal_votes');
+      if (game.Reveal_Votes > 0) {
+        if (existingVotes) {
+          existingVotes.innerHTML = '(' + game.Reveal_Votes + ' Stimme(n))';
+        } else {
+          var revealBtn = document.getElementById('reveal_all_btn');
+          if (revealBtn) {
+            revealBtn.insertAdjacentHTML('afterend', ' <span id="reveal_votes">(' + game.Reveal_Votes + ' Stimme(n))</span>');
+          }
+        }
+      } else if (existingVotes) {
+        existingVotes.remove();
+      }
+    }
+  } else if (newPhase === 'running') {
+    var lastText = formatScoringText(game.Last_Scoring);
+    if (lastText) {
+      roundRow.innerHTML = '<span>Letzte Runde: ' + lastText + '</span>';
+    } else {
+      roundRow.innerHTML = '';
+    }
+  } else {
+    roundRow.innerHTML = '';
+  }
+  _currentRoundPhase = newPhase;
+
+  // Lobby after game button
+  var lobbyBtn = document.getElementById('mark_lobby_btn');
+  if (lobbyBtn) {
+    if (game.Lobby_After_Game) {
+      lobbyBtn.className = 'btn btn-success btn-sm';
+      lobbyBtn.innerHTML = 'Lobby nach dem Spiel geplant (klicken zum Aufheben)';
+    } else {
+      lobbyBtn.className = 'btn btn-warning btn-sm';
+      lobbyBtn.innerHTML = 'Zurück zur Lobby nach dem Spiel';
+    }
+  }
+
+  // H2: Update player select lists
+  if (typeof updatePlayerSelects === 'function') {
+    updatePlayerSelects(game);
+  }
+
+  // R6: Update rules display data
+  if (game.Ruleset) {
+    updateRulesModal(game.Ruleset);
+  }
+}
+
+// R6: Build rules modal content
+function updateRulesModal(ruleset) {
+  var title = document.getElementById('rules_title');
+  var content = document.getElementById('rules_content');
+  if (!title || !content) return;
+  title.innerHTML = 'Regeln: ' + ruleset.name;
+  var rulesBtn = document.getElementById('rules_floating_btn');
+  if (rulesBtn) rulesBtn.title = 'Regeln: ' + ruleset.name;
+  var html = '<p><strong>Chips:</strong> ' + ruleset.stack_max + ' | <strong>Finale:</strong> ' + (ruleset.play_final ? 'Ja' : 'Nein') + '</p>';
+  html += '<table class="table table-condensed rules-table"><thead><tr><th class="rules-col-kombi">Kombination</th><th>Name</th><th>Chips</th></tr></thead><tbody>';
+  for (var i = 0; i < ruleset.rules.length; i++) {
+    var r = ruleset.rules[i];
+    html += '<tr><td class="rules-col-kombi">' + r.dice + '</td><td>' + r.name + '</td><td>' + (r.chips == -1 ? 'Alle (' + r.name + ')' : r.chips) + '</td></tr>';
+  }
+  html += '</tbody></table>';
+  html += '<p><small>Alle weiteren Kombinationen: Schrott (1 Chip)</small></p>';
+  content.innerHTML = html;
+}
+
+// myDice: the player's dice from the embedded snapshot, if available
+function restoreMyDice(game, myDice) {
+  if (!_needsDiceRestore) return;
+  _needsDiceRestore = false;
+
+  var myId = getMyId();
+  var me = null;
+  for (var i = 0; i < game.User.length; i++) {
+    if (game.User[i].Id === myId) { me = game.User[i]; break; }
+  }
+  if (!me || me.Number_Dice === 0) return;
+  if (_myDiceValues[0] > 0 && _myDiceValues[1] > 0 && _myDiceValues[2] > 0) return;
+
+  function applyMyDice(res) {
+    _diceInCup = [!res.dice1_visible, !res.dice2_visible, !res.dice3_visible];
+    _diceOutAtRoll = [res.dice1_visible, res.dice2_visible, res.dice3_visible];
+
+    if (game.Move === myId) {
+      _myDiceValues = [res.dice1 || 0, res.dice2 || 0, res.dice3 || 0];
+      _diceHiddenAfterRoll = false;
+    } else {
+      _myDiceValues = [
+        res.dice1_visible ? (res.dice1 || 0) : 0,
+        res.dice2_visible ? (res.dice2 || 0) : 0,
+        res.dice3_visible ? (res.dice3 || 0) : 0
+      ];
+      _diceHiddenAfterRoll = !res.dice1_visible || !res.dice2_visible || !res.dice3_visible;
+    }
+
+    if (!_diceAnimating) renderDiceCup();
+  }
+
+  if (myDice) { applyMyDice(myDice); return; }
+
+  var gameid = getGameId();
+  var xhttp = new XMLHttpRequest();
+  xhttp.open("GET", "/api/game/" + gameid + "/user/" + myId + "/mydice");
+  xhttp.onreadystatechange = function() {
+    if (xhttp.readyState == XMLHttpRequest.DONE && xhttp.status == 200) {
+      applyMyDice(JSON.parse(xhttp.responseText));
+    }
+  };
+  xhttp.send();
+}
+
+// Game state rendered into the page by the server (null if disabled)
+var _initialState = _pageData.snapshot;
+var _embeddedVersion = null;
+
+function initial_game_data() {
+  if (_initialState) {
+    var snap = _initialState;
+    _initialState = null;
+    _embeddedVersion = snap.Game.State_Version;
+    refresh_game(snap.Game);
+    restoreMyDice(snap.Game, snap.My_Id === getMyId() ? snap.My_Dice : null);
+    return;
+  }
+  var gameid = getGameId();
+  var xhttp = new XMLHttpRequest();
+  xhttp.open("GET", "/api/game/" + gameid);
+  xhttp.setRequestHeader("Content-Type", "application/json");
+  xhttp.onreadystatechange = function () {
+    if (xhttp.readyState == XMLHttpRequest.DONE) {
+      if (xhttp.status == 200) {
+        var res = JSON.parse(xhttp.responseText);
+        refresh_game(res);
+        restoreMyDice(res);
+      }
+    }
+  }
+  xhttp.send(JSON.stringify({}));
+}
+
+function startup() {
+  var id = localStorage.getItem('id');
+  var user = document.getElementById('ownuser');
+  user.innerHTML = "Spieler: " + (localStorage.getItem('name') || '');
+  // Pre-fill mid-game join input from localStorage
+  var savedName = localStorage.getItem('name');
+  if (savedName) {
+    var joinInput = document.getElementById('join_name');
+    if (joinInput && !joinInput.value) joinInput.value = savedName;
+  }
+  initial_game_data();
+  _kbAutoLoad();
+}
+
+startup();
+
+document.addEventListener('DOMContentLoaded', function() {
+  var container = document.getElementById('floating-icons');
+  if (container) {
+    var kbBtn = document.createElement('a');
+    kbBtn.id = 'kb_floating_btn';
+    kbBtn.className = 'floating-icon-btn';
+    kbBtn.href = '#';
+    kbBtn.onclick = function(e) { e.preventDefault(); showKbModal(); };
+    kbBtn.title = 'Tastatursteuerung';
+    kbBtn.style.display = 'none';
+    kbBtn.innerHTML = '<svg viewBox="0 0 576 512" fill="currentColor" width="16" height="16"><path d="M528 64H48C21.49 64 0 85.49 0 112v288c0 26.51 21.49 48 48 48h480c26.51 0 48-21.49 48-48V112c0-26.51-21.49-48-48-48zm8 336c0 4.411-3.589 8-8 8H48c-4.411 0-8-3.589-8-8V112c0-4.411 3.589-8 8-8h480c4.411 0 8 3.589 8 8v288zM170 270v-28c0-6.627-5.373-12-12-12h-28c-6.627 0-12 5.373-12 12v28c0 6.627 5.373 12 12 12h28c6.627 0 12-5.373 12-12zm96 0v-28c0-6.627-5.373-12-12-12h-28c-6.627 0-12 5.373-12 12v28c0 6.627 5.373 12 12 12h28c6.627 0 12-5.373 12-12zm96 0v-28c0-6.627-5.373-12-12-12h-28c-6.627 0-12 5.373-12 12v28c0 6.627 5.373 12 12 12h28c6.627 0 12-5.373 12-12zm96 0v-28c0-6.627-5.373-12-12-12h-28c-6.627 0-12 5.373-12 12v28c0 6.627 5.373 12 12 12h28c6.627 0 12-5.373 12-12zm-336 82v-28c0-6.627-5.373-12-12-12H72c-6.627 0-12 5.373-12 12v28c0 6.627 5.373 12 12 12h28c6.627 0 12-5.373 12-12zm384 0v-28c0-6.627-5.373-12-12-12h-28c-6.627 0-12 5.373-12 12v28c0 6.627 5.373 12 12 12h28c6.627 0 12-5.373 12-12zM98 198v-28c0-6.627-5.373-12-12-12H58c-6.627 0-12 5.373-12 12v28c0 6.627 5.373 12 12 12h28c6.627 0 12-5.373 12-12zm96 0v-28c0-6.627-5.373-12-12-12h-28c-6.627 0-12 5.373-12 12v28c0 6.627 5.373 12 12 12h28c6.627 0 12-5.373 12-12zm96 0v-28c0-6.627-5.373-12-12-12h-28c-6.627 0-12 5.373-12 12v28c0 6.627 5.373 12 12 12h28c6.627 0 12-5.373 12-12zm96 0v-28c0-6.627-5.373-12-12-12h-28c-6.627 0-12 5.373-12 12v28c0 6.627 5.373 12 12 12h28c6.627 0 12-5.373 12-12zm96 0v-28c0-6.627-5.373-12-12-12h-28c-6.627 0-12 5.373-12 12v28c0 6.627 5.373 12 12 12h28c6.627 0 12-5.373 12-12zm-98 158v-16c0-6.627-5.373-12-12-12H204c-6.627 0-12 5.373-12 12v16c0 6.627 5.373 12 12 12h168c6.627 0 12-5.373 12-12z"/></svg>';
+    container.insertBefore(kbBtn, container.firstChild);
+    if (!matchMedia('(hover: none) and (pointer: coarse)').matches) {
+      kbBtn.style.display = '';
+    }
+
+    var camBtn = document.createElement('a');
+    camBtn.id = 'screenshot_floating_btn';
+    camBtn.className = 'floating-icon-btn';
+    camBtn.href = '#';
+    camBtn.style.display = 'none';
+    camBtn.onclick = function(e) { e.preventDefault(); copyScreenshotToClipboard(); };
+    camBtn.title = 'Rundenergebnis Screenshot';
+    camBtn.innerHTML = '<svg viewBox="0 0 512 512" fill="currentColor" width="16" height="16"><path d="M149.1 64.8L138.7 96H64C28.7 96 0 124.7 0 160v256c0 35.3 28.7 64 64 64h384c35.3 0 64-28.7 64-64V160c0-35.3-28.7-64-64-64H373.3l-10.4-31.2C356.4 45.2 338.1 32 317.4 32H194.6c-20.7 0-39 13.2-45.5 32.8zM256 384c-53 0-96-43-96-96s43-96 96-96 96 43 96 96-43 96-96 96z"/></svg>';
+    container.insertBefore(camBtn, container.firstChild);
+
+    var beerBtn = document.createElement('a');
+    beerBtn.id = 'beer_floating_btn';
+    beerBtn.className = 'floating-icon-btn';
+    beerBtn.href = '#';
+    beerBtn.onclick = function(e) { e.preventDefault(); showBeerSummary(); };
+    beerBtn.title = 'Bier-Statistik';
+    beerBtn.innerHTML = '<svg viewBox="0 0 512 512" fill="currentColor" width="16" height="16"><path d="M416 64h-48V16c0-8.8-7.2-16-16-16H64C55.2 0 48 7.2 48 16v352c0 44.2 35.8 80 80 80h176c44.2 0 80-35.8 80-80v-48h32c35.3 0 64-28.7 64-64V128c0-35.3-28.7-64-64-64zm-32 192c0 17.6-14.4 32-32 32h-32V128h32c17.6 0 32 14.4 32 32v96zM208 288c0 8.8-7.2 16-16 16s-16-7.2-16-16V128c0-8.8 7.2-16 16-16s16 7.2 16 16v160zm-80 0c0 8.8-7.2 16-16 16s-16-7.2-16-16V128c0-8.8 7.2-16 16-16s16 7.2 16 16v160zm160 0c0 8.8-7.2 16-16 16s-16-7.2-16-16V128c0-8.8 7.2-16 16-16s16 7.2 16 16v160z"/></svg>';
+    container.insertBefore(beerBtn, container.firstChild);
+
+    var btn = document.createElement('a');
+    btn.id = 'rules_floating_btn';
+    btn.className = 'floating-icon-btn';
+    btn.href = '#';
+    btn.onclick = function(e) { e.preventDefault(); showRules(); };
+    btn.title = 'Regeln';
+    btn.innerHTML = '<svg viewBox="0 0 448 512" fill="currentColor" width="16" height="16"><path d="M448 360V24c0-13.3-10.7-24-24-24H96C43 0 0 43 0 96v320c0 53 43 96 96 96h328c13.3 0 24-10.7 24-24v-16c0-8.6-4.6-16.2-11.5-20.4-4.8-12-4.8-42.2 0-54.2 6.9-4.2 11.5-11.8 11.5-20.4zM96 404c-28.4 0-48-10.2-48-28s19.6-28 48-28h288v56H96zm0-236h288v24H96v-24z"/></svg>';
+    container.insertBefore(btn, container.firstChild);
+  }
+  var rulesModal = document.getElementById('rulesModal');
+  if (rulesModal) {
+    window.addEventListener('click', function(e) {
+      if (e.target === rulesModal) rulesModal.style.display = 'none';
+    });
+  }
+  var beerModal = document.getElementById('beerModal');
+  if (beerModal) {
+    window.addEventListener('click', function(e) {
+      if (e.target === beerModal) beerModal.style.display = 'none';
+    });
+  }
+  var kbModal = document.getElementById('kbModal');
+  if (kbModal) {
+    window.addEventListener('click', function(e) {
+      if (e.target === kbModal) closeKbModal();
+    });
+  }
+});
+
+// ============= Configurable keyboard bindings =============
+var KB_ACTION_LABELS = {
+  primary_action: 'Hauptaktion (Würfeln / Aufdecken / …)',
+  dice_cup_0: 'Würfel 1 im Becher',
+  dice_cup_1: 'Würfel 2 im Becher',
+  dice_cup_2: 'Würfel 3 im Becher',
+  dice_out_0: 'Würfel 1 rausgelegt',
+  dice_out_1: 'Würfel 2 rausgelegt',
+  dice_out_2: 'Würfel 3 rausgelegt',
+  dice_toggle_0: 'Würfel 1 rein/raus',
+  dice_toggle_1: 'Würfel 2 rein/raus',
+  dice_toggle_2: 'Würfel 3 rein/raus',
+  aufdecken: 'Aufdecken',
+  zudecken: 'Zudecken',
+  ende: 'Zug beenden (Ende)',
+  pause: 'Pause',
+  turn_sixes: 'Sechsen umwandeln'
+};
+var KB_ACTION_ORDER = [
+  'primary_action',
+  'dice_cup_0', 'dice_cup_1', 'dice_cup_2',
+  'dice_out_0', 'dice_out_1', 'dice_out_2',
+  'dice_toggle_0', 'dice_toggle_1', 'dice_toggle_2',
+  'aufdecken', 'zudecken', 'ende', 'pause', 'turn_sixes'
+];
+var DEFAULT_KEYBINDINGS = {
+  primary_action: [
+    {code:'Enter',shift:false,label:'Enter'},
+    {code:'Space',shift:false,label:'Leertaste'},
+    {code:'NumpadEnter',shift:false,label:'Numpad Enter'}
+  ],
+  dice_cup_0: [{code:'Digit1',shift:false,label:'1'},{code:'Numpad1',shift:false,label:'Numpad 1'}],
+  dice_cup_1: [{code:'Digit2',shift:false,label:'2'},{code:'Numpad2',shift:false,label:'Numpad 2'}],
+  dice_cup_2: [{code:'Digit3',shift:false,label:'3'},{code:'Numpad3',shift:false,label:'Numpad 3'}],
+  dice_out_0: [{code:'Digit4',shift:false,label:'4'},{code:'Numpad4',shift:false,label:'Numpad 4'}],
+  dice_out_1: [{code:'Digit5',shift:false,label:'5'},{code:'Numpad5',shift:false,label:'Numpad 5'}],
+  dice_out_2: [{code:'Digit6',shift:false,label:'6'},{code:'Numpad6',shift:false,label:'Numpad 6'}],
+  dice_toggle_0: [],
+  dice_toggle_1: [],
+  dice_toggle_2: [],
+  aufdecken: [{code:'KeyQ',shift:false,label:'Q'},{code:'NumpadAdd',shift:false,label:'Numpad +'}],
+  zudecken: [{code:'KeyW',shift:false,label:'W'},{code:'NumpadSubtract',shift:false,label:'Numpad \u2212'}],
+  ende: [{code:'KeyE',shift:true,label:'Shift+E'},{code:'NumpadDivide',shift:false,label:'Numpad /'}],
+  pause: [{code:'KeyP',shift:true,label:'Shift+P'}],
+  turn_sixes: [{code:'Digit7',shift:false,label:'7'},{code:'Numpad7',shift:false,label:'Numpad 7'}]
+};
+
+var _currentBindings = null;
+var _kbRecording = null;
+var _kbPersonsCache = null;
+
+function _kbDeepCopy(o) { return JSON.parse(JSON.stringify(o)); }
+
+function _kbGetBindings() {
+  if (!_currentBindings) {
+    var stored = localStorage.getItem('keybindings');
+    if (stored) { try { _currentBindings = JSON.parse(stored); } catch(e) {} }
+    if (!_currentBindings) _currentBindings = _kbDeepCopy(DEFAULT_KEYBINDINGS);
+    for (var a in DEFAULT_KEYBINDINGS) {
+      if (!_currentBindings[a]) _currentBindings[a] = [];
+    }
+  }
+  return _currentBindings;
+}
+
+function _kbSaveLocal() {
+  localStorage.setItem('keybindings', JSON.stringify(_kbGetBindings()));
+}
+
+function _kbApplyBindings(bindings) {
+  _currentBindings = _kbDeepCopy(bindings);
+  for (var a in DEFAULT_KEYBINDINGS) {
+    if (!_currentBindings[a]) _currentBindings[a] = [];
+  }
+  _kbSaveLocal();
+}
+
+function _kbAutoLoad() {
+  withPreferences(function(prefs) {
+    if (prefs.bindings) _kbApplyBindings(prefs.bindings);
+  });
+}
+
+function _kbMakeLabel(e) {
+  var parts = [];
+  if (e.shiftKey) parts.push('Shift');
+  var n = e.code;
+  if (n === 'Space') n = 'Leertaste';
+  else if (n === 'Enter') n = 'Enter';
+  else if (n === 'NumpadEnter') n = 'Numpad Enter';
+  else if (n === 'NumpadAdd') n = 'Numpad +';
+  else if (n === 'NumpadSubtract') n = 'Numpad \u2212';
+  else if (n === 'NumpadMultiply') n = 'Numpad *';
+  else if (n === 'NumpadDivide') n = 'Numpad /';
+  else if (n === 'NumpadDecimal') n = 'Numpad .';
+  else if (n.startsWith('Numpad')) n = 'Numpad ' + n.replace('Numpad','');
+  else if (n.startsWith('Key')) n = n.replace('Key','');
+  else if (n.startsWith('Digit')) n = n.replace('Digit','');
+  else if (n === 'Backspace') n = 'Backspace';
+  else if (n === 'Tab') n = 'Tab';
+  else if (n === 'Delete') n = 'Entf';
+  parts.push(n);
+  return parts.join('+');
+}
+
+// --- Action handlers ---
+function _kbPrimaryAction() {
+  var throwBtn = document.getElementById('startgame_id');
+  var diceBtn = document.getElementById('btn_dice');
+  if (throwBtn && throwBtn.classList.contains('buttongreen') && diceBtn && !diceBtn.disabled) {
+    dice(); return;
+  }
+  var pullupContainer = document.getElementById('btn_pullup_container');
+  if (pullupContainer && pullupContainer.classList.contains('buttongreen')) {
+    pullup(); return;
+  }
+  var revealAllBtn = document.getElementById('reveal_all_btn');
+  if (revealAllBtn && !revealAllBtn.disabled) { vote_reveal_all(); return; }
+  var distributeBtn = document.getElementById('distribute_btn');
+  if (distributeBtn && !distributeBtn.disabled) { distribute(); return; }
+}
+
+function _kbClickDiceCell(idx) {
+  var cell = document.getElementById('dcell' + idx);
+  if (cell && cell.classList.contains('dcell-clickable') && cell.onclick) cell.onclick();
+}
+
+function _kbToggleDice(diceIdx) {
+  if (_diceInCup[diceIdx]) _kbClickDiceCell(diceIdx);
+  else _kbClickDiceCell(3 + diceIdx);
+}
+
+function _kbAufdecken() {
+  var container = document.getElementById('btn_pullup_container');
+  if (!container) return;
+  var btn = container.querySelector('button');
+  if (btn && !btn.disabled) pullup();
+}
+
+function _kbZudecken() {
+  var cups = document.querySelectorAll('.containercup');
+  for (var i = 0; i < cups.length; i++) {
+    if (cups[i].id !== 'btn_pullup_container') {
+      var btn = cups[i].querySelector('button');
+      if (btn && !btn.disabled) { pulldown(); return; }
+    }
+  }
+}
+
+function _kbEnde() {
+  var btn = document.getElementById('btn_endpause');
+  if (btn && !btn.disabled && btn.getAttribute('data-mode') === 'ende') endpause_click();
+}
+
+function _kbPause() {
+  var btn = document.getElementById('btn_endpause');
+  if (btn && !btn.disabled && btn.getAttribute('data-mode') === 'pause') endpause_click();
+}
+
+function _kbTurnSixes() {
+  var btn3 = document.getElementById('btn_turn_3');
+  if (btn3 && btn3.style.display !== 'none') {
+    var inner = btn3.querySelector('button');
+    if (inner && !inner.disabled) { turnSixes(2); return; }
+  }
+  var btn2 = document.getElementById('btn_turn_2');
+  if (btn2 && btn2.style.display !== 'none') {
+    var inner = btn2.querySelector('button');
+    if (inner && !inner.disabled) { turnSixes(1); return; }
+  }
+}
+
+var KB_ACTION_HANDLERS = {
+  primary_action: _kbPrimaryAction,
+  dice_cup_0: function(){_kbClickDiceCell(0);}, dice_cup_1: function(){_kbClickDiceCell(1);}, dice_cup_2: function(){_kbClickDiceCell(2);},
+  dice_out_0: function(){_kbClickDiceCell(3);}, dice_out_1: function(){_kbClickDiceCell(4);}, dice_out_2: function(){_kbClickDiceCell(5);},
+  dice_toggle_0: function(){_kbToggleDice(0);}, dice_toggle_1: function(){_kbToggleDice(1);}, dice_toggle_2: function(){_kbToggleDice(2);},
+  aufdecken: _kbAufdecken, zudecken: _kbZudecken,
+  ende: _kbEnde, pause: _kbPause, turn_sixes: _kbTurnSixes
+};
+
+// --- Modal helpers ---
+function _kbIsModalOpen() {
+  var rm = document.getElementById('rulesModal');
+  var bm = document.getElementById('beerModal');
+  var km = document.getElementById('kbModal');
+  return (rm && rm.style.display === 'block')
+      || (bm && bm.style.display === 'block')
+      || (km && km.style.display === 'block');
+}
+
+function showKbModal() {
+  _kbRecording = null;
+  document.getElementById('kbModal').style.display = 'block';
+  document.getElementById('kb_load_menu').style.display = 'none';
+  document.getElementById('kb_status').innerHTML = '';
+  _kbRenderConfig();
+}
+function closeKbModal() {
+  _kbRecording = null;
+  document.getElementById('kbModal').style.display = 'none';
+}
+
+function _kbRenderConfig() {
+  var bindings = _kbGetBindings();
+  var html = '<table class="table table-condensed"><thead><tr><th>Aktion</th><th>Tasten</th><th></th></tr></thead><tbody>';
+  for (var ai = 0; ai < KB_ACTION_ORDER.length; ai++) {
+    var action = KB_ACTION_ORDER[ai];
+    html += '<tr><td style="white-space:nowrap">' + KB_ACTION_LABELS[action] + '</td><td>';
+    var keys = bindings[action] || [];
+    for (var ki = 0; ki < keys.length; ki++) {
+      html += '<span class="kb-pill">' + _esc(keys[ki].label)
+            + ' <span class="kb-pill-remove" onclick="_kbRemoveKey(\'' + action + '\',' + ki + ')">\u00d7</span></span> ';
+    }
+    html += '</td><td>';
+    if (_kbRecording && _kbRecording.action === action) {
+      html += '<span class="kb-recording">Taste dr\u00fccken\u2026 (Esc=Abbruch)</span>';
+    } else {
+      html += '<button class="btn btn-default btn-xs" onclick="_kbStartRecord(\'' + action + '\')">+</button>';
+    }
+    html += '</td></tr>';
+  }
+  html += '</tbody></table>';
+  document.getElementById('kb_content').innerHTML = html;
+}
+
+function _kbStartRecord(action) {
+  _kbRecording = {action: action};
+  _kbRenderConfig();
+}
+
+function _kbRemoveKey(action, index) {
+  var bindings = _kbGetBindings();
+  if (bindings[action]) { bindings[action].splice(index, 1); _kbSaveLocal(); }
+  _kbRenderConfig();
+}
+
+function kbReset() {
+  _currentBindings = _kbDeepCopy(DEFAULT_KEYBINDINGS);
+  _kbSaveLocal();
+  _kbRenderConfig();
+  var st = document.getElementById('kb_status');
+  st.innerHTML = '<small>Standardbelegung wiederhergestellt.</small>';
+  setTimeout(function(){st.innerHTML='';},3000);
+}
+
+function kbSave() {
+  var nick = localStorage.getItem('name');
+  if (!nick) {
+    document.getElementById('kb_status').innerHTML = '<small style="color:#e53935;">Kein Spielername bekannt.</small>';
+    return;
+  }
+  var xhr = new XMLHttpRequest();
+  xhr.open('PUT', '/api/keybindings');
+  xhr.setRequestHeader('Content-Type', 'application/json');
+  xhr.onreadystatechange = function() {
+    if (xhr.readyState === XMLHttpRequest.DONE) {
+      var st = document.getElementById('kb_status');
+      if (xhr.status === 200) {
+        var res = JSON.parse(xhr.responseText);
+        st.innerHTML = '<small style="color:#4CAF50;">Gespeichert f\u00fcr ' + _esc(res.person_name) + '.</small>';
+      } else {
+        var res = {}; try{res=JSON.parse(xhr.responseText);}catch(e){}
+        st.innerHTML = '<small style="color:#e53935;">' + _esc(res.Message||'Fehler') + '</small>';
+      }
+      setTimeout(function(){st.innerHTML='';},4000);
+    }
+  };
+  xhr.send(JSON.stringify({nick: nick, bindings: _kbGetBindings()}));
+}
+
+function kbShowLoadMenu() {
+  var menu = document.getElementById('kb_load_menu');
+  if (menu.style.display !== 'none') { menu.style.display = 'none'; return; }
+  menu.innerHTML = '<small>Lade\u2026</small>';
+  menu.style.display = 'block';
+  var xhr = new XMLHttpRequest();
+  xhr.open('GET', '/api/keybindings/persons');
+  xhr.onreadystatechange = function() {
+    if (xhr.readyState === XMLHttpRequest.DONE) {
+      if (xhr.status === 200) {
+        _kbPersonsCache = JSON.parse(xhr.responseText);
+        if (_kbPersonsCache.length === 0) {
+          menu.innerHTML = '<small>Keine gespeicherten Belegungen vorhanden.</small>';
+          return;
+        }
+        var h = '<strong>Belegung laden von:</strong><br>';
+        for (var i = 0; i < _kbPersonsCache.length; i++) {
+          h += '<button class="btn btn-default btn-xs" style="margin:2px;" '
+             + 'onclick="kbLoadFromPerson(' + _kbPersonsCache[i].id + ')">'
+             + _esc(_kbPersonsCache[i].name) + '</button> ';
+        }
+        menu.innerHTML = h;
+      } else {
+        menu.innerHTML = '<small style="color:#e53935;">Fehler beim Laden.</small>';
+      }
+    }
+  };
+  xhr.send();
+}
+
+function kbLoadFromPerson(personId) {
+  if (!_kbPersonsCache) return;
+  for (var i = 0; i < _kbPersonsCache.length; i++) {
+    if (_kbPersonsCache[i].id === personId && _kbPersonsCache[i].bindings) {
+      _kbApplyBindings(_kbPersonsCache[i].bindings);
+      _kbRenderConfig();
+      document.getElementById('kb_load_menu').style.display = 'none';
+      var st = document.getElementById('kb_status');
+      st.innerHTML = '<small style="color:#4CAF50;">Belegung von ' + _esc(_kbPersonsCache[i].name) + ' geladen.</small>';
+      setTimeout(function(){st.innerHTML='';},3000);
+      return;
+    }
+  }
+}
+
+// --- Main keydown handler ---
+document.addEventListener('keydown', function(e) {
+  var tag = e.target.tagName.toLowerCase();
+  if (tag === 'input' || tag === 'textarea' || tag === 'select') return;
+
+  if (_kbRecording) {
+    e.preventDefault();
+    if (e.key === 'Escape') { _kbRecording = null; _kbRenderConfig(); return; }
+    var binding = {code: e.code, shift: e.shiftKey, label: _kbMakeLabel(e)};
+    var all = _kbGetBindings();
+    for (var a in all) {
+      all[a] = all[a].filter(function(b) {
+        return !(b.code === binding.code && !!b.shift === !!binding.shift);
+      });
+    }
+    all[_kbRecording.action].push(binding);
+    _kbSaveLocal();
+    _kbRecording = null;
+    _kbRenderConfig();
+    return;
+  }
+
+  if (_kbIsModalOpen()) {
+    if (e.key === 'Escape') {
+      var rm = document.getElementById('rulesModal');
+      var bm = document.getElementById('beerModal');
+      var km = document.getElementById('kbModal');
+      if (rm && rm.style.display === 'block') rm.style.display = 'none';
+      if (bm && bm.style.display === 'block') bm.style.display = 'none';
+      if (km && km.style.display === 'block') km.style.display = 'none';
+    }
+    return;
+  }
+
+  var gc = document.getElementById('game_controls');
+  if (!gc || gc.style.display === 'none') return;
+
+  unlockAudio();
+  var kbb = document.getElementById('kb_floating_btn');
+  if (kbb && kbb.style.display === 'none') kbb.style.display = '';
+
+  var bindings = _kbGetBindings();
+  for (var action in bindings) {
+    var list = bindings[action];
+    for (var i = 0; i < list.length; i++) {
+      var b = list[i];
+      if (e.code === b.code && e.shiftKey === !!b.shift && !e.ctrlKey && !e.metaKey) {
+        if (KB_ACTION_HANDLERS[action]) {
+          e.preventDefault();
+          KB_ACTION_HANDLERS[action]();
+          return;
+        }
+      }
+    }
+  }
+});
+
+namespace = '/game';
+
+const socket = io(namespace, {
+  reconnection: true,
+  reconnectionAttempts: Infinity,
+  reconnectionDelay: 1000,
+  reconnectionDelayMax: 5000,
+  randomizationFactor: 0.5
+});
+
+socket.on('connect', function () {
+  var game = document.getElementById('UUID');
+  var gameid = game.innerHTML;
+  gameid = gameid.replace(/^"(.+)"$/, '$1');
+  socket.emit('join', { room: gameid });
+  revalidateEmbeddedState(gameid);
+});
+
+// Catch changes between rendering the page and joining the room;
+// usually answered with 304 Not Modified
+function revalidateEmbeddedState(gameid) {
+  if (!_embeddedVersion) return;
+  var version = _embeddedVersion;
+  _embeddedVersion = null;
+  var xhttp = new XMLHttpRequest();
+  xhttp.open("GET", "/api/game/" + gameid);
+  xhttp.setRequestHeader("If-None-Match", '"' + version + '"');
+  xhttp.onreadystatechange = function () {
+    if (xhttp.readyState == XMLHttpRequest.DONE && xhttp.status == 200) {
+      refresh_game(JSON.parse(xhttp.responseText));
+    }
+  };
+  xhttp.send();
+}
+
+socket.on('reload_game', function (game) {
+  if (game) {
+    refresh_game(game);
+  }
+});
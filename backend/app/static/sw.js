@@ -1,6 +1,13 @@
-var CACHE_NAME = 'tele-schocken-static-v2';
+var CACHE_NAME = 'tele-schocken-static-v3';
 var TWO_MONTHS_MS = 60 * 24 * 60 * 60 * 1000;
 
+// Written by "flask assets build"; files below /dist/ have a content hash
+// in their name and never change
+var MANIFEST_URL = '/dist/manifest.json';
+var HASHED_PREFIX = '/dist/';
+// Precached at install; images are cached when first used
+var PRECACHE_EXTENSIONS = ['.js', '.css', '.svg'];
+
 var STATIC_EXTENSIONS = [
   '.mp3', '.wav', '.ogg', '.webm',
   '.js', '.css',
@@ -18,7 +25,12 @@ function isStaticAsset(url) {
   return false;
 }
 
+function isHashedAsset(url) {
+  return new URL(url).pathname.indexOf(HASHED_PREFIX) === 0;
+}
+
 function needsRevalidation(url) {
+  if (isHashedAsset(url)) return false;
   var pathname = new URL(url).pathname.toLowerCase();
   for (var i = 0; i < REVALIDATE_EXTENSIONS.length; i++) {
     if (pathname.endsWith(REVALIDATE_EXTENSIONS[i])) return true;
@@ -26,10 +38,57 @@ function needsRevalidation(url) {
   return false;
 }
 
+function loadManifest() {
+  return fetch(MANIFEST_URL, {cache: 'no-store'}).then(function(response) {
+    if (!response.ok) return null;
+    return response.json();
+  }).catch(function() { return null; });
+}
+
+function hashedUrls(manifest, extensions) {
+  var urls = [];
+  for (var name in manifest.assets) {
+    var path = manifest.assets[name];
+    if (extensions && !extensions.some(function(ext) { return path.endsWith(ext); })) continue;
+    urls.push(new URL('/' + path, self.location).href);
+  }
+  return urls;
+}
+
+// Precache all hashed assets of the current build
 self.addEventListener('install', function(event) {
   self.skipWaiting();
+  event.waitUntil(
+    loadManifest().then(function(manifest) {
+      if (!manifest) return;
+      return caches.open(CACHE_NAME).then(function(cache) {
+        return Promise.all(hashedUrls(manifest, PRECACHE_EXTENSIONS).map(function(url) {
+          return cache.match(url).then(function(cached) {
+            if (cached) return;
+            return cache.add(url).catch(function() {});
+          });
+        }));
+      });
+    })
+  );
 });
 
+// Drop hashed assets of older builds
+function pruneOldBuilds() {
+  return loadManifest().then(function(manifest) {
+    if (!manifest) return;
+    var current = {};
+    hashedUrls(manifest).forEach(function(url) { current[url] = true; });
+    return caches.open(CACHE_NAME).then(function(cache) {
+      return cache.keys().then(function(requests) {
+        return Promise.all(requests.filter(function(req) {
+          return isHashedAsset(req.url) && !current[req.url];
+        }).map(function(req) { return cache.delete(req); }));
+      });
+    });
+  });
+}
+
 self.addEventListener('activate', function(event) {
   event.waitUntil(
     caches.keys().then(function(names) {
@@ -37,7 +96,7 @@ self.addEventListener('activate', function(event) {
         names.filter(function(n) { return n !== CACHE_NAME; })
              .map(function(n) { return caches.delete(n); })
       );
-    }).then(function() {
+    }).then(pruneOldBuilds).then(function() {
       return self.clients.claim();
     })
   );
@@ -0,0 +1,211 @@
+"""
+static_assets.py
+====================================
+Fingerprinted and precompressed static files.
+"flask assets build" copies every static file to static/dist under a
+content hashed name (style.css -> dist/styles/style.<hash>.css), writes
+gzip and brotli variants of the compressible ones and records everything
+in dist/manifest.json. With a manifest present, url_for('static', ...)
+returns the hashed URLs, the variants are sent as they are (no per
+request compression) and all hashed files are marked immutable.
+Without a build the static files are served unchanged.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import shutil
+
+import click
+from flask import request, send_file
+from flask.cli import AppGroup
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - brotli comes with flask-compress
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+BUILD_DIR = 'dist'
+MANIFEST_NAME = 'manifest.json'
+# Served under fixed URLs or versioned elsewhere (audio_manifest)
+EXCLUDED = ('audio/', 'video/', BUILD_DIR + '/', 'sw.js', 'robots.txt')
+COMPRESSIBLE = ('.js', '.css', '.svg', '.map', '.json', '.txt', '.html', '.ico')
+# Content-Encoding -> file suffix, in order of preference
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+# Smaller files are not worth a compressed variant
+MIN_COMPRESS_SIZE = 500
+
+_state = {
+    'static': None,
+    'version': '',
+    # logical filename -> hashed filename (both relative to static)
+    'assets': {},
+    # hashed filename -> available encodings
+    'encoded': {},
+    'hashed': frozenset(),
+}
+
+assets_cli = AppGroup('assets', help='Static asset build.')
+
+
+# --------------- Build ---------------
+
+def _source_files(static_folder):
+    for root, dirs, files in os.walk(static_folder):
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            filename = os.path.relpath(path, static_folder).replace(os.sep, '/')
+            if filename.startswith(EXCLUDED) or filename in EXCLUDED:
+                continue
+            yield filename, path
+
+
+def _hashed_name(filename, data):
+    digest = hashlib.sha1(data).hexdigest()[:10]
+    base, ext = os.path.splitext(filename)
+    return '{}/{}.{}{}'.format(BUILD_DIR, base, digest, ext)
+
+
+def _write_variants(path, data):
+    encodings = []
+    if not path.endswith(COMPRESSIBLE) or len(data) < MIN_COMPRESS_SIZE:
+        return encodings
+    variants = {'gzip': gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants['br'] = brotli.compress(data, quality=11)
+    for encoding, suffix in ENCODINGS:
+        compressed = variants.get(encoding)
+        if compressed is None or len(compressed) >= len(data):
+            continue
+        with open(path + suffix, 'wb') as f:
+            f.write(compressed)
+        encodings.append(encoding)
+    return encodings
+
+
+def build(static_folder):
+    """Rebuild static/dist and its manifest; returns the manifest."""
+    out = os.path.join(static_folder, BUILD_DIR)
+    tmp = out + '.tmp'
+    shutil.rmtree(tmp, ignore_errors=True)
+    assets = {}
+    encoded = {}
+    for filename, path in _source_files(static_folder):
+        with open(path, 'rb') as f:
+            data = f.read()
+        hashed = _hashed_name(filename, data)
+        target = os.path.join(tmp, os.path.relpath(hashed, BUILD_DIR))
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, 'wb') as f:
+            f.write(data)
+        assets[filename] = hashed
+        encodings = _write_variants(target, data)
+        if encodings:
+            encoded[hashed] = encodings
+    version = hashlib.sha1(json.dumps(assets, sort_keys=True).encode('utf-8')).hexdigest()[:12]
+    manifest = {'version': version, 'assets': assets, 'encoded': encoded}
+    with open(os.path.join(tmp, MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    shutil.rmtree(out, ignore_errors=True)
+    os.replace(tmp, out)
+    return manifest
+
+
+@assets_cli.command('build')
+def build_command():
+    """Fingerprint and precompress the static files."""
+    from flask import current_app
+    manifest = build(current_app.static_folder)
+    click.echo('{} Dateien, {} komprimiert, Version {}'.format(
+        len(manifest['assets']), len(manifest['encoded']), manifest['version']))
+
+
+@assets_cli.command('clean')
+def clean_command():
+    """Remove the build, static files are served unhashed again."""
+    from flask import current_app
+    shutil.rmtree(os.path.join(current_app.static_folder, BUILD_DIR), ignore_errors=True)
+
+
+# --------------- Runtime ---------------
+
+def load(static_folder):
+    """Load dist/manifest.json if it exists."""
+    _state['static'] = static_folder
+    path = os.path.join(static_folder, BUILD_DIR, MANIFEST_NAME)
+    try:
+        with open(path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {}
+    _state['version'] = manifest.get('version', '')
+    _state['assets'] = manifest.get('assets', {})
+    _state['encoded'] = manifest.get('encoded', {})
+    _state['hashed'] = frozenset(_state['assets'].values())
+    if _state['assets']:
+        built = os.stat(path).st_mtime
+        stale = [name for name, src in _source_files(static_folder)
+                 if name in _state['assets'] and os.stat(src).st_mtime > built]
+        if stale:
+            logger.warning('Static files changed after "flask assets build": %s',
+                           ', '.join(stale))
+
+
+def version():
+    """Build version ('' without a build), changes with any asset."""
+    return _state['version']
+
+
+def _choose_encoding(encodings):
+    accepted = request.accept_encodings
+    for encoding, suffix in ENCODINGS:
+        if encoding in encodings and accepted[encoding]:
+            return encoding, suffix
+    return None, None
+
+
+def init_app(app):
+    """Use the manifest for url_for and serve the precompressed variants."""
+    load(app.static_folder)
+    app.cli.add_command(assets_cli)
+    app.jinja_env.globals['asset_version'] = version
+
+    @app.url_defaults
+    def _hashed_static_url(endpoint, values):
+        if endpoint == 'static' and _state['assets']:
+            hashed = _state['assets'].get(values.get('filename'))
+            if hashed is not None:
+                values['filename'] = hashed
+
+    @app.before_request
+    def _serve_precompressed():
+        if request.endpoint != 'static':
+            return None
+        filename = (request.view_args or {}).get('filename', '')
+        encoding, suffix = _choose_encoding(_state['encoded'].get(filename, ()))
+        if encoding is None:
+            return None
+        path = safe_join(_state['static'], filename + suffix)
+        if path is None or not os.path.isfile(path):
+            return None
+        response = send_file(path, mimetype=mimetypes.guess_type(filename)[0],
+                             conditional=True)
+        # Flask-Compress leaves responses with a Content-Encoding alone
+        response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        return response
+
+    @app.after_request
+    def _cache_hashed_static(response):
+        if request.endpoint == 'static' and response.status_code in (200, 206, 304) and \
+                (request.view_args or {}).get('filename') in _state['hashed']:
+            response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+            response.headers.pop('Expires', None)
+        return response
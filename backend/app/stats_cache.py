@@ -0,0 +1,215 @@
+"""
+stats_cache.py
+====================================
+Result cache for the protokoll statistics.
+Every commit that writes a GameLog, GameLogPlayer, NickMapping or Person
+bumps a protokoll data version, stored in RUNTIME_DIR so all workers see
+it. Cached results are keyed by that version plus the normalized request
+filters, so a write invalidates everything computed before it. The cache
+is a small per-worker LRU; concurrent identical requests wait for the
+first one instead of computing the same result again.
+Requests only read the version kept in memory: a background thread of
+each worker checks the file every DATA_VERSION_CHECK_INTERVAL seconds,
+so the writes of other workers show up that much later.
+watch_commits() lets other caches react to committed writes as well.
+"""
+import collections
+import os
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app import metrics
+
+STATS_CACHE = metrics.Counter(
+    'teleschocken_stats_cache_total', 'Statistics cache lookups by result',
+    ('result',))
+
+_CHANGED = 'changed_models'
+
+_lock = threading.Lock()
+_cache = collections.OrderedDict()
+_inflight = {}
+_watchers = []
+_state = {'path': None, 'size': 32, 'version': None, 'pid': None, 'interval': 1.0}
+# In-memory copy of the version file: (version, stat key, mtime)
+_current = {'version': '', 'key': None, 'mtime': None}
+
+
+# --------------- Data version ---------------
+
+def _read():
+    try:
+        with open(_state['path']) as f:
+            st = os.fstat(f.fileno())
+            version = f.read()
+    except (OSError, TypeError):
+        _current.update(version='', key=None, mtime=None)
+        return
+    _current.update(version=version, key=(st.st_ino, st.st_mtime_ns), mtime=st.st_mtime)
+
+
+def _watch_loop():
+    while True:
+        time.sleep(_state['interval'])
+        try:
+            st = os.stat(_state['path'])
+        except (OSError, TypeError):
+            continue
+        # bump_version replaces the file: a new inode and mtime
+        if (st.st_ino, st.st_mtime_ns) != _current['key']:
+            _read()
+
+
+def _watched():
+    if _state['pid'] != os.getpid():
+        with _lock:
+            if _state['pid'] != os.getpid():
+                # A forked worker needs its own watcher
+                _state['pid'] = os.getpid()
+                _read()
+                threading.Thread(target=_watch_loop, daemon=True).start()
+    return _current
+
+
+def data_version():
+    """Return the current protokoll data version (shared by all workers)."""
+    return _watched()['version']
+
+
+def bump_version():
+    """Invalidate all cached results of all workers."""
+    version = '{}-{}'.format(os.getpid(), time.time_ns())
+    os.makedirs(os.path.dirname(_state['path']), exist_ok=True)
+    tmp = '{}.{}.tmp'.format(_state['path'], os.getpid())
+    with open(tmp, 'w') as f:
+        f.write(version)
+    os.replace(tmp, _state['path'])
+    # This worker sees its own write right away
+    _read()
+    return version
+
+
+def version_age():
+    """Seconds since the protokoll data last changed (inf if unknown)."""
+    mtime = _watched()['mtime']
+    if mtime is None:
+        return float('inf')
+    return time.time() - mtime
+
+
+def _bump_or_clear():
+    try:
+        bump_version()
+    except OSError:
+        # The data is committed already; at least this worker must not
+        # serve stale results
+        clear()
+
+
+# --------------- Write tracking ---------------
+
+def watch_commits(models, callback):
+    """Call callback() after every commit that wrote one of the models."""
+    # init_app runs for every app; register each callback once
+    watcher = (frozenset(models), callback)
+    if watcher not in _watchers:
+        _watchers.append(watcher)
+
+
+def _after_flush(session, flush_context):
+    # new/dirty/deleted still show the pre-flush state here
+    changed = {type(obj) for obj in session.new | session.dirty | session.deleted}
+    session.info.setdefault(_CHANGED, set()).update(changed)
+
+
+def _do_orm_execute(state):
+    # Query.update()/delete() and bulk inserts bypass the flush
+    if not (state.is_update or state.is_delete or state.is_insert):
+        return
+    mapper = state.bind_mapper
+    if mapper is not None:
+        state.session.info.setdefault(_CHANGED, set()).add(mapper.class_)
+
+
+def _after_commit(session):
+    # Releasing a savepoint fires after_commit as well; the writes are
+    # only visible to other sessions after the outermost commit
+    if session.in_nested_transaction():
+        return
+    changed = session.info.pop(_CHANGED, None)
+    if not changed:
+        return
+    for models, callback in _watchers:
+        if models & changed:
+            callback()
+
+
+def _after_rollback(session):
+    # A savepoint rollback fires this as well; its writes may be reported
+    # once too often, the ones of the enclosing transaction must not be lost
+    if session.in_nested_transaction():
+        return
+    session.info.pop(_CHANGED, None)
+
+
+# --------------- Cache ---------------
+
+def cached(key, compute):
+    """Return compute() for the filter tuple key, from the cache if possible."""
+    version = data_version()
+    full_key = (version,) + tuple(key)
+    while True:
+        with _lock:
+            if version != _state['version']:
+                _cache.clear()
+                _state['version'] = version
+            if full_key in _cache:
+                _cache.move_to_end(full_key)
+                STATS_CACHE.inc('hit')
+                return _cache[full_key]
+            waiting = _inflight.get(full_key)
+            if waiting is None:
+                done = _inflight[full_key] = threading.Event()
+        if waiting is None:
+            break
+        STATS_CACHE.inc('coalesced')
+        # Loop again: if the first request failed, the next one computes
+        waiting.wait(30)
+
+    STATS_CACHE.inc('miss')
+    try:
+        value = compute()
+        with _lock:
+            if _state['size'] > 0 and version == _state['version']:
+                _cache[full_key] = value
+                while len(_cache) > _state['size']:
+                    _cache.popitem(last=False)
+        return value
+    finally:
+        with _lock:
+            _inflight.pop(full_key, None)
+        done.set()
+
+
+def clear():
+    with _lock:
+        _cache.clear()
+
+
+def init_app(app):
+    """Register the session events that track protokoll writes."""
+    from app.models import GameLog, GameLogPlayer, NickMapping, Person
+
+    watch_commits((GameLog, GameLogPlayer, NickMapping, Person), _bump_or_clear)
+    _state['path'] = os.path.join(app.config['RUNTIME_DIR'], 'protokoll_version')
+    _state['size'] = app.config.get('STATS_CACHE_SIZE', 32)
+    _state['interval'] = app.config.get('DATA_VERSION_CHECK_INTERVAL', 1.0)
+    _read()
+    if not event.contains(Session, 'after_flush', _after_flush):
+        event.listen(Session, 'after_flush', _after_flush)
+        event.listen(Session, 'do_orm_execute', _do_orm_execute)
+        event.listen(Session, 'after_commit', _after_commit)
+        event.listen(Session, 'after_rollback', _after_rollback)
@@ -0,0 +1,40 @@
+"""
+template_cache.py
+====================================
+Jinja bytecode cache in RUNTIME_DIR/jinja.
+Compiled templates are shared by all workers and survive restarts, so a
+fresh worker loads the bytecode instead of compiling every template
+again. Entries carry a checksum of the template source; edited templates
+are compiled and stored anew.
+"""
+import os
+
+from jinja2 import FileSystemBytecodeCache
+
+
+class SharedBytecodeCache(FileSystemBytecodeCache):
+    """FileSystemBytecodeCache that never exposes half-written files to
+    other workers."""
+
+    def dump_bytecode(self, bucket):
+        filename = self._get_cache_filename(bucket)
+        tmp = '{}.{}.tmp'.format(filename, os.getpid())
+        try:
+            with open(tmp, 'wb') as f:
+                bucket.write_bytecode(f)
+            os.replace(tmp, filename)
+        except OSError:
+            # Only a cache; the template is compiled again next time
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+
+
+def init_app(app):
+    """Attach the bytecode cache to the app's Jinja environment."""
+    if not app.config.get('JINJA_BYTECODE_CACHE', True):
+        return
+    directory = os.path.join(app.config['RUNTIME_DIR'], 'jinja')
+    os.makedirs(directory, exist_ok=True)
+    app.jinja_env.bytecode_cache = SharedBytecodeCache(directory)
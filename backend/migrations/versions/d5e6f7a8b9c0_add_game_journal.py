@@ -0,0 +1,33 @@
+"""Add game_journal
+
+Revision ID: d5e6f7a8b9c0
+Revises: c0d1e2f3a4b5
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = 'd5e6f7a8b9c0'
+down_revision = 'c0d1e2f3a4b5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('game_journal',
+        sa.Column('id', sa.BigInteger().with_variant(sa.Integer(), 'sqlite'), nullable=False),
+        sa.Column('game_id', sa.Integer(), nullable=False),
+        sa.Column('ts', sa.BigInteger(), nullable=False),
+        sa.Column('action', sa.String(length=20), nullable=False),
+        sa.Column('actor', sa.Integer(), nullable=True),
+        sa.Column('data', sa.Text(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_game_journal_game_ts', 'game_journal', ['game_id', 'ts'])
+
+
+def downgrade():
+    op.drop_index('ix_game_journal_game_ts', table_name='game_journal')
+    op.drop_table('game_journal')
@@ -3,15 +3,21 @@ teleschocken.py
 ====================================
 The core module of teleschocken project
 """
-from app import app, db
+from app import create_app, db
 
 from app.models import User, Game
 
+app = create_app()
+
 
 '''
 DB Update
 flask db migrate -m "Your Text"
 flask db upgrade
+flask deploy migrate   (locked; pre-start step with MIGRATE_ON_BOOT = False)
+
+Static assets (hashed + precompressed, run on every deploy)
+flask assets build
 '''
 
 
@@ -0,0 +1,46 @@
+import datetime
+
+from app import create_app, db
+from app.models import GameLog
+
+
+def _game_uuids(client):
+    response = client.get('/api/protokoll/games?legacy=true')
+    assert response.status_code == 200
+    return [g['game_uuid'] for g in response.get_json()]
+
+
+def _login(app):
+    client = app.test_client()
+    assert client.post('/api/protokoll/auth', json={'password': 'pw'}).status_code == 200
+    return client
+
+
+def test_protokoll_reads_use_replica_until_written(tmp_path):
+    # Two independent files: rows only in the replica show where a read went
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///{}'.format(tmp_path / 'primary.db'),
+        'SQLALCHEMY_REPLICA_URI': 'sqlite:///{}'.format(tmp_path / 'replica.db'),
+        'RUNTIME_DIR': str(tmp_path / 'runtime'),
+        'SECRET_KEY': 'test',
+        'ADMIN_PASSWORD': 'pw',
+        'SERVER_NAME': None,
+        # The test client only sends the session cookie without a domain
+        'SESSION_COOKIE_DOMAIN': None,
+    })
+    with app.app_context():
+        db.create_all()
+        db.metadata.create_all(db.engines['replica'])
+        with db.engines['replica'].begin() as conn:
+            conn.execute(GameLog.__table__.insert().values(
+                game_uuid='replica', game_date=datetime.date(2024, 1, 1),
+                mapping_complete=False))
+
+    writer = _login(app)
+    assert _game_uuids(writer) == ['replica']
+
+    assert writer.post('/api/protokoll/persons', json={'name': 'Anna'}).status_code == 201
+    # Read-your-writes: the writer is kept on the primary
+    assert _game_uuids(writer) == []
+    # Other clients as well, while the replica may still lag behind
+    assert _game_uuids(_login(app)) == []
@@ -0,0 +1,90 @@
+import threading
+import time
+
+from sqlalchemy import event
+
+from app import create_app, db, game_actor
+from app.models import Game
+
+
+def test_concurrent_joins_are_serialized(tmp_path, monkeypatch):
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///{}'.format(tmp_path / 'actor.db'),
+        'RUNTIME_DIR': str(tmp_path / 'runtime'),
+        'SECRET_KEY': 'test',
+        'SERVER_NAME': None,
+        'JOURNAL': False,
+    })
+    emits = []
+    monkeypatch.setattr(game_actor.socketio, 'emit', lambda *args, **kwargs: emits.append(args[0]))
+    uuid = app.test_client().post('/api/game', json={'name': 'a'}).get_json()['UUID']
+
+    # set_game_user reads the highest turn_order and writes the next one
+    codes = []
+
+    def join(n):
+        response = app.test_client().post('/api/game/{}/user'.format(uuid),
+                                          json={'name': 'p{}'.format(n)})
+        codes.append(response.status_code)
+
+    threads = [threading.Thread(target=join, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert codes == [200] * 8
+    with app.app_context():
+        orders = [u.turn_order for u in Game.query.filter_by(UUID=uuid).first().users]
+    assert sorted(orders) == list(range(9))
+
+
+def test_queued_commands_share_one_commit_and_broadcast(tmp_path, monkeypatch):
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///{}'.format(tmp_path / 'actor.db'),
+        'RUNTIME_DIR': str(tmp_path / 'runtime'),
+        'SECRET_KEY': 'test',
+        'SERVER_NAME': None,
+        'JOURNAL': False,
+    })
+    emits = []
+    monkeypatch.setattr(game_actor.socketio, 'emit', lambda *args, **kwargs: emits.append(args[0]))
+    uuid = app.test_client().post('/api/game', json={'name': 'a'}).get_json()['UUID']
+
+    # Hold the first batch until the other commands are queued behind it
+    held, release = threading.Event(), threading.Event()
+    run_batch = game_actor._run_batch
+
+    def held_batch(gid, commands):
+        held.set()
+        release.wait(10)
+        run_batch(gid, commands)
+
+    monkeypatch.setattr(game_actor, '_run_batch', held_batch)
+    commits = []
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'commit', lambda conn: commits.append(conn))
+
+    codes = []
+
+    def join(n):
+        response = app.test_client().post('/api/game/{}/user'.format(uuid),
+                                          json={'name': 'p{}'.format(n)})
+        codes.append(response.status_code)
+
+    threads = [threading.Thread(target=join, args=(n,)) for n in range(5)]
+    threads[0].start()
+    assert held.wait(10)
+    for thread in threads[1:]:
+        thread.start()
+    while game_actor._actors[uuid].qsize() < 4:
+        time.sleep(0.01)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert codes == [200] * 5
+    # The first join alone, then the four queued joins together
+    assert len(commits) == 2
+    assert emits == ['reload_game', 'reload_game']
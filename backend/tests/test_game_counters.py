@@ -0,0 +1,120 @@
+import pytest
+
+from app import create_app, db, game_actor, game_counters
+from app.models import Game
+
+
+def test_roll_counters_are_written_in_batches(tmp_path):
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///{}'.format(tmp_path / 'counters.db'),
+        'RUNTIME_DIR': str(tmp_path / 'runtime'),
+        'SECRET_KEY': 'test',
+        'SERVER_NAME': None,
+        'GAME_COUNTER_FLUSH_INTERVAL': 3600,
+        'JOURNAL': False,
+    })
+    client = app.test_client()
+    uuid = client.post('/api/game', json={'name': 'a'}).get_json()['UUID']
+    client.post('/api/game/{}/user'.format(uuid), json={'name': 'b'})
+    client.post('/api/game/{}/start'.format(uuid), json={'ruleset_id': 'classic_13'})
+    mover = client.get('/api/game/' + uuid).get_json()['Move']
+    for _ in range(2):
+        client.post('/api/game/{}/user/{}/dice'.format(uuid, mover),
+                    json={'dice1': True, 'dice2': True, 'dice3': True})
+
+    def counts():
+        with app.app_context():
+            game = Game.query.filter_by(UUID=uuid).first()
+            return game.throw_dice_count, game.refreshed
+
+    started = counts()
+    assert started[0] == 0
+    assert game_counters.flush() == 1
+    assert counts()[0] == 2
+    assert counts()[1] > started[1]
+
+    # At the round end the pending values go into the same commit
+    with app.app_context():
+        game = Game.query.filter_by(UUID=uuid).first()
+        game_counters.count_roll(game, True)
+        game_counters.apply(game)
+        db.session.commit()
+        assert (game.throw_dice_count, game.schockoutcount) == (3, 1)
+    assert game_counters.flush() == 0
+
+
+def test_failed_flush_keeps_the_counts(tmp_path, monkeypatch):
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///{}'.format(tmp_path / 'counters.db'),
+        'RUNTIME_DIR': str(tmp_path / 'runtime'),
+        'SECRET_KEY': 'test',
+        'SERVER_NAME': None,
+        'GAME_COUNTER_FLUSH_INTERVAL': 3600,
+        'JOURNAL': False,
+    })
+    uuid = app.test_client().post('/api/game', json={'name': 'a'}).get_json()['UUID']
+    with app.app_context():
+        game = Game.query.filter_by(UUID=uuid).first()
+        game_counters.count_roll(game, False)
+        game_counters.count_roll(game, True)
+        game_id = game.id
+
+    def broken(*args, **kwargs):
+        raise RuntimeError('database is locked')
+
+    with monkeypatch.context() as patch:
+        patch.setattr(game_counters, '_values', broken)
+        with pytest.raises(RuntimeError):
+            game_counters.flush()
+    with app.app_context():
+        game_counters.count_roll(db.session.get(Game, game_id), False)
+    assert game_counters._pending[game_id]['throws'] == 3
+
+    assert game_counters.flush() == 1
+    with app.app_context():
+        game = db.session.get(Game, game_id)
+        assert (game.throw_dice_count, game.schockoutcount) == (3, 1)
+
+
+def test_rolled_back_round_end_keeps_the_counts(tmp_path):
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///{}'.format(tmp_path / 'counters.db'),
+        'RUNTIME_DIR': str(tmp_path / 'runtime'),
+        'SECRET_KEY': 'test',
+        'SERVER_NAME': None,
+        'GAME_COUNTER_FLUSH_INTERVAL': 3600,
+        'JOURNAL': False,
+    })
+    uuid = app.test_client().post('/api/game', json={'name': 'a'}).get_json()['UUID']
+    with app.app_context():
+        game = Game.query.filter_by(UUID=uuid).first()
+        game_id = game.id
+        # Round end in a savepoint (a game_actor command) that is dropped
+        game_actor._lock_game(db.session, uuid)
+        savepoint = db.session.begin_nested()
+        game_counters.count_roll(game, True)
+        game_counters.apply(game)
+        assert game_id not in game_counters._pending
+        savepoint.rollback()
+        assert game_counters._pending[game_id]['throws'] == 1
+
+        # Released savepoint, outer transaction rolled back
+        savepoint = db.session.begin_nested()
+        game_counters.count_roll(game, False)
+        game_counters.apply(game)
+        savepoint.commit()
+        assert game_id not in game_counters._pending
+        db.session.rollback()
+        assert game_counters._pending[game_id]['throws'] == 2
+
+    # Request ending without a commit
+    with app.app_context():
+        game_counters.apply(db.session.get(Game, game_id))
+    assert game_counters._pending[game_id]['throws'] == 2
+
+    with app.app_context():
+        game = db.session.get(Game, game_id)
+        game_counters.apply(game)
+        db.session.commit()
+        assert (game.throw_dice_count, game.schockoutcount) == (2, 1)
+    assert game_counters.flush() == 0
@@ -0,0 +1,30 @@
+import time
+
+import gevent
+from flask import Flask
+
+from app import hub_monitor
+
+
+def test_hub_monitor_catches_blocking_endpoint():
+    blocking_app = Flask(__name__)
+
+    @blocking_app.route('/block')
+    def block():
+        # time.sleep is not monkey-patched here, so it blocks the hub
+        time.sleep(0.5)
+        return 'done'
+
+    hub_monitor.start(0.1)
+    before = len(hub_monitor.recent_blocks())
+
+    client = blocking_app.test_client()
+    response = gevent.spawn(client.get, '/block').get()
+    assert response.status_code == 200
+    # Let the hub run the callback the monitor thread scheduled
+    gevent.sleep(0.2)
+
+    blocks = hub_monitor.recent_blocks()
+    assert len(blocks) > before
+    assert 'in block' in '\n'.join(blocks[0]['report'])
+    assert 'teleschocken_hub_blocked_total' in hub_monitor.metrics.generate_latest()
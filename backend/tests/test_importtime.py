@@ -0,0 +1,40 @@
+import os
+import subprocess
+import sys
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Cumulative import time budget of the WSGI module (app creation included);
+# about 0.9s on a single slow core
+BUDGET_US = int(os.environ.get('IMPORT_TIME_BUDGET_MS', 3000)) * 1000
+# Only needed by "flask db", the deploy migration or single endpoints
+LAZY_MODULES = ('alembic', 'flask_migrate', 'pytz', 'dateutil')
+
+
+def _importtime(statement, tmp_path):
+    # teleschocken builds the app, which needs a config file
+    config = tmp_path / 'config.py'
+    config.write_text('SECRET_KEY = {!r}\nSQLALCHEMY_DATABASE_URI = {!r}\nRUNTIME_DIR = {!r}\n'.format(
+        'test', 'sqlite:///{}'.format(tmp_path / 'importtime.db'), str(tmp_path / 'runtime')))
+    env = dict(os.environ, TELESCHOCKEN_CONFIG_FILE=str(config))
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', statement],
+        cwd=BACKEND, env=env, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr[-2000:]
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def test_import_time_budget(tmp_path):
+    times = _importtime('import teleschocken', tmp_path)
+    assert times['teleschocken'] < BUDGET_US, \
+        'import teleschocken took {:.0f} ms'.format(times['teleschocken'] / 1000)
+
+
+def test_heavy_modules_load_lazily(tmp_path):
+    times = _importtime('import teleschocken', tmp_path)
+    assert not [m for m in LAZY_MODULES if m in times]
@@ -0,0 +1,73 @@
+from app import create_app, db, journal
+from app.models import Game
+
+
+def test_journal_replays_a_game(tmp_path):
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///{}'.format(tmp_path / 'journal.db'),
+        'RUNTIME_DIR': str(tmp_path / 'runtime'),
+        'SECRET_KEY': 'test',
+        'SERVER_NAME': None,
+        'JOURNAL_SNAPSHOT_EVERY': 5,
+    })
+    client = app.test_client()
+    uuid = client.post('/api/game', json={'name': 'a'}).get_json()['UUID']
+    client.post('/api/game/{}/user'.format(uuid), json={'name': 'b'})
+    client.post('/api/game/{}/start'.format(uuid), json={'ruleset_id': 'classic_13'})
+    mover = client.get('/api/game/' + uuid).get_json()['Move']
+    rolls = [client.post('/api/game/{}/user/{}/dice'.format(uuid, mover),
+                         json={'dice1': True, 'dice2': True, 'dice3': True}).get_json()
+             for _ in range(2)]
+    journal.flush()
+
+    with app.app_context():
+        game_id = Game.query.filter_by(UUID=uuid).first().id
+        actions = [e['action'] for e in journal.entries(game_id)]
+        assert actions[-4:] == ['start', 'roll', 'roll', journal.SNAPSHOT]
+
+        first_roll = journal.replay(game_id, steps=actions.index('roll') + 1)
+        user = first_roll['users'][str(mover)]
+        assert first_roll['action'] == 'roll'
+        assert (user['dice1'], user['dice2'], user['dice3'], user['number_dice']) == \
+            (rolls[0]['dice1'], rolls[0]['dice2'], rolls[0]['dice3'], 1)
+
+        latest = journal.replay(game_id)
+        assert latest['action'] == journal.SNAPSHOT
+        assert latest['users'][str(mover)]['number_dice'] == 2
+        assert latest['game']['status'] == 'STARTED'
+
+
+def test_journal_waits_for_the_outer_commit(tmp_path):
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///{}'.format(tmp_path / 'journal.db'),
+        'RUNTIME_DIR': str(tmp_path / 'runtime'),
+        'SECRET_KEY': 'test',
+        'SERVER_NAME': None,
+    })
+    uuid = app.test_client().post('/api/game', json={'name': 'a'}).get_json()['UUID']
+    journal.flush()
+    with app.app_context():
+        game = Game.query.filter_by(UUID=uuid).first()
+
+        def batch():
+            # Commands of a game_actor batch: released, dropped, released
+            for column, value in (('message', 'first'), ('reveal_votes', '1'),
+                                  ('message', 'second')):
+                savepoint = db.session.begin_nested()
+                setattr(game, column, value)
+                db.session.flush()
+                if column == 'reveal_votes':
+                    savepoint.rollback()
+                else:
+                    savepoint.commit()
+
+        batch()
+        # Nothing is queued before the outer commit, nothing after a rollback
+        assert not journal._queue
+        db.session.rollback()
+        assert not journal._queue
+
+        batch()
+        db.session.commit()
+        journal.flush()
+        assert journal.entries(game.id)[-1]['data'] == '{"g":{"message":"second"}}'
@@ -0,0 +1,37 @@
+import os
+import pstats
+
+import gevent
+
+from app import create_app, profiling
+
+
+def test_profile_covers_only_its_request(tmp_path):
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///{}'.format(tmp_path / 'profiling.db'),
+        'RUNTIME_DIR': str(tmp_path / 'runtime'),
+        'SECRET_KEY': 'test',
+        'SERVER_NAME': None,
+        'JOURNAL': False,
+    })
+
+    @app.route('/waiting')
+    def waiting():
+        gevent.sleep(0.1)
+        return 'ok'
+
+    def other_greenlet():
+        for _ in range(5):
+            sum(range(10000))
+            gevent.sleep(0.01)
+
+    profiling.save_settings({'enabled': True, 'endpoints': ['waiting']})
+    other = gevent.spawn(other_greenlet)
+    assert app.test_client().get('/waiting').status_code == 200
+    other.join()
+
+    profile = profiling.list_profiles()[0]['name']
+    functions = {key[2] for key in pstats.Stats(os.path.join(
+        str(tmp_path / 'runtime'), 'profiles', profile)).stats}
+    assert 'waiting' in functions
+    assert 'other_greenlet' not in functions
@@ -0,0 +1,35 @@
+import collections
+
+from app import rng
+
+
+class _Game(object):
+
+    def __init__(self, id):
+        self.id = id
+
+
+def _play(game_ids):
+    return [(gid, rng.for_game(_Game(gid)).randint(1, 6)) for gid in game_ids]
+
+
+def test_seeded_games_replay_independently():
+    rng.configure(seed='test')
+    try:
+        alone = [d for _, d in _play([1] * 20)]
+        rng.configure(seed='test')
+        # Rolls of other games in between do not change game 1
+        mixed = [d for gid, d in _play([1, 2] * 20) if gid == 1]
+        assert alone == mixed
+        assert alone != [d for _, d in _play([3] * 20)]
+    finally:
+        rng.configure(seed=None)
+
+
+def test_buffered_dice_are_uniform():
+    rng.configure(seed=None, buffer_bytes=64)
+    dice = rng.for_game(_Game(1))
+    counts = collections.Counter(dice.randint(1, 6) for _ in range(60000))
+    assert sorted(counts) == [1, 2, 3, 4, 5, 6]
+    assert all(9000 < n < 11000 for n in counts.values())
+    assert 0 <= dice.random() < 1
@@ -0,0 +1,59 @@
+import os
+import time
+
+from app import create_app, db, stats_cache
+from app.models import Person
+
+
+def test_version_waits_for_the_outer_commit(tmp_path):
+    config = {
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///{}'.format(tmp_path / 'stats.db'),
+        'RUNTIME_DIR': str(tmp_path / 'runtime'),
+        'SECRET_KEY': 'test',
+        'SERVER_NAME': None,
+        'JOURNAL': False,
+    }
+    create_app(config)
+    app = create_app(config)
+    watchers = len(stats_cache._watchers)
+    create_app(config)
+    assert len(stats_cache._watchers) == watchers
+
+    with app.app_context():
+        before = stats_cache.data_version()
+        savepoint = db.session.begin_nested()
+        db.session.add(Person(name='a'))
+        savepoint.commit()
+        # Released savepoint: not committed yet, nothing to invalidate
+        assert stats_cache.data_version() == before
+        savepoint = db.session.begin_nested()
+        db.session.add(Person(name='b'))
+        savepoint.rollback()
+        db.session.commit()
+        assert stats_cache.data_version() != before
+        assert Person.query.count() == 1
+
+
+def test_version_of_other_workers(tmp_path):
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///{}'.format(tmp_path / 'stats.db'),
+        'RUNTIME_DIR': str(tmp_path / 'runtime'),
+        'SECRET_KEY': 'test',
+        'SERVER_NAME': None,
+        'JOURNAL': False,
+        'DATA_VERSION_CHECK_INTERVAL': 0.05,
+    })
+    with app.app_context():
+        assert stats_cache.version_age() == float('inf')
+        own = stats_cache.bump_version()
+        assert stats_cache.data_version() == own
+        assert stats_cache.version_age() < 1
+
+        # Another worker bumps the version
+        other = tmp_path / 'other'
+        other.write_text('other-1')
+        os.replace(other, tmp_path / 'runtime' / 'protokoll_version')
+        deadline = time.time() + 5
+        while stats_cache.data_version() != 'other-1' and time.time() < deadline:
+            time.sleep(0.05)
+        assert stats_cache.data_version() == 'other-1'